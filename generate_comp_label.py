@@ -1,6 +1,8 @@
 import numpy as np
 import json
 import os
+import sys
+from label_io import run_stream_cli
 
 # ランダムな2点間の値を比較し、その結果（記号）と関連情報を新しい辞書として返す関数
 def generate_comparison_and_create_dictionary(dataset): # 関数名を変更
@@ -87,6 +89,11 @@ def load_datasets_from_jsonl(file_path):
     return datasets
 
 if __name__ == "__main__":
+    # 引数を指定した場合はストリーミングモードで処理します（'-' で標準入力・標準出力）
+    # 例: zcat input.jsonl.gz | python generate_comp_label.py - - > output.jsonl
+    if len(sys.argv) > 1:
+        sys.exit(run_stream_cli(generate_comparison_and_create_dictionary, sys.argv[1:], "comparison_output.jsonl"))
+
     input_jsonl_file = "test.jsonl" 
 
     datasets_from_file = load_datasets_from_jsonl(input_jsonl_file)
@@ -1,6 +1,8 @@
 import numpy as np
 import json
 import os
+import sys
+from label_io import run_stream_cli
 
 # 閾値を超える値を検出し、関連情報と共に新しい辞書として返す関数
 def generate_threshold_values_and_create_dictionary(dataset):
@@ -72,6 +74,11 @@ def load_datasets_from_jsonl(file_path):
     return datasets
 
 if __name__ == "__main__":
+    # 引数を指定した場合はストリーミングモードで処理します（'-' で標準入力・標準出力）
+    # 例: zcat input.jsonl.gz | python generate_exceed_label.py - - > output.jsonl
+    if len(sys.argv) > 1:
+        sys.exit(run_stream_cli(generate_threshold_values_and_create_dictionary, sys.argv[1:], "threshold_output.jsonl", ensure_ascii=True))
+
     input_jsonl_file = "test_for_threshold.jsonl"
 
     if not os.path.exists(input_jsonl_file):
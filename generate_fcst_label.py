@@ -1,6 +1,9 @@
 import numpy as np
 import json
 import os
+import sys
+from label_io import run_stream_cli
+from label_timeaxis import get_time_axis
 
 # 線形回帰で次の値を予測し、関連情報と共に新しい辞書として返す関数
 def generate_regression_prediction_and_create_dictionary(dataset): # 関数名を変更
@@ -13,9 +16,14 @@ def generate_regression_prediction_and_create_dictionary(dataset): # 関数名
     years_list = dataset.get('years_column', [])
 
     # 入力データのバリデーションとfloatへの変換を試みる
+    # 年は label_timeaxis で世紀を補った4桁の年にする（"00" の次の "99" が 99 として回帰に入らないように）
     try:
         original_values = np.array(original_values_list, dtype=float)
-        years = np.array(years_list, dtype=float)
+        time_axis = get_time_axis(years_list)
+        if time_axis.all_valid:
+            years = time_axis.years.astype(float)
+        else:
+            years = np.array(years_list, dtype=float)
     except ValueError:
         print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'values' または 'years_column' に数値に変換できない要素が含まれています。")
         return {
@@ -88,6 +96,11 @@ def load_datasets_from_jsonl(file_path):
     return datasets
 
 if __name__ == "__main__":
+    # 引数を指定した場合はストリーミングモードで処理します（'-' で標準入力・標準出力）
+    # 例: zcat input.jsonl.gz | python generate_fcst_label.py - - > output.jsonl
+    if len(sys.argv) > 1:
+        sys.exit(run_stream_cli(generate_regression_prediction_and_create_dictionary, sys.argv[1:], "regression_prediction_output.jsonl"))
+
     input_jsonl_file = "test.jsonl" 
 
     datasets_from_file = load_datasets_from_jsonl(input_jsonl_file)
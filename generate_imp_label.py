@@ -1,6 +1,8 @@
 import numpy as np
 import json
 import os
+import sys
+from label_io import run_stream_cli
 import random 
 import pandas as pd 
 
@@ -82,6 +84,11 @@ def load_datasets_from_jsonl(file_path):
     return datasets
 
 if __name__ == "__main__":
+    # 引数を指定した場合はストリーミングモードで処理します（'-' で標準入力・標準出力）
+    # 例: zcat input.jsonl.gz | python generate_imp_label.py - - > output.jsonl
+    if len(sys.argv) > 1:
+        sys.exit(run_stream_cli(generate_interpolation_and_create_dictionary, sys.argv[1:], "interpolation_output.jsonl", ensure_ascii=True))
+
     input_jsonl_file = "test_for_interpolation.jsonl"
 
     if not os.path.exists(input_jsonl_file):
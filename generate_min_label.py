@@ -1,6 +1,8 @@
 import numpy as np
 import json
 import os 
+import sys
+from label_io import run_stream_cli
 
 def generate_gold_and_create_dictionary(dataset):
     """
@@ -53,6 +55,11 @@ def load_datasets_from_jsonl(file_path):
     return datasets
 
 if __name__ == "__main__":
+    # 引数を指定した場合はストリーミングモードで処理します（'-' で標準入力・標準出力）
+    # 例: zcat input.jsonl.gz | python generate_min_label.py - - > output.jsonl
+    if len(sys.argv) > 1:
+        sys.exit(run_stream_cli(generate_gold_and_create_dictionary, sys.argv[1:], "min_with_gold.jsonl"))
+
     input_jsonl_file = "test.jsonl" 
 
     datasets_from_file = load_datasets_from_jsonl(input_jsonl_file)
@@ -1,6 +1,8 @@
 import numpy as np
 import json
 import os
+import sys
+from label_io import run_stream_cli
 from scipy.signal import find_peaks 
 
 # ピーク値（複数可）を検出し、関連情報と共に新しい辞書として返す関数
@@ -58,6 +60,11 @@ def load_datasets_from_jsonl(file_path):
     return datasets
 
 if __name__ == "__main__":
+    # 引数を指定した場合はストリーミングモードで処理します（'-' で標準入力・標準出力）
+    # 例: zcat input.jsonl.gz | python generate_peak_label.py - - > output.jsonl
+    if len(sys.argv) > 1:
+        sys.exit(run_stream_cli(generate_peaks_and_create_dictionary, sys.argv[1:], "peaks_output.jsonl"))
+
     # ★★★ 入力するJSONLファイル名を指定してください ★★★
     input_jsonl_file = "test.jsonl" 
 
@@ -1,6 +1,8 @@
 import numpy as np
 import json
 import os
+import sys
+from label_io import run_stream_cli
 # import random # np.random を使うので不要です
 
 # 指定範囲内の最大値（RangeMax）を計算し、関連情報と共に新しい辞書として返す関数
@@ -81,6 +83,11 @@ def load_datasets_from_jsonl(file_path):
     return datasets
 
 if __name__ == "__main__":
+    # 引数を指定した場合はストリーミングモードで処理します（'-' で標準入力・標準出力）
+    # 例: zcat input.jsonl.gz | python generate_rangesum_label.py - - > output.jsonl
+    if len(sys.argv) > 1:
+        sys.exit(run_stream_cli(generate_rangemin_and_create_dictionary, sys.argv[1:], "rangemin_output.jsonl"))
+
     # ★★★ 入力するJSONLファイル名を指定してください ★★★
     input_jsonl_file = "test.jsonl" 
 
@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from label_intermediates import generate_labels_memoized
+from label_io import iter_datasets_from_jsonl
+from label_json import ArrayTextCache, dumps
+from label_tasks import TASKS, task_ensure_ascii, task_output_files
+from label_writer import FanOutWriter
+
+# asyncio ベースのサービスからラベル生成を呼び出すための API
+# ファイルの読み書き、JSONの解析・文字列化、ラベル計算はすべて executor 上で行い、
+# イベントループではスケジューリングだけを行います。
+
+
+class EventLoopStallMonitor:
+    """
+    一定間隔で眠るタスクの起床遅れを測り、イベントループが止まった時間を記録します。
+    遅れが stall_threshold_ms を超えた場合は回数を数え、警告を標準エラー出力に出します。
+    """
+
+    def __init__(self, stall_threshold_ms=100.0, interval_ms=10.0, warn=True):
+        self.stall_threshold = stall_threshold_ms / 1000.0
+        self.interval = interval_ms / 1000.0
+        self.warn = warn
+        self.max_lag_ms = 0.0
+        self.stall_count = 0
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = loop.time() - expected
+            self.max_lag_ms = max(self.max_lag_ms, lag * 1000.0)
+            if lag > self.stall_threshold:
+                self.stall_count += 1
+                if self.warn:
+                    print(f"警告: イベントループが {lag * 1000.0:.1f} ms 停止しました。", file=sys.stderr)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {'max_lag_ms': self.max_lag_ms, 'stall_count': self.stall_count}
+
+
+def _label_datasets(task_names, datasets):
+    # executor 上で実行: ラベル計算とJSON文字列化（結果は SeriesRecord のまま label_json で書き出す）
+    cache = ArrayTextCache()
+    return {
+        task_name: ''.join([
+            dumps(result_item, task_ensure_ascii(task_name), cache) + '\n'
+            for result_item in results
+        ])
+        for task_name, results in generate_labels_memoized(task_names, datasets, compact=True).items()
+    }
+
+
+def _label_lines(task_names, lines, first_line_number, source_name):
+    # executor 上で実行: JSONの解析からラベルの文字列化まで
+    datasets = list(iter_datasets_from_jsonl(lines, source_name, first_line_number))
+    return len(datasets), _label_datasets(task_names, datasets)
+
+
+def _read_lines(infile, batch_size):
+    lines = []
+    for line in infile:
+        lines.append(line)
+        if len(lines) >= batch_size:
+            break
+    return lines
+
+
+def _check_tasks(task_names):
+    unknown_tasks = [name for name in task_names if name not in TASKS]
+    if unknown_tasks:
+        raise KeyError(f"未知のタスクです: {unknown_tasks}")
+
+
+async def alabel_stream(datasets, task_names, batch_size=256, max_concurrency=4, executor=None):
+    """
+    データセットの（同期または非同期の）イテラブルを受け取り、batch_size 件ごとに
+    {タスク名: 結果の辞書のリスト} を入力と同じ順序で非同期に返します。
+    同時に計算中のバッチは最大 max_concurrency 個です。
+    """
+    _check_tasks(task_names)
+    loop = asyncio.get_running_loop()
+    pending = collections.deque()
+
+    def run_batch(batch):
+        return generate_labels_memoized(task_names, batch)
+
+    async def batches():
+        batch = []
+        if hasattr(datasets, '__aiter__'):
+            async for dataset in datasets:
+                batch.append(dataset)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        else:
+            for dataset in datasets:
+                batch.append(dataset)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+
+    async for batch in batches():
+        pending.append(loop.run_in_executor(executor, run_batch, batch))
+        if len(pending) >= max_concurrency:
+            yield await pending.popleft()
+    while pending:
+        yield await pending.popleft()
+
+
+async def alabel_file(input_path, task_names, output_dir='.', batch_size=256, max_concurrency=4,
+                      executor=None, fsync_policy='on_close', stall_threshold_ms=100.0):
+    """
+    入力JSONLを非同期に読み込み、各タスクの結果をタスクごとのファイルへ非同期に書き出します。
+    出力は同期版（label_writer.run_tasks_to_files）と同じ内容・順序になります。
+    executor に ProcessPoolExecutor を渡すと、計算を別プロセスで行えます。
+    戻り値は処理件数とイベントループの停止時間の統計を含む辞書です。
+    解析や計算、書き出しで例外が発生した場合は、残りのバッチを取り消してライターを閉じ、
+    途中まで書き出した出力ファイルを削除してから例外を送出します。
+    """
+    _check_tasks(task_names)
+    loop = asyncio.get_running_loop()
+    output_files = {
+        task_name: os.path.join(output_dir, file_name)
+        for task_name, file_name in task_output_files(task_names).items()
+    }
+    monitor = EventLoopStallMonitor(stall_threshold_ms)
+    monitor.start()
+    started = time.perf_counter()
+    processed_count = 0
+
+    # 読み書きは順序を保つために1スレッドで行う
+    io_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='label-async-io')
+    writer = FanOutWriter(fsync_policy=fsync_policy)
+    pending = collections.deque()
+
+    async def write_oldest():
+        count, texts = await pending.popleft()
+        for task_name, text in texts.items():
+            await loop.run_in_executor(io_executor, writer.write, output_files[task_name], text)
+        return count
+
+    completed = False
+    try:
+        infile = await loop.run_in_executor(io_executor, lambda: open(input_path, 'r', encoding='utf-8'))
+        try:
+            next_line_number = 1
+            while True:
+                lines = await loop.run_in_executor(io_executor, _read_lines, infile, batch_size)
+                if not lines:
+                    break
+                pending.append(loop.run_in_executor(
+                    executor, _label_lines, task_names, lines, next_line_number, input_path))
+                next_line_number += len(lines)
+                if len(pending) >= max_concurrency:
+                    processed_count += await write_oldest()
+            while pending:
+                processed_count += await write_oldest()
+        except BaseException:
+            # 失敗した場合は、まだ始まっていないバッチを取り消し、実行中のバッチの結果は捨てる
+            for future in pending:
+                future.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            pending.clear()
+            raise
+        finally:
+            await loop.run_in_executor(io_executor, infile.close)
+        await loop.run_in_executor(io_executor, writer.close)
+        completed = True
+    finally:
+        if not completed:
+            # 途中までの出力は完成したファイルと区別できないため削除する
+            await loop.run_in_executor(io_executor, writer.abort)
+        io_executor.shutdown(wait=False)
+        await monitor.stop()
+
+    return {
+        'processed_count': processed_count,
+        'elapsed_seconds': time.perf_counter() - started,
+        **monitor.stats(),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='asyncio でラベルを生成し、タスクごとのファイルへ書き出します。')
+    parser.add_argument('input')
+    parser.add_argument('--tasks', default=','.join(TASKS))
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--max-concurrency', type=int, default=4)
+    parser.add_argument('--stall-threshold-ms', type=float, default=100.0)
+    args = parser.parse_args()
+
+    stats = asyncio.run(alabel_file(
+        args.input, [name for name in args.tasks.split(',') if name], args.output_dir,
+        batch_size=args.batch_size, max_concurrency=args.max_concurrency,
+        stall_threshold_ms=args.stall_threshold_ms,
+    ))
+    print(json.dumps(stats, ensure_ascii=False), file=sys.stderr)
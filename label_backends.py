@@ -0,0 +1,282 @@
+import os
+import sys
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# 重い計算カーネル（ピーク・谷の検出、移動最大・最小、線形補間）の
+# バックエンドを切り替えるためのレジストリ
+#
+#   'numpy'  : NumPy のベクトル化による参照実装（常に利用可能）
+#   'python' : 高速化用のループ実装をそのまま Python で実行するもの（ループ実装の確認用。遅い）
+#   'numba'  : 同じループ実装を numba.njit でコンパイルしたもの（numba がインストールされている場合のみ）
+#
+# バックエンドは get_kernel() の引数、set_backend()、環境変数 LABEL_KERNEL_BACKEND の順で決まり、
+# 既定（'auto'）は numba があれば 'numba'、なければ 'numpy' です。
+# 指定したバックエンドが利用できない場合は警告を出して 'numpy' を使います。
+#
+# 各カーネルは連結バッファ (buffer, offsets) を受け取り、区間ごとに計算します
+# （label_kernels.concat_values() と同じ形式）。
+
+BACKEND_ENV = 'LABEL_KERNEL_BACKEND'
+
+
+# ---- ピーク・谷の検出 ----
+# scipy.signal.find_peaks(sign * values) の位置（平坦な頂上は中央）と同じ結果を返す。
+# 戻り値は (バッファ全体での位置の配列, 区間ごとの個数の配列)
+
+def _extrema_numpy(buffer, offsets, sign):
+    x = buffer * sign
+    segment_count = offsets.size - 1
+    changes = np.flatnonzero(x[1:] != x[:-1])
+    if changes.size < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(segment_count, dtype=np.int64)
+    left = changes[:-1]
+    right = changes[1:]
+    # 区間 left+1 .. right が同じ値の連続で、左で上昇し右で下降するものが極値
+    is_extremum = (x[left + 1] > x[left]) & (x[right + 1] < x[right])
+    # 左右の隣接点が同じ系列に含まれるものだけを残す
+    same_segment = np.searchsorted(offsets, left, side='right') == np.searchsorted(offsets, right + 1, side='right')
+    keep = is_extremum & same_segment
+    positions = (left[keep] + 1 + right[keep]) // 2
+    counts = np.bincount(np.searchsorted(offsets, positions, side='right') - 1, minlength=segment_count)
+    return positions.astype(np.int64), counts.astype(np.int64)
+
+
+def _extrema_loop(buffer, offsets, sign):
+    # scipy の _local_maxima_1d と同じ走査
+    segment_count = offsets.size - 1
+    positions = np.empty(buffer.size, dtype=np.int64)
+    counts = np.zeros(segment_count, dtype=np.int64)
+    found = 0
+    for segment in range(segment_count):
+        i = offsets[segment] + 1
+        i_max = offsets[segment + 1] - 1
+        while i < i_max:
+            if sign * buffer[i - 1] < sign * buffer[i]:
+                i_ahead = i + 1
+                while i_ahead < i_max and sign * buffer[i_ahead] == sign * buffer[i]:
+                    i_ahead += 1
+                if sign * buffer[i_ahead] < sign * buffer[i]:
+                    positions[found] = (i + i_ahead - 1) // 2
+                    found += 1
+                    counts[segment] += 1
+                    i = i_ahead
+            i += 1
+    return positions[:found], counts
+
+
+# ---- 移動最大・最小 ----
+# 各区間の長さ window の窓（区間内に収まるもの）の最大（最小）値を、区間の順・開始位置の順に返す。
+# 窓に NaN が含まれる場合は NaN（np.max / np.min と同じ）。
+
+def _rolling_extrema_numpy(buffer, offsets, window, use_max):
+    # van Herk / Gil-Werman 法: 長さ window のブロックごとの前方・後方の累積最大から O(n) で求める
+    lengths = np.diff(offsets)
+    counts = np.maximum(lengths - window + 1, 0)
+    total = int(counts.sum())
+    if total == 0:
+        return np.zeros(0)
+    reduce_pair = np.maximum if use_max else np.minimum
+    block_count = -(-buffer.size // window)
+    padded = np.full(block_count * window, -np.inf if use_max else np.inf)
+    padded[:buffer.size] = buffer
+    blocks = padded.reshape(block_count, window)
+    prefix = reduce_pair.accumulate(blocks, axis=1).ravel()
+    suffix = reduce_pair.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    first = np.zeros(counts.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=first[1:])
+    starts = np.repeat(offsets[:-1], counts) + np.arange(total) - np.repeat(first[:-1], counts)
+    return reduce_pair(suffix[starts], prefix[starts + window - 1])
+
+
+def _rolling_extrema_loop(buffer, offsets, window, use_max):
+    # 単調な両端キュー（位置を保持）による O(n) の走査
+    total = 0
+    for segment in range(offsets.size - 1):
+        total += max(offsets[segment + 1] - offsets[segment] - window + 1, 0)
+    result = np.empty(total)
+    queue = np.empty(buffer.size, dtype=np.int64)
+    found = 0
+    for segment in range(offsets.size - 1):
+        start = offsets[segment]
+        head = 0
+        tail = 0
+        last_nan = -1
+        for i in range(start, offsets[segment + 1]):
+            x = buffer[i]
+            if x != x:
+                last_nan = i
+            else:
+                while tail > head and ((buffer[queue[tail - 1]] <= x) if use_max else (buffer[queue[tail - 1]] >= x)):
+                    tail -= 1
+                queue[tail] = i
+                tail += 1
+            if i - start >= window - 1:
+                window_start = i - window + 1
+                while head < tail and queue[head] < window_start:
+                    head += 1
+                result[found] = np.nan if last_nan >= window_start else buffer[queue[head]]
+                found += 1
+    return result
+
+
+# ---- 線形補間 ----
+# pandas.Series.interpolate(method='linear') と同じく、内部の NaN は前後の値から線形に補間し、
+# 末尾の NaN は最後の値で埋め、先頭の NaN はそのまま残す（区間ごと）。
+
+def _interpolate_numpy(buffer, offsets):
+    n = buffer.size
+    index = np.arange(n)
+    valid = ~np.isnan(buffer)
+    previous_valid = np.maximum.accumulate(np.where(valid, index, -1))
+    next_valid = np.minimum.accumulate(np.where(valid, index, n)[::-1])[::-1]
+    segment_start = np.repeat(offsets[:-1], np.diff(offsets))
+    segment_end = np.repeat(offsets[1:], np.diff(offsets))
+    has_previous = previous_valid >= segment_start
+    has_next = next_valid < segment_end
+    result = buffer.copy()
+
+    inner = ~valid & has_previous & has_next
+    p = previous_valid[inner]
+    q = next_valid[inner]
+    slope = (buffer[q] - buffer[p]) / (q - p)
+    result[inner] = slope * (index[inner] - p) + buffer[p]
+
+    trailing = ~valid & has_previous & ~has_next
+    result[trailing] = buffer[previous_valid[trailing]]
+    return result
+
+
+def _interpolate_loop(buffer, offsets):
+    result = buffer.copy()
+    for segment in range(offsets.size - 1):
+        start = offsets[segment]
+        end = offsets[segment + 1]
+        previous = -1
+        i = start
+        while i < end:
+            if buffer[i] == buffer[i]:
+                previous = i
+                i += 1
+                continue
+            following = i
+            while following < end and buffer[following] != buffer[following]:
+                following += 1
+            if previous >= 0:
+                for j in range(i, following):
+                    if following < end:
+                        slope = (buffer[following] - buffer[previous]) / (following - previous)
+                        result[j] = slope * (j - previous) + buffer[previous]
+                    else:
+                        result[j] = buffer[previous]
+            i = following
+    return result
+
+
+# カーネル名 -> {バックエンド名: 実装}（'numba' はループ実装をコンパイルして使う）
+KERNELS = {
+    'extrema': {'numpy': _extrema_numpy, 'python': _extrema_loop},
+    'rolling_extrema': {'numpy': _rolling_extrema_numpy, 'python': _rolling_extrema_loop},
+    'interpolate': {'numpy': _interpolate_numpy, 'python': _interpolate_loop},
+}
+
+_selected_backend = None
+_compiled_kernels = {}
+_warned_backends = set()
+
+
+def available_backends():
+    """
+    この環境で利用できるバックエンド名のリストを返します。
+    """
+    return ['numpy', 'python'] + (['numba'] if numba is not None else [])
+
+
+def set_backend(backend):
+    """
+    get_kernel() の既定のバックエンドを設定します（None で環境変数・自動選択に戻す）。
+    """
+    global _selected_backend
+    if backend is not None and backend not in ('auto', 'numpy', 'python', 'numba'):
+        raise ValueError(f"未知のバックエンドです: '{backend}'")
+    _selected_backend = backend
+
+
+def _resolve_backend(backend):
+    backend = backend or _selected_backend or os.environ.get(BACKEND_ENV) or 'auto'
+    if backend == 'auto':
+        return 'numba' if numba is not None else 'numpy'
+    if backend not in available_backends():
+        if backend not in _warned_backends:
+            _warned_backends.add(backend)
+            print(f"警告: バックエンド '{backend}' は利用できません。'numpy' を使います。", file=sys.stderr)
+        return 'numpy'
+    return backend
+
+
+def get_kernel(kernel_name, backend=None):
+    """
+    カーネルの実装を返します。
+    """
+    if kernel_name not in KERNELS:
+        raise KeyError(f"未知のカーネルです: '{kernel_name}'")
+    backend = _resolve_backend(backend)
+    if backend != 'numba':
+        return KERNELS[kernel_name][backend]
+    function = _compiled_kernels.get(kernel_name)
+    if function is None:
+        function = numba.njit(cache=True)(KERNELS[kernel_name]['python'])
+        _compiled_kernels[kernel_name] = function
+    return function
+
+
+def _kernel_cases(seed=0):
+    # 引き分け、平坦区間、NaN、無限大、短い系列、空の系列を含む確認用の入力
+    rng = np.random.default_rng(seed)
+    lengths = rng.integers(0, 40, 200)
+    lengths[:4] = [0, 1, 2, 3]
+    offsets = np.zeros(lengths.size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    buffer = rng.integers(0, 5, int(offsets[-1])).astype(np.float64)
+    special = rng.random(buffer.size)
+    buffer[special < 0.03] = np.nan
+    buffer[(special >= 0.03) & (special < 0.04)] = np.inf
+    return buffer, offsets
+
+
+def verify_backends(backends=None, seed=0):
+    """
+    各カーネルの出力が 'numpy' の参照実装と一致するかを確認し、一致しなかったものを
+    (カーネル名, バックエンド名, 説明) のリストで返します。
+    """
+    backends = [b for b in (backends or available_backends()) if b != 'numpy']
+    buffer, offsets = _kernel_cases(seed)
+    finite = np.nan_to_num(buffer, nan=1.0, posinf=2.0)
+    interpolation_input = buffer.copy()
+    interpolation_input[np.isinf(interpolation_input)] = 3.0
+
+    calls = {
+        'extrema': [(buffer, offsets, 1.0), (buffer, offsets, -1.0)],
+        'rolling_extrema': [(buffer, offsets, 1, True), (buffer, offsets, 3, True), (buffer, offsets, 5, False),
+                            (finite, offsets, 4, False)],
+        'interpolate': [(interpolation_input, offsets)],
+    }
+    mismatches = []
+    for kernel_name, arguments_list in calls.items():
+        reference = get_kernel(kernel_name, 'numpy')
+        for backend in backends:
+            candidate = get_kernel(kernel_name, backend)
+            for arguments in arguments_list:
+                expected = reference(*arguments)
+                actual = candidate(*arguments)
+                if not isinstance(expected, tuple):
+                    expected, actual = (expected,), (actual,)
+                for e, a in zip(expected, actual):
+                    if not (e.shape == a.shape and np.array_equal(e, a, equal_nan=True)):
+                        mismatches.append((kernel_name, backend, f'引数の形 {[np.shape(v) for v in arguments]}'))
+    return mismatches
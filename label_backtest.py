@@ -0,0 +1,221 @@
+import sys
+
+import numpy as np
+
+from label_io import run_stream_cli
+from label_kernels import concat_values
+from label_numeric import segmented_cumsum
+from label_timeaxis import get_time_axis
+
+# 予測タスク（fcst）のローリング・オリジン型バックテストのラベル
+# 各時点 t（学習に使う先頭の点の数）で先頭 t 点に線形回帰を当てはめ、t+1 .. t+h 点目を予測して
+# 実際の値との誤差を求めます。回帰のモーメント（x, y, x^2, xy の和）は累積和で更新するため、
+# 1系列のすべての時点の当てはめは O(n) で計算できます。年は fcst と同じく label_timeaxis で世紀を補った年とし、
+# 系列は年の昇順（TimeAxis.order）に並べてから当てはめます。NaN や無限大を含む系列は、それ以降の
+# すべての時点のモーメントが NaN になるためエラーとします（TASKS の finite_values で事前に隔離されます）。
+
+DEFAULT_HORIZON = 3
+MIN_TRAIN_SIZE = 2
+
+
+def rolling_origin_forecasts(values, years, offsets, horizon=DEFAULT_HORIZON, min_train_size=MIN_TRAIN_SIZE):
+    """
+    連結バッファ (values, years, offsets) のすべての系列について、ローリング・オリジンの予測をまとめて計算します。
+    戻り値は辞書で、時点ごとの配列（'series'、'origin_positions'、'slopes'、'intercepts'、
+    'target_positions'、'predictions'、'errors'、'valid'。後ろの4つは (時点の数, horizon) の2次元配列）を含みます。
+    origin_positions は学習に使う最後の点のバッファ上の位置です。
+    """
+    lengths = np.diff(offsets)
+    starts = offsets[:-1]
+    # 系列の最初の点を原点にずらしてから和を取る（桁落ちを抑える）
+    x0 = np.repeat(years[starts[lengths > 0]], lengths[lengths > 0])
+    y0 = np.repeat(values[starts[lengths > 0]], lengths[lengths > 0])
+    xs = years - x0
+    ys = values - y0
+    sum_x = segmented_cumsum(xs, offsets)
+    sum_y = segmented_cumsum(ys, offsets)
+    sum_xx = segmented_cumsum(xs * xs, offsets)
+    sum_xy = segmented_cumsum(xs * ys, offsets)
+
+    # 学習点の数 t は min_train_size 以上、かつ予測する点が1つ以上残ること
+    origin_counts = np.maximum(lengths - min_train_size, 0)
+    series = np.repeat(np.arange(lengths.size), origin_counts)
+    first_origin = np.zeros(origin_counts.size + 1, dtype=np.int64)
+    np.cumsum(origin_counts, out=first_origin[1:])
+    train_sizes = np.arange(series.size) - first_origin[series] + min_train_size
+    last_train = starts[series] + train_sizes - 1
+
+    t = train_sizes.astype(np.float64)
+    mean_x = sum_x[last_train] / t
+    mean_y = sum_y[last_train] / t
+    sxx = sum_xx[last_train] - t * mean_x * mean_x
+    sxy = sum_xy[last_train] - t * mean_x * mean_y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slopes = sxy / sxx
+    shifted_intercepts = mean_y - slopes * mean_x
+
+    steps = np.arange(horizon)
+    target_positions = last_train[:, None] + 1 + steps[None, :]
+    valid = target_positions < offsets[1:][series][:, None]
+    target_positions = np.where(valid, target_positions, last_train[:, None])
+    predictions = slopes[:, None] * xs[target_positions] + shifted_intercepts[:, None] + y0[target_positions]
+    errors = predictions - values[target_positions]
+    # 学習点の年がすべて同じ時点（傾きが求まらない）は誤差の集計から除く
+    valid &= np.isfinite(predictions)
+
+    x0_origin = x0[last_train]
+    y0_origin = y0[last_train]
+    return {
+        'series': series,
+        'origin_positions': last_train,
+        'slopes': slopes,
+        'intercepts': y0_origin + shifted_intercepts - slopes * x0_origin,
+        'target_positions': target_positions,
+        'predictions': predictions,
+        'errors': errors,
+        'valid': valid,
+    }
+
+
+def _error_summaries(forecasts, series_count, horizon):
+    # 系列ごと、および予測の何歩先かごとの MAE / RMSE
+    valid = forecasts['valid']
+    errors = np.where(valid, forecasts['errors'], 0.0)
+    series = np.broadcast_to(forecasts['series'][:, None], valid.shape)
+    steps = np.broadcast_to(np.arange(horizon)[None, :], valid.shape)
+    keys = (series * horizon + steps)[valid]
+    absolute = np.abs(errors[valid])
+    squared = errors[valid] ** 2
+    size = series_count * horizon
+    step_counts = np.bincount(keys, minlength=size).reshape(series_count, horizon)
+    step_absolute = np.bincount(keys, weights=absolute, minlength=size).reshape(series_count, horizon)
+    step_squared = np.bincount(keys, weights=squared, minlength=size).reshape(series_count, horizon)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mae = step_absolute.sum(axis=1) / step_counts.sum(axis=1)
+        rmse = np.sqrt(step_squared.sum(axis=1) / step_counts.sum(axis=1))
+        mae_by_step = step_absolute / step_counts
+        rmse_by_step = np.sqrt(step_squared / step_counts)
+    return mae, rmse, mae_by_step, rmse_by_step
+
+
+def _float_or_none(value):
+    return float(value) if np.isfinite(value) else None
+
+
+def _build_results(datasets, values, years, offsets, horizon):
+    forecasts = rolling_origin_forecasts(values, years, offsets, horizon)
+    mae, rmse, mae_by_step, rmse_by_step = _error_summaries(forecasts, len(datasets), horizon)
+    origin_offsets = np.searchsorted(forecasts['series'], np.arange(len(datasets) + 1))
+
+    results = []
+    for i, dataset in enumerate(datasets):
+        origins = slice(origin_offsets[i], origin_offsets[i + 1])
+        valid = forecasts['valid'][origins]
+        target_positions = forecasts['target_positions'][origins]
+        predictions = forecasts['predictions'][origins]
+        results.append({
+            **dataset,
+            'original_values_for_regression': values[offsets[i]:offsets[i + 1]].tolist(),
+            'years_for_regression': years[offsets[i]:offsets[i + 1]].tolist(),
+            'backtest_horizon': horizon,
+            'backtest_origin_years': years[forecasts['origin_positions'][origins]].tolist(),
+            'backtest_slopes': [_float_or_none(v) for v in forecasts['slopes'][origins].tolist()],
+            'backtest_intercepts': [_float_or_none(v) for v in forecasts['intercepts'][origins].tolist()],
+            'backtest_target_years': [years[p[m]].tolist() for p, m in zip(target_positions, valid)],
+            'backtest_predictions': [[_float_or_none(v) for v in p[m].tolist()] for p, m in zip(predictions, valid)],
+            'backtest_mae': _float_or_none(mae[i]),
+            'backtest_rmse': _float_or_none(rmse[i]),
+            'backtest_mae_by_horizon': [_float_or_none(v) for v in mae_by_step[i].tolist()],
+            'backtest_rmse_by_horizon': [_float_or_none(v) for v in rmse_by_step[i].tolist()],
+        })
+    return results
+
+
+def _years_list(dataset):
+    years_list = dataset.get('years_column', [])
+    return years_list if isinstance(years_list, (list, tuple)) else []
+
+
+def _record_error(values, time_axis):
+    # バックテストできない理由（問題がなければ None）
+    if not time_axis.all_valid:
+        return 'Invalid data type in values or years_column.'
+    if len(values) < MIN_TRAIN_SIZE + 1 or len(values) != len(time_axis):
+        return f'Not enough data points for a backtest (requires at least {MIN_TRAIN_SIZE + 1} points with corresponding years) or mismatched lengths.'
+    if not np.all(np.isfinite(values)):
+        return 'Non-finite values (NaN or infinity) cannot be backtested.'
+    return None
+
+
+def _error_result(dataset, error_msg, values=None, years=None):
+    result_item = {**dataset}
+    if values is not None:
+        result_item['original_values_for_regression'] = values.tolist()
+        result_item['years_for_regression'] = years.tolist()
+    result_item['backtest_mae'] = None
+    result_item['backtest_rmse'] = None
+    result_item['regression_error'] = error_msg
+    return result_item
+
+
+def generate_backtest_and_create_dictionary(dataset, horizon=DEFAULT_HORIZON):
+    """
+    'values' と 'years_column' に対してローリング・オリジンのバックテストを行い、
+    時点ごとの予測と MAE / RMSE を元のデータセットの情報と合わせた新しい辞書を作成します。
+    original_values_for_regression と years_for_regression は年の昇順に並べた系列です。
+    """
+    try:
+        values = np.array(dataset.get('values', []), dtype=float)
+    except ValueError:
+        values = None
+    time_axis = get_time_axis(_years_list(dataset))
+    if values is None or not time_axis.all_valid:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'values' または 'years_column' に数値に変換できない要素が含まれています。")
+        return _error_result(dataset, 'Invalid data type in values or years_column.')
+
+    years = time_axis.years.astype(np.float64)
+    error_msg = _record_error(values, time_axis)
+    if error_msg is not None:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}': {error_msg}")
+        return _error_result(dataset, error_msg, values, years)
+
+    order = time_axis.order
+    offsets = np.array([0, len(values)], dtype=np.int64)
+    return _build_results([dataset], values[order], years[order], offsets, horizon)[0]
+
+
+def batch_backtest(datasets, fallback_function):
+    """
+    バッチカーネル: 有効なレコードのバックテストをまとめて計算し、それ以外は fallback_function に任せます。
+    """
+    buffer, value_offsets, candidate_positions = concat_values(datasets)
+    valid_positions = []
+    gather = []
+    year_segments = []
+    for index, position in enumerate(candidate_positions):
+        start, end = value_offsets[index], value_offsets[index + 1]
+        time_axis = get_time_axis(_years_list(datasets[position]))
+        if _record_error(buffer[start:end], time_axis) is None:
+            # 年の昇順に並べ替えた位置で値を取り出す
+            valid_positions.append(position)
+            gather.append(start + time_axis.order)
+            year_segments.append(time_axis.years[time_axis.order])
+
+    results = [None] * len(datasets)
+    if valid_positions:
+        offsets = np.zeros(len(valid_positions) + 1, dtype=np.int64)
+        np.cumsum([segment.size for segment in year_segments], out=offsets[1:])
+        valid_years = np.concatenate(year_segments).astype(np.float64)
+        built = _build_results([datasets[p] for p in valid_positions], buffer[np.concatenate(gather)], valid_years,
+                               offsets, DEFAULT_HORIZON)
+        for position, result_item in zip(valid_positions, built):
+            results[position] = result_item
+    for position, dataset in enumerate(datasets):
+        if results[position] is None:
+            results[position] = fallback_function(dataset)
+    return results
+
+
+if __name__ == "__main__":
+    # 例: python label_backtest.py test.jsonl backtest_output.jsonl
+    sys.exit(run_stream_cli(generate_backtest_and_create_dictionary, sys.argv[1:], "backtest_output.jsonl"))
@@ -0,0 +1,161 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# ラベル生成の各実装の時間とメモリ確保量を比べるためのベンチマーク
+# 合成データ（文字列の数値リストと2桁の年）を作り、ベンチマークごとに比較対象を実行します。
+#
+#   python label_benchmark.py records --records 2000 --length 200
+
+
+def make_synthetic_datasets(record_count, length, seed=0):
+    """
+    ベンチマーク用の合成データセットのリストを作ります。
+    """
+    rng = np.random.default_rng(seed)
+    datasets = []
+    for record_index in range(record_count):
+        values = np.round(rng.normal(100.0, 20.0, length), 1)
+        datasets.append({
+            'id': record_index,
+            'title': f'series {record_index}',
+            'years_column': [f'{year % 100:02d}' for year in range(1950, 1950 + length)],
+            'values': [str(value) for value in values],
+        })
+    return datasets
+
+
+def measure(function, *args):
+    """
+    function(*args) を実行し、(戻り値, 経過秒数, tracemalloc で測ったピークのメモリ量, 戻り値が保持しているメモリ量) を返します。
+    """
+    tracemalloc.start()
+    try:
+        started = time.perf_counter()
+        # 既存のラベル生成関数の警告表示は計測から外す
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = function(*args)
+        elapsed = time.perf_counter() - started
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, elapsed, peak, retained
+
+
+def _print_row(name, elapsed, peak, retained):
+    print(f"{name:<28} {elapsed * 1000.0:10.1f} ms  peak {peak / (1 << 20):9.1f} MiB  retained {retained / (1 << 20):9.1f} MiB")
+
+
+def benchmark_records(datasets, task_names):
+    """
+    タスクごとに {**dataset, ...} の辞書を作る既存の方法と、SeriesRecord を保持して
+    書き出すときにだけ辞書に変換する方法のメモリ確保量を比べます。
+    """
+    from label_intermediates import generate_labels_memoized
+    from label_record import to_output_dict
+    from label_tasks import get_task_function
+
+    def legacy_dicts():
+        return {task_name: [get_task_function(task_name)(dataset) for dataset in datasets]
+                for task_name in task_names}
+
+    def compact_records():
+        return generate_labels_memoized(task_names, datasets, compact=True)
+
+    def serialize(results):
+        return sum(len(json.dumps(to_output_dict(item))) for items in results.values() for item in items)
+
+    legacy, elapsed, peak, retained = measure(legacy_dicts)
+    _print_row('dict per task', elapsed, peak, retained)
+    compact, elapsed, peak, retained = measure(compact_records)
+    _print_row('SeriesRecord', elapsed, peak, retained)
+    _, elapsed, peak, _ = measure(serialize, compact)
+    _print_row('SeriesRecord -> JSON', elapsed, peak, 0)
+    del legacy
+
+
+def benchmark_encode(datasets, task_names):
+    """
+    SeriesRecord を辞書に変換して json.dumps する方法と、label_json で配列を直接
+    （レコード内で共有される配列は1回だけ）文字列化する方法を比べます。
+    """
+    from label_intermediates import generate_labels_memoized
+    from label_json import ArrayTextCache, dumps
+    from label_record import to_output_dict
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = generate_labels_memoized(task_names, datasets, compact=True)
+    records = list(zip(*results.values()))
+
+    def via_tolist():
+        return [json.dumps(to_output_dict(item)) for items in records for item in items]
+
+    def via_label_json():
+        cache = ArrayTextCache()
+        lines = []
+        for items in records:
+            lines.extend(dumps(item, cache=cache) for item in items)
+            cache.clear()
+        return lines
+
+    expected, elapsed, peak, _ = measure(via_tolist)
+    _print_row('tolist + json.dumps', elapsed, peak, 0)
+    encoded, elapsed, peak, _ = measure(via_label_json)
+    _print_row('label_json', elapsed, peak, 0)
+    if encoded != expected:
+        print('エラー: label_json の出力が json.dumps と一致しません。', file=sys.stderr)
+
+
+def benchmark_backends(datasets, task_names):
+    """
+    label_backends の各カーネルを利用可能なすべてのバックエンドで実行して時間を比べ、
+    出力が参照実装（'numpy'）と一致することを確認します。task_names は使いません。
+    """
+    from label_backends import available_backends, get_kernel, verify_backends
+    from label_kernels import concat_values
+
+    buffer, offsets, _ = concat_values(datasets)
+    with_gaps = buffer.copy()
+    with_gaps[::7] = np.nan
+    calls = {
+        'extrema': (buffer, offsets, 1.0),
+        'rolling_extrema': (buffer, offsets, 7, True),
+        'interpolate': (with_gaps, offsets),
+    }
+    for backend in available_backends():
+        for kernel_name, arguments in calls.items():
+            kernel = get_kernel(kernel_name, backend)
+            kernel(*arguments)  # JIT コンパイルを計測から外す
+            _, elapsed, peak, _ = measure(kernel, *arguments)
+            _print_row(f'{kernel_name} [{backend}]', elapsed, peak, 0)
+    for kernel_name, backend, description in verify_backends():
+        print(f"エラー: {kernel_name} の {backend} バックエンドの出力が参照実装と一致しません: {description}", file=sys.stderr)
+
+
+# ベンチマーク名 -> (関数, 既定のタスク)
+BENCHMARKS = {
+    'records': (benchmark_records, 'max,min,sum,ave,peak,dip'),
+    'encode': (benchmark_encode, 'max,min,sum,ave,peak,dip'),
+    'backends': (benchmark_backends, ''),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ラベル生成の実装を比較するベンチマークを実行します。')
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--records', type=int, default=2000)
+    parser.add_argument('--length', type=int, default=200)
+    parser.add_argument('--tasks', default=None, help='カンマ区切りのタスク名（既定はベンチマークごと）')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    benchmark_function, default_tasks = BENCHMARKS[args.benchmark]
+    selected_tasks = [name for name in (args.tasks or default_tasks).split(',') if name]
+    print(f"{args.benchmark}: {args.records} 件 x {args.length} 点, タスク {selected_tasks}", file=sys.stderr)
+    benchmark_function(make_synthetic_datasets(args.records, args.length, args.seed), selected_tasks)
@@ -0,0 +1,246 @@
+import argparse
+import json
+import sys
+
+import numpy as np
+
+from label_io import iter_datasets_from_jsonl, open_jsonl_input, open_jsonl_output
+from label_numeric import decode_dataset_column
+from label_timeaxis import get_time_axis
+
+# 複数の系列（コーパス内の別々のレコード）を比較するラベル
+# 各系列を years_column を解析した時間軸で共通の年の格子に並べ（欠けている年は NaN）、
+# 選んだ系列の組ごとに、両方に値がある年（と指定した期間）について次の量を計算します。
+#
+#   平均の比較     : 各系列の平均と、その比較記号（generate_comp_label.py と同じ '>', '<', '='）
+#   相関係数       : ピアソンの相関係数（共通の年が2未満、または一方の分散が0の場合は None）
+#   最初に上回った年: 系列 A の値が系列 B の値を初めて上回った年（なければ None）
+#
+# 組はブロック単位（BLOCK_ELEMENTS 要素分の行）でまとめて取り出して計算するため、
+# Python で組ごとにループせず、メモリ使用量も組の数によらず一定です。
+
+MIN_OVERLAP = 2
+# 一度に取り出す (組の数 × 年の数) の上限
+BLOCK_ELEMENTS = 1 << 22
+# 組を並べ替えるときの行のブロックの大きさ（同じ行の近くの組をまとめて取り出す）
+SCHEDULE_BLOCK_ROWS = 256
+
+
+class AlignedCorpus:
+    """
+    時間軸で揃えた系列の集まりです。matrix[i, k] は i 番目の系列の years_grid[k] 年の値（なければ NaN）です。
+    同じ年が系列内に複数ある場合は最初に現れる値を使います。
+    """
+
+    def __init__(self, ids, headers, years_grid, matrix):
+        self.ids = ids
+        self.headers = headers
+        self.years_grid = years_grid
+        self.matrix = matrix
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_datasets(cls, datasets):
+        """
+        datasets を揃えます。'values' が空・数値でないもの、years_column が values と対応しないものは除きます。
+        戻り値は (AlignedCorpus, 除いたレコードの id のリスト) です。
+        """
+        buffer, offsets, bad_values = decode_dataset_column(datasets, 'values')
+        kept = []
+        skipped = []
+        for position, dataset in enumerate(datasets):
+            length = offsets[position + 1] - offsets[position]
+            time_axis = get_time_axis(dataset.get('years_column', []))
+            if length == 0 or position in bad_values or len(time_axis) != length or not time_axis.all_valid:
+                skipped.append(dataset.get('id'))
+                continue
+            kept.append((position, time_axis.years))
+
+        years_grid = np.unique(np.concatenate([years for _, years in kept])) if kept else np.zeros(0, dtype=np.int64)
+        matrix = np.full((len(kept), years_grid.size), np.nan)
+        for row, (position, years) in enumerate(kept):
+            columns = np.searchsorted(years_grid, years)
+            # 同じ年が複数ある場合に最初の値が残るよう、逆順に書き込む
+            matrix[row, columns[::-1]] = buffer[offsets[position]:offsets[position + 1]][::-1]
+        ids = [datasets[position].get('id') for position, _ in kept]
+        headers = [datasets[position].get('value_header') for position, _ in kept]
+        return cls(ids, headers, years_grid, matrix), skipped
+
+
+def sample_pairs(num_series, num_pairs, seed=0):
+    """
+    0..num_series-1 から重複のない組 (a, b)（a < b）を num_pairs 個まで乱数で選びます。
+    可能な組の数が num_pairs 以下ならすべての組を返します。戻り値は (a の配列, b の配列) です。
+    """
+    total = num_series * (num_series - 1) // 2
+    if num_pairs >= total:
+        return np.triu_indices(num_series, k=1)
+    rng = np.random.default_rng(seed)
+    chosen = np.zeros(0, dtype=np.int64)
+    while chosen.size < num_pairs:
+        # 組を上三角の通し番号で表し、足りない分だけまとめて引く
+        draws = rng.integers(0, total, 2 * (num_pairs - chosen.size))
+        chosen = np.concatenate([chosen, np.setdiff1d(np.unique(draws), chosen)])
+    chosen = rng.permutation(chosen)[:num_pairs]
+    return _pair_from_index(chosen, num_series)
+
+
+def _pair_from_index(pair_index, num_series):
+    # 上三角の通し番号（(0, 1), (0, 2), ..., (1, 2), ... の順）から (a, b) を求める
+    row_starts = np.arange(num_series) * (2 * num_series - np.arange(num_series) - 1) // 2
+    a = np.searchsorted(row_starts, pair_index, side='right') - 1
+    b = pair_index - row_starts[a] + a + 1
+    return a, b
+
+
+def iter_all_pairs(num_series, chunk_size):
+    """
+    すべての組 (a, b)（a < b）を、最大 chunk_size 個ずつの (a の配列, b の配列) として順に返します。
+    """
+    total = num_series * (num_series - 1) // 2
+    for start in range(0, total, chunk_size):
+        yield _pair_from_index(np.arange(start, min(start + chunk_size, total)), num_series)
+
+
+def schedule_pairs(a, b, block_rows=SCHEDULE_BLOCK_ROWS):
+    """
+    組を (a の行ブロック, b の行ブロック, a, b) の順に並べ替え、同じ行を続けて取り出すようにします。
+    """
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    order = np.lexsort((b, a, b // block_rows, a // block_rows))
+    return a[order], b[order]
+
+
+def pairwise_statistics(matrix, years_grid, a, b, period=None):
+    """
+    組 (a[p], b[p]) ごとの統計量をまとめて計算し、配列の辞書で返します。
+    period=(開始年, 終了年) を指定すると、その期間（両端を含む）の年だけを使います。
+    """
+    rows_a = matrix[a]
+    rows_b = matrix[b]
+    both = np.isfinite(rows_a) & np.isfinite(rows_b)
+    if period is not None:
+        both &= (years_grid >= period[0]) & (years_grid <= period[1])
+    counts = both.sum(axis=1)
+    safe_counts = np.maximum(counts, 1)
+    masked_a = np.where(both, rows_a, 0.0)
+    masked_b = np.where(both, rows_b, 0.0)
+    means_a = masked_a.sum(axis=1) / safe_counts
+    means_b = masked_b.sum(axis=1) / safe_counts
+
+    centered_a = np.where(both, rows_a - means_a[:, None], 0.0)
+    centered_b = np.where(both, rows_b - means_b[:, None], 0.0)
+    covariance = (centered_a * centered_b).sum(axis=1)
+    scale = np.sqrt((centered_a * centered_a).sum(axis=1) * (centered_b * centered_b).sum(axis=1))
+    has_correlation = (counts >= 2) & (scale > 0)
+    correlations = np.where(has_correlation, covariance / np.where(has_correlation, scale, 1.0), np.nan)
+
+    exceeds = both & (rows_a > rows_b)
+    has_exceed = exceeds.any(axis=1)
+    first_exceed = np.where(has_exceed, years_grid[np.argmax(exceeds, axis=1)], -1) if years_grid.size else np.full(a.size, -1)
+
+    return {
+        'both': both,
+        'counts': counts,
+        'means_a': means_a,
+        'means_b': means_b,
+        'correlations': correlations,
+        'has_correlation': has_correlation,
+        'first_exceed_years': first_exceed,
+        'has_exceed': has_exceed,
+    }
+
+
+def _comparison_symbol(left, right):
+    if left > right:
+        return ">"
+    if left < right:
+        return "<"
+    return "="
+
+
+def iter_cross_results(corpus, pair_chunks, period=None, min_overlap=MIN_OVERLAP, block_elements=BLOCK_ELEMENTS):
+    """
+    pair_chunks（(a の配列, b の配列) の反復）の組ごとに比較ラベルの辞書を返します。
+    共通の年が min_overlap 未満の組は出力しません。
+    """
+    pairs_per_block = max(1, block_elements // max(corpus.years_grid.size, 1))
+    for chunk_a, chunk_b in pair_chunks:
+        chunk_a, chunk_b = schedule_pairs(chunk_a, chunk_b)
+        for start in range(0, chunk_a.size, pairs_per_block):
+            a = chunk_a[start:start + pairs_per_block]
+            b = chunk_b[start:start + pairs_per_block]
+            statistics = pairwise_statistics(corpus.matrix, corpus.years_grid, a, b, period)
+            for p in np.flatnonzero(statistics['counts'] >= min_overlap).tolist():
+                row_a, row_b = int(a[p]), int(b[p])
+                columns = np.flatnonzero(statistics['both'][p])
+                mean_a = float(statistics['means_a'][p])
+                mean_b = float(statistics['means_b'][p])
+                yield {
+                    'id': f"{corpus.ids[row_a]}|{corpus.ids[row_b]}",
+                    'series_a_id': corpus.ids[row_a],
+                    'series_b_id': corpus.ids[row_b],
+                    'value_header_a': corpus.headers[row_a],
+                    'value_header_b': corpus.headers[row_b],
+                    'common_years': corpus.years_grid[columns].tolist(),
+                    'values_a': corpus.matrix[row_a, columns].tolist(),
+                    'values_b': corpus.matrix[row_b, columns].tolist(),
+                    'calculated_mean_a': mean_a,
+                    'calculated_mean_b': mean_b,
+                    'calculated_comparison_symbol': _comparison_symbol(mean_a, mean_b),
+                    'calculated_correlation': (float(statistics['correlations'][p])
+                                               if statistics['has_correlation'][p] else None),
+                    'calculated_first_year_a_exceeds_b': (statistics['first_exceed_years'][p].item()
+                                                          if statistics['has_exceed'][p] else None),
+                }
+
+
+def generate_cross_series_labels(datasets, num_pairs=None, seed=0, period=None, min_overlap=MIN_OVERLAP):
+    """
+    datasets の系列の組について比較ラベルを計算し、辞書のリストを返します。
+    num_pairs が None ならすべての組、そうでなければ seed で選んだ num_pairs 個の組を使います。
+    """
+    corpus, _ = AlignedCorpus.from_datasets(datasets)
+    if num_pairs is None:
+        pair_chunks = iter_all_pairs(len(corpus), BLOCK_ELEMENTS)
+    else:
+        pair_chunks = [sample_pairs(len(corpus), num_pairs, seed)]
+    return list(iter_cross_results(corpus, pair_chunks, period, min_overlap))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='コーパス内の系列の組を比較するラベルを生成します。')
+    parser.add_argument('input', help="入力JSONL（'-' で標準入力）")
+    parser.add_argument('output', nargs='?', default='cross_series_output.jsonl', help="出力JSONL（'-' で標準出力）")
+    parser.add_argument('--pairs', type=int, default=1000, help='乱数で選ぶ組の数')
+    parser.add_argument('--all-pairs', action='store_true', help='すべての組を比較する')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--period', type=int, nargs=2, metavar=('START', 'END'), help='比較に使う期間（両端の年を含む）')
+    parser.add_argument('--min-overlap', type=int, default=MIN_OVERLAP)
+    args = parser.parse_args()
+
+    try:
+        with open_jsonl_input(args.input) as input_file:
+            datasets = list(iter_datasets_from_jsonl(input_file, args.input))
+    except FileNotFoundError:
+        print(f"エラー: ファイル '{args.input}' が見つかりません。", file=sys.stderr)
+        sys.exit(1)
+
+    corpus, skipped = AlignedCorpus.from_datasets(datasets)
+    del datasets
+    if skipped:
+        print(f"警告: {len(skipped)} 件のレコードは 'values' が空か、'years_column' を年として揃えられないため除きました。", file=sys.stderr)
+    if args.all_pairs:
+        pair_chunks = iter_all_pairs(len(corpus), BLOCK_ELEMENTS)
+    else:
+        pair_chunks = [sample_pairs(len(corpus), args.pairs, args.seed)]
+
+    count = 0
+    with open_jsonl_output(args.output) as output_file:
+        for result_item in iter_cross_results(corpus, pair_chunks, args.period, args.min_overlap):
+            output_file.write(json.dumps(result_item, ensure_ascii=False) + '\n')
+            count += 1
+    print(f"{len(corpus)} 系列から {count} 組の比較ラベルを '{args.output}' に書き出しました。", file=sys.stderr)
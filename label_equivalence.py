@@ -0,0 +1,473 @@
+import contextlib
+import io
+import json
+import math
+import random
+import sys
+
+import numpy as np
+
+from label_record import to_output_dict
+from label_tasks import TASKS, generate_labels_deterministic, get_seeded_task_function, record_seed, task_ensure_ascii
+
+# 新しい実行経路（バッチカーネル、共有中間データ、事前検証済みバッチ）が
+# 既存の generate_*_label.py の関数と同じ出力を返すかを確かめる差分テスト
+#
+# 同じシード付きのコーパスに対して、既存の関数（レコードごとに label_tasks.record_seed() で乱数を初期化）と
+# 各経路の結果をフィールドごとに比べ（浮動小数点は許容誤差付き）、食い違いごとに
+# 同じ食い違いが再現する最小のレコード（余分なキーと values の要素を削ったもの）を報告します。
+#
+# 既存の関数の既知の癖は出力に含まれる形のまま比べます（rangesum/rangeave の結果が calculated_range_min に
+# 入っていること、exceed/below が values_above_threshold を共有することなど）。
+# 既存の関数が例外で止まる既知の場合（KNOWN_LEGACY_ERRORS）は食い違いとせず、件数だけを数えます。
+# 'serialized' の経路は書き出し側（SeriesRecord を label_json で文字列化したもの）を、既存スクリプトの
+# json.dumps の出力とバイト単位で比べます。
+
+DEFAULT_RTOL = 1e-9
+DEFAULT_ATOL = 1e-12
+# 最小化で試す縮小の回数の上限
+MAX_SHRINK_STEPS = 200
+
+
+def _has_string_years(dataset):
+    years = dataset.get('years_column')
+    try:
+        return isinstance(years, list) and np.array(years).dtype.kind in 'US'
+    except ValueError:
+        return False
+
+
+def _has_non_finite_values(dataset):
+    try:
+        return not np.isfinite(np.array(dataset.get('values', []), dtype=float)).all()
+    except (TypeError, ValueError):
+        return False
+
+
+# 既存の関数が例外で止まることが分かっている場合: タスク名 -> (例外の型名, 条件, 説明)
+# 例外の型と条件（レコードが満たすもの）の両方が一致したときだけ既知の例外とみなします。
+KNOWN_LEGACY_ERRORS = {
+    'maxtime': ('UFuncTypeError', _has_string_years, "NumPy 2 では years_column の文字列の np.max が失敗する"),
+    'mintime': ('UFuncTypeError', _has_string_years, "NumPy 2 では years_column の文字列の np.min が失敗する"),
+    'exceed': ('OverflowError', _has_non_finite_values,
+               "values に NaN や無限大があると np.random.uniform の範囲が不正になり失敗する"),
+    'below': ('OverflowError', _has_non_finite_values,
+              "values に NaN や無限大があると np.random.uniform の範囲が不正になり失敗する"),
+}
+
+
+def is_known_legacy_error(task_name, error_name, dataset):
+    """
+    既存の関数の例外（型名 error_name）が、dataset に対して KNOWN_LEGACY_ERRORS の既知の例外かどうかを返します。
+    """
+    if task_name not in KNOWN_LEGACY_ERRORS:
+        return False
+    expected_name, condition, _ = KNOWN_LEGACY_ERRORS[task_name]
+    return error_name == expected_name and condition(dataset)
+
+
+@contextlib.contextmanager
+def _quiet():
+    # 既存の関数の警告表示（標準出力）を抑える
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def _normalize(value):
+    # 書き出される JSON と同じ形（NumPy のスカラーや配列は Python の値）に揃える
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if isinstance(value, np.ndarray):
+        return _normalize(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _outcome(function):
+    # ('ok', 結果) または ('error', 例外の型名)
+    try:
+        return 'ok', _normalize(to_output_dict(function()))
+    except Exception as error:
+        return 'error', type(error).__name__
+
+
+def run_legacy(task_name, dataset, base_seed=0):
+    """
+    既存のラベル生成関数を1レコードに対して実行します（乱数を使うタスクはレコードごとのシードで初期化）。
+    """
+    def call():
+        if TASKS[task_name].get('randomized'):
+            seed = record_seed(base_seed, task_name, dataset.get('id'))
+            np.random.seed(seed)
+            random.seed(seed)
+        return get_seeded_task_function(task_name, base_seed)(dataset)
+
+    with _quiet():
+        return _outcome(call)
+
+
+def _engine_batch(task_name, datasets, base_seed):
+    return generate_labels_deterministic(task_name, datasets, base_seed)
+
+
+def _engine_memoized(task_name, datasets, base_seed):
+    from label_intermediates import generate_labels_memoized
+
+    return generate_labels_memoized([task_name], datasets, base_seed)[task_name]
+
+
+def _engine_validated(task_name, datasets, base_seed):
+    # 事前検証を通過したレコードだけを TypedBatch として渡し、隔離したレコードは None を返す
+    from label_validation import validate_batch
+
+    report = validate_batch(datasets, [task_name])
+    clean_positions = report.clean_positions(task_name)
+    results = [None] * len(datasets)
+    for position, result_item in zip(clean_positions,
+                                     generate_labels_deterministic(task_name, report.clean_batch(task_name), base_seed)):
+        results[position] = result_item
+    return results
+
+
+def _engine_serialized(task_name, datasets, base_seed):
+    # label_writer などと同じく SeriesRecord のまま label_json で書き出した1行の文字列を返す
+    from label_intermediates import generate_labels_memoized
+    from label_json import dumps
+
+    results = generate_labels_memoized([task_name], datasets, base_seed, compact=True)[task_name]
+    return [dumps(result_item, task_ensure_ascii(task_name)) for result_item in results]
+
+
+# 経路名 -> (タスク名, データセットのリスト, 基本シード) を受け取り結果（辞書、または書き出した文字列）のリストを返す関数
+ENGINES = {
+    'batch': _engine_batch,
+    'memoized': _engine_memoized,
+    'validated': _engine_validated,
+    'serialized': _engine_serialized,
+}
+
+
+def run_engine(engine_name, task_name, datasets, base_seed=0):
+    """
+    経路をバッチ全体に対して実行し、レコードごとの結果 [('ok', 結果) / ('error', 型名) / None] を返します。
+    バッチ全体が例外で止まった場合は1レコードずつ実行し直して、どのレコードの例外かを特定します。
+    書き出した文字列を返す経路の結果は文字列のままです。
+    """
+    engine = ENGINES[engine_name]
+    with _quiet():
+        try:
+            results = engine(task_name, datasets, base_seed)
+            return [None if result_item is None else ('ok', _normalize(to_output_dict(result_item)))
+                    for result_item in results]
+        except Exception:
+            pass
+        outcomes = []
+        for dataset in datasets:
+            outcome = _outcome(lambda: engine(task_name, [dataset], base_seed)[0])
+            outcomes.append(None if outcome == ('ok', None) else outcome)
+        return outcomes
+
+
+def _values_differ(left, right, rtol, atol):
+    if isinstance(left, bool) or isinstance(right, bool):
+        return left is not right
+    if isinstance(left, (int, float)) and isinstance(right, (int, float)):
+        if isinstance(left, float) and isinstance(right, float) and math.isnan(left) and math.isnan(right):
+            return False
+        return not (left == right or abs(left - right) <= atol + rtol * abs(right))
+    if isinstance(left, list) and isinstance(right, list):
+        return len(left) != len(right) or any(_values_differ(a, b, rtol, atol) for a, b in zip(left, right))
+    if isinstance(left, dict) and isinstance(right, dict):
+        return diff_fields(left, right, rtol, atol) != []
+    return type(left) is not type(right) or left != right
+
+
+_MISSING = '<missing>'
+
+
+def diff_fields(expected, actual, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """
+    2つの結果の辞書をフィールドごとに比べ、食い違うフィールド名のリストを返します（キーの有無も比べます）。
+    """
+    fields = []
+    for key in list(expected) + [key for key in actual if key not in expected]:
+        if _values_differ(expected.get(key, _MISSING), actual.get(key, _MISSING), rtol, atol):
+            fields.append(key)
+    return fields
+
+
+def compare_outcomes(task_name, legacy, engine, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL, dataset=None):
+    """
+    既存の関数と経路の結果を比べ、(分類, 食い違うフィールドのリスト) を返します。
+    分類は 'match'、'mismatch'、'same_error'（両方が同じ型の例外で止まった）、
+    'known_quirk'（既存の関数だけが dataset に対する既知の例外で止まった）、
+    'quarantined'（経路が除外し、既存の関数も例外で止まったレコード）、
+    'quarantined_review'（経路が除外したが、既存の関数はラベルを返したレコード。除外が妥当かの確認が必要）です。
+    """
+    legacy_status, legacy_value = legacy
+    if engine is None:
+        return ('quarantined', []) if legacy_status == 'error' else ('quarantined_review', [])
+    engine_status, engine_value = engine
+    if legacy_status == 'error':
+        if engine_status == 'error' and engine_value == legacy_value:
+            return 'same_error', []
+        if dataset is not None and is_known_legacy_error(task_name, legacy_value, dataset):
+            return 'known_quirk', []
+        return 'mismatch', ['<error>']
+    if engine_status == 'error':
+        return 'mismatch', ['<error>']
+    if isinstance(engine_value, str):
+        # 書き出した文字列は既存スクリプトの json.dumps とバイト単位で一致する必要がある
+        expected_text = json.dumps(legacy_value, ensure_ascii=task_ensure_ascii(task_name))
+        return ('match', []) if engine_value == expected_text else ('mismatch', ['<bytes>'])
+    fields = diff_fields(legacy_value, engine_value, rtol, atol)
+    return ('mismatch', fields) if fields else ('match', [])
+
+
+def _still_mismatches(engine_name, task_name, dataset, field, base_seed, rtol, atol):
+    legacy = run_legacy(task_name, dataset, base_seed)
+    engine = run_engine(engine_name, task_name, [dataset], base_seed)[0]
+    category, fields = compare_outcomes(task_name, legacy, engine, rtol, atol, dataset)
+    return category == 'mismatch' and field in fields
+
+
+def minimize_record(engine_name, task_name, dataset, field, base_seed=0, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    """
+    field の食い違いが再現する範囲で、dataset から余分なキーと values/years_column の要素を削ったレコードを返します。
+    id は乱数のシードに使われるため残します。
+    """
+    steps = 0
+
+    def check(candidate):
+        nonlocal steps
+        steps += 1
+        return _still_mismatches(engine_name, task_name, candidate, field, base_seed, rtol, atol)
+
+    current = dict(dataset)
+    for key in [key for key in current if key not in ('id', 'values', 'years_column')]:
+        candidate = {k: v for k, v in current.items() if k != key}
+        if steps < MAX_SHRINK_STEPS and check(candidate):
+            current = candidate
+
+    # values（と同じ位置の years_column）の要素を、大きな塊から順に取り除く
+    values = current.get('values')
+    if not isinstance(values, list):
+        return current
+    chunk = max(1, len(values) // 2)
+    while chunk >= 1 and steps < MAX_SHRINK_STEPS:
+        start = 0
+        removed = False
+        while start < len(current['values']) and steps < MAX_SHRINK_STEPS:
+            candidate = dict(current)
+            candidate['values'] = current['values'][:start] + current['values'][start + chunk:]
+            years = current.get('years_column')
+            if isinstance(years, list) and len(years) == len(current['values']):
+                candidate['years_column'] = years[:start] + years[start + chunk:]
+            if check(candidate):
+                current = candidate
+                removed = True
+            else:
+                start += chunk
+        if not removed:
+            chunk //= 2
+    return current
+
+
+def make_seeded_corpus(record_count, seed=0):
+    """
+    差分テスト用のコーパスを作ります。通常の系列に加えて、平坦な区間、同じ値の系列（大きな値のものを含む）、
+    桁の大きく異なる値（1e17 と 1 など）が混ざった系列、短い系列、空の values、NaN、無限大、
+    数値でない要素、years_column の長さの不一致、str 以外のキーなどを一定の割合で含みます。
+    """
+    rng = np.random.default_rng(seed)
+    datasets = []
+    for record_index in range(record_count):
+        length = int(rng.integers(3, 40))
+        kind = rng.random()
+        if kind < 0.15:
+            values = [str(float(v)) for v in rng.integers(0, 5, length)]  # 平坦な区間と重複
+        elif kind < 0.2:
+            values = ['7.5'] * length
+        elif kind < 0.25:
+            values = [str(v) for v in np.round(rng.normal(50.0, 10.0, int(rng.integers(1, 3))), 1)]
+        elif kind < 0.28:
+            values = []
+        elif kind < 0.36:
+            # 和や平均で桁落ちが起きる系列
+            values = [str(v) for v in rng.choice([1e17, -1e17, 1.0, 3.0, -2.0, 0.5], length)]
+        elif kind < 0.39:
+            values = [str(float(rng.choice([1e17, -3.0e-5, 0.1])))] * length
+        else:
+            values = [str(v) for v in np.round(rng.normal(100.0, 30.0, length), 1)]
+        if values and rng.random() < 0.05:
+            values[int(rng.integers(len(values)))] = 'nan'
+        if values and rng.random() < 0.04:
+            values[int(rng.integers(len(values)))] = str(rng.choice(['inf', '-inf']))
+        if values and rng.random() < 0.03:
+            values[int(rng.integers(len(values)))] = 'n/a'
+        start_year = int(rng.integers(1950, 2020 - len(values) + 1)) if values else 2000
+        years = [f'{year % 100:02d}' for year in range(start_year + len(values) - 1, start_year - 1, -1)]
+        if years and rng.random() < 0.05:
+            years = years[:-1]
+        dataset = {
+            'id': f'eq_{seed}_{record_index}',
+            'value_header': f'series {record_index}',
+            'years_column': years,
+            'values': values,
+        }
+        if record_index % 50 == 49:
+            # API から渡される辞書には str 以外のキーもあり得る（json.dumps はキーを文字列に変換する）
+            dataset.update({2: 'int', 1.5: 'float', True: 'bool', None: 'none', -0.0: 'negative zero'})
+        datasets.append(dataset)
+    return datasets
+
+
+class EquivalenceReport:
+    """
+    (タスク, 経路) ごとの分類の件数と、フィールドごとの食い違いの件数です。
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.field_mismatches = {}
+
+    def add(self, task_name, engine_name, category, fields):
+        key = f'{task_name}/{engine_name}'
+        counts = self.counts.setdefault(key, {'match': 0, 'mismatch': 0, 'same_error': 0, 'known_quirk': 0,
+                                              'quarantined': 0, 'quarantined_review': 0})
+        counts[category] += 1
+        for field in fields:
+            by_field = self.field_mismatches.setdefault(key, {})
+            by_field[field] = by_field.get(field, 0) + 1
+
+    @property
+    def mismatch_count(self):
+        return sum(counts['mismatch'] for counts in self.counts.values())
+
+    @property
+    def review_count(self):
+        return sum(counts['quarantined_review'] for counts in self.counts.values())
+
+    def to_dict(self):
+        return {'counts': self.counts, 'field_mismatches': self.field_mismatches}
+
+
+def _mismatch_view(outcome, fields, task_name):
+    # 食い違いの報告に載せる部分（文字列の比較では書き出した1行全体）
+    status, value = outcome
+    if status != 'ok':
+        return outcome
+    if fields == ['<bytes>']:
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=task_ensure_ascii(task_name))
+    return {field: value.get(field, _MISSING) for field in fields}
+
+
+def check_equivalence(datasets, task_names, engine_names, base_seed=0, batch_size=1024, rtol=DEFAULT_RTOL,
+                      atol=DEFAULT_ATOL, mismatch_file=None, max_reproducers=20):
+    """
+    datasets（反復可能）をバッチごとに各タスク・各経路で実行して既存の関数と比べ、EquivalenceReport を返します。
+    mismatch_file を渡すと、食い違いごとに1行の JSON（最初の max_reproducers 件は最小化したレコード付き）を書き出します。
+    既存の関数がラベルを返したのに経路が除外したレコード（quarantined_review）も、除外の理由コードと共に書き出します。
+    """
+    from label_validation import validate_batch
+
+    report = EquivalenceReport()
+    reproduced = set()
+
+    def run_batch(batch):
+        for task_name in task_names:
+            legacy_outcomes = [run_legacy(task_name, dataset, base_seed) for dataset in batch]
+            for engine_name in engine_names:
+                engine_outcomes = run_engine(engine_name, task_name, batch, base_seed)
+                review_reasons = None
+                for position, (dataset, legacy, engine) in enumerate(zip(batch, legacy_outcomes, engine_outcomes)):
+                    category, fields = compare_outcomes(task_name, legacy, engine, rtol, atol, dataset)
+                    report.add(task_name, engine_name, category, fields)
+                    if mismatch_file is None:
+                        continue
+                    if category == 'quarantined_review':
+                        if review_reasons is None:
+                            review_reasons = validate_batch(batch, [task_name]).reasons
+                        mismatch_file.write(json.dumps({
+                            'task': task_name,
+                            'engine': engine_name,
+                            'id': dataset.get('id'),
+                            'quarantine_reasons': review_reasons.get(position, {}).get(task_name),
+                            'legacy': legacy,
+                            'record': dataset,
+                        }, ensure_ascii=False) + '\n')
+                        continue
+                    if category != 'mismatch':
+                        continue
+                    entry = {
+                        'task': task_name,
+                        'engine': engine_name,
+                        'id': dataset.get('id'),
+                        'fields': fields,
+                        'legacy': _mismatch_view(legacy, fields, task_name),
+                        'engine_result': _mismatch_view(engine, fields, task_name),
+                    }
+                    # 同じ (タスク, 経路, フィールド) の食い違いは最初の1件だけ最小化する
+                    signature = (task_name, engine_name, fields[0])
+                    if len(reproduced) < max_reproducers and signature not in reproduced:
+                        reproduced.add(signature)
+                        entry['reproducer'] = minimize_record(engine_name, task_name, dataset, fields[0],
+                                                              base_seed, rtol, atol)
+                    mismatch_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    batch = []
+    for dataset in datasets:
+        batch.append(dataset)
+        if len(batch) >= batch_size:
+            run_batch(batch)
+            batch = []
+    if batch:
+        run_batch(batch)
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from label_io import iter_datasets_from_jsonl, open_jsonl_input, open_jsonl_output
+
+    parser = argparse.ArgumentParser(description='新しい実行経路と既存の generate_*_label.py の出力を比べます。')
+    parser.add_argument('--input', default=None, help="比べるコーパスのJSONL（省略時はシード付きの合成コーパス）")
+    parser.add_argument('--records', type=int, default=2000, help='合成コーパスのレコード数')
+    parser.add_argument('--seed', type=int, default=0, help='合成コーパスと乱数を使うタスクの基本シード')
+    parser.add_argument('--tasks', default=','.join(TASKS))
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL)
+    parser.add_argument('--atol', type=float, default=DEFAULT_ATOL)
+    parser.add_argument('--mismatches', default='equivalence_mismatches.jsonl', help='食い違いと最小の再現レコードを書き出すJSONL')
+    parser.add_argument('--max-reproducers', type=int, default=20)
+    args = parser.parse_args()
+
+    selected_tasks = [name for name in args.tasks.split(',') if name]
+    selected_engines = [name for name in args.engines.split(',') if name]
+    unknown = [name for name in selected_tasks if name not in TASKS] + [name for name in selected_engines if name not in ENGINES]
+    if unknown:
+        print(f"エラー: 未知のタスクまたは経路です: {unknown}", file=sys.stderr)
+        sys.exit(1)
+
+    with contextlib.ExitStack() as stack:
+        if args.input is not None:
+            infile = stack.enter_context(open_jsonl_input(args.input))
+            corpus = iter_datasets_from_jsonl(infile, args.input)
+        else:
+            corpus = make_seeded_corpus(args.records, args.seed)
+        mismatch_file = stack.enter_context(open_jsonl_output(args.mismatches))
+        equivalence_report = check_equivalence(corpus, selected_tasks, selected_engines, args.seed, args.batch_size,
+                                               args.rtol, args.atol, mismatch_file, args.max_reproducers)
+
+    print(json.dumps(equivalence_report.to_dict(), ensure_ascii=False, indent=2))
+    if equivalence_report.review_count:
+        print(f"警告: 既存の関数はラベルを返したが除外された {equivalence_report.review_count} 件を '{args.mismatches}' に書き出しました。"
+              "除外が妥当か確認してください。", file=sys.stderr)
+    if equivalence_report.mismatch_count:
+        print(f"警告: {equivalence_report.mismatch_count} 件の食い違いを '{args.mismatches}' に書き出しました。", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,217 @@
+import sys
+
+import numpy as np
+
+from label_backends import get_kernel
+from label_io import run_stream_cli
+from label_numeric import TypedBatch, decode_dataset_column, select_segments
+from label_tasks import record_seed
+
+# 複数の欠損（連続した欠損区間を含む）と複数の補間方法に対応した補間タスクのラベル
+# generate_imp_label.py は内部の1点だけを NaN にして pandas の線形補間を使いますが、
+# このモジュールは系列ごとに複数の欠損区間をレコードの id から決まる乱数で選び、
+# 1つの欠損入りの配列から次の方法の gold をバッチ全体でまとめて計算します。
+#
+#   linear     : 前後の観測点を結ぶ線形補間（pandas の interpolate(method='linear') と同じ）
+#   nearest    : 最も近い観測点の値（距離が同じ場合は前の点。pandas の method='nearest' と同じ）
+#   previous   : 直前の観測点の値
+#   polynomial : 前後それぞれ最大2点の観測点を通る3次の多項式（片側に1点しかない場合は次数を下げる）
+
+METHODS = ('linear', 'nearest', 'previous', 'polynomial')
+DEFAULT_NUM_GAPS = 2
+DEFAULT_MAX_GAP_LENGTH = 3
+TASK_NAME = 'gapimp'
+
+
+def sample_gaps(length, rng, num_gaps=DEFAULT_NUM_GAPS, max_gap_length=DEFAULT_MAX_GAP_LENGTH):
+    """
+    長さ length の系列の内部（最初と最後の点を除く）に、重ならず間に観測点が1つ以上残る欠損区間を選び、
+    [(開始位置, 終了位置), ...]（終了位置を含む）を返します。入りきらない場合は区間の数を減らします。
+    """
+    interior = length - 2
+    gap_lengths = rng.integers(1, max_gap_length + 1, num_gaps)
+    while gap_lengths.size > 0 and gap_lengths.sum() + gap_lengths.size - 1 > interior:
+        gap_lengths = gap_lengths[:-1] if gap_lengths.max() == 1 else np.minimum(gap_lengths, gap_lengths.max() - 1)
+    if gap_lengths.size == 0:
+        return []
+    free = interior - int(gap_lengths.sum()) - (gap_lengths.size - 1)
+    shifts = np.sort(rng.integers(0, free + 1, gap_lengths.size))
+    starts = 1 + shifts + np.concatenate(([0], np.cumsum(gap_lengths)[:-1])) + np.arange(gap_lengths.size)
+    return [(int(start), int(start + gap_length - 1)) for start, gap_length in zip(starts, gap_lengths)]
+
+
+def _neighbors(valid, offsets):
+    # 各位置の直前・直後の観測点の位置（同じ系列内にない場合は -1）
+    n = valid.size
+    index = np.arange(n)
+    lengths = np.diff(offsets)
+    segment_start = np.repeat(offsets[:-1], lengths)
+    segment_end = np.repeat(offsets[1:], lengths)
+    previous_valid = np.maximum.accumulate(np.where(valid, index, -1))
+    next_valid = np.minimum.accumulate(np.where(valid, index, n)[::-1])[::-1]
+    previous_valid = np.where(previous_valid >= segment_start, previous_valid, -1)
+    next_valid = np.where(next_valid < segment_end, next_valid, -1)
+    return previous_valid, next_valid, segment_start, segment_end
+
+
+def _polynomial_fill(buffer, masked, previous_valid, next_valid, segment_start, segment_end):
+    # 欠損位置ごとに、前後最大2点ずつの観測点を通る多項式の値をラグランジュ補間で求める
+    targets = np.flatnonzero(masked)
+    p0 = previous_valid[targets]
+    q0 = next_valid[targets]
+    p1 = np.where(p0 - 1 >= segment_start[targets], previous_valid[np.maximum(p0 - 1, 0)], -1)
+    q1 = np.where(q0 + 1 < segment_end[targets], next_valid[np.minimum(q0 + 1, buffer.size - 1)], -1)
+    nodes = np.stack([p1, p0, q0, q1])
+    available = nodes >= 0
+    safe_nodes = np.where(available, nodes, 0)
+    x = targets.astype(np.float64)
+    result = np.zeros(targets.size)
+    for j in range(4):
+        weight = np.ones(targets.size)
+        for k in range(4):
+            if k == j:
+                continue
+            both = available[j] & available[k]
+            factor = (x - safe_nodes[k]) / np.where(both, safe_nodes[j] - safe_nodes[k], 1.0)
+            weight *= np.where(both, factor, 1.0)
+        result += np.where(available[j], weight * buffer[safe_nodes[j]], 0.0)
+    return targets, result
+
+
+def impute_batch(masked_buffer, offsets):
+    """
+    欠損（NaN）入りの連結バッファについて、各方法で補間した値を {方法: 補間後のバッファ} で返します。
+    すべての欠損は系列の内部にあり、前後に観測点があることを前提とします。
+    """
+    masked = np.isnan(masked_buffer)
+    previous_valid, next_valid, segment_start, segment_end = _neighbors(~masked, offsets)
+    targets = np.flatnonzero(masked)
+    p = previous_valid[targets]
+    q = next_valid[targets]
+
+    filled = {'linear': get_kernel('interpolate')(masked_buffer, offsets)}
+    nearest = masked_buffer.copy()
+    nearest[targets] = masked_buffer[np.where(targets - p <= q - targets, p, q)]
+    filled['nearest'] = nearest
+    previous = masked_buffer.copy()
+    previous[targets] = masked_buffer[p]
+    filled['previous'] = previous
+    polynomial = masked_buffer.copy()
+    polynomial_targets, polynomial_values = _polynomial_fill(
+        masked_buffer, masked, previous_valid, next_valid, segment_start, segment_end)
+    polynomial[polynomial_targets] = polynomial_values
+    filled['polynomial'] = polynomial
+    return filled
+
+
+def _display(value):
+    return 'NaN' if value != value else str(value)
+
+
+def _build_results(datasets, buffer, offsets, base_seed, num_gaps, max_gap_length):
+    masked_buffer = buffer.copy()
+    gaps_per_dataset = []
+    for i, dataset in enumerate(datasets):
+        rng = np.random.default_rng(record_seed(base_seed, TASK_NAME, dataset.get('id')))
+        gaps = sample_gaps(int(offsets[i + 1] - offsets[i]), rng, num_gaps, max_gap_length)
+        for start, end in gaps:
+            masked_buffer[offsets[i] + start:offsets[i] + end + 1] = np.nan
+        gaps_per_dataset.append(gaps)
+    filled = impute_batch(masked_buffer, offsets)
+
+    results = []
+    for i, (dataset, gaps) in enumerate(zip(datasets, gaps_per_dataset)):
+        start, end = offsets[i], offsets[i + 1]
+        nan_indices = [index for gap_start, gap_end in gaps for index in range(gap_start, gap_end + 1)]
+        positions = np.array(nan_indices, dtype=np.int64) + start
+        years = np.array(dataset.get('years_column', []))
+        results.append({
+            **dataset,
+            'years_column': years.tolist() if years.size > 0 else dataset.get('years_column', []),
+            'original_values': buffer[start:end].tolist(),
+            'values_with_nan_display': [_display(v) for v in masked_buffer[start:end].tolist()],
+            'nan_indices': nan_indices,
+            'nan_gaps': [[gap_start, gap_end] for gap_start, gap_end in gaps],
+            'gold_interpolated_values': {method: filled[method][positions].tolist() for method in METHODS},
+        })
+    return results
+
+
+def generate_gap_imputation_and_create_dictionary(dataset, base_seed=0, num_gaps=DEFAULT_NUM_GAPS,
+                                                  max_gap_length=DEFAULT_MAX_GAP_LENGTH):
+    """
+    'values' の内部に複数の欠損区間を作り、各補間方法の gold を計算して新しい辞書を作成します。
+    欠損区間はレコードの id と base_seed から決まるため、何度実行しても同じになります。
+    """
+    original_values_list = dataset.get('values', [])
+    if not original_values_list:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' には 'values' キーが存在しないか、空です。補間処理できません。")
+        return {
+            **dataset,
+            'original_values': [],
+            'values_with_nan_display': [],
+            'nan_indices': [],
+            'nan_gaps': [],
+            'gold_interpolated_values': None,
+        }
+
+    original_values = np.array(original_values_list, dtype=float)
+    if len(original_values) < 3:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'values' の要素が3未満です。内部にNaNを挿入して補間できません。")
+        return {
+            **dataset,
+            'original_values': original_values.tolist(),
+            'values_with_nan_display': [str(v) for v in original_values.tolist()],
+            'nan_indices': [],
+            'nan_gaps': [],
+            'gold_interpolated_values': None,
+        }
+
+    if not np.isfinite(original_values).all():
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'values' に NaN または無限大が含まれています。補間の gold を計算できません。")
+        return {
+            **dataset,
+            'original_values': original_values.tolist(),
+            'values_with_nan_display': [_display(v) for v in original_values.tolist()],
+            'nan_indices': [],
+            'nan_gaps': [],
+            'gold_interpolated_values': None,
+        }
+
+    offsets = np.array([0, len(original_values)], dtype=np.int64)
+    return _build_results([dataset], original_values, offsets, base_seed, num_gaps, max_gap_length)[0]
+
+
+def batch_gap_imputation(datasets, fallback_function, base_seed=0):
+    """
+    バッチカーネル: NaN・無限大を含まない3点以上の数値の系列をまとめて処理し、それ以外は fallback_function に任せます。
+    欠損区間は generate_gap_imputation_and_create_dictionary() と同じく、レコードの id と base_seed から決まります。
+    """
+    if isinstance(datasets, TypedBatch):
+        buffer, offsets, bad_values = datasets.buffer, datasets.offsets, {}
+    else:
+        buffer, offsets, bad_values = decode_dataset_column(datasets, 'values')
+    lengths = np.diff(offsets)
+    non_finite_counts = np.zeros(lengths.size, dtype=np.int64)
+    nonempty = lengths > 0
+    non_finite_counts[nonempty] = np.add.reduceat(~np.isfinite(buffer), offsets[:-1][nonempty])
+    valid_positions = [p for p in range(len(datasets))
+                       if p not in bad_values and lengths[p] >= 3 and non_finite_counts[p] == 0]
+
+    results = [None] * len(datasets)
+    if valid_positions:
+        valid_buffer, valid_offsets = select_segments(buffer, offsets, valid_positions)
+        built = _build_results([datasets[p] for p in valid_positions], valid_buffer, valid_offsets,
+                               base_seed, DEFAULT_NUM_GAPS, DEFAULT_MAX_GAP_LENGTH)
+        for position, result_item in zip(valid_positions, built):
+            results[position] = result_item
+    for position, dataset in enumerate(datasets):
+        if results[position] is None:
+            results[position] = fallback_function(dataset)
+    return results
+
+
+if __name__ == "__main__":
+    # 例: python label_imputation.py test.jsonl gap_interpolation_output.jsonl
+    sys.exit(run_stream_cli(generate_gap_imputation_and_create_dictionary, sys.argv[1:],
+                            "gap_interpolation_output.jsonl", ensure_ascii=True))
@@ -0,0 +1,286 @@
+import json
+import math
+import os
+
+from label_numeric import exact_float_units, units_to_float
+from label_timeaxis import get_time_axis
+
+# 追記のみで伸びていく系列のラベル（max/min/sum/ave/peak/dip/fcst）を
+# 全履歴を再計算せずに更新するための状態オブジェクト
+
+
+class IncrementalSeriesState:
+    """
+    1系列分の集計状態を保持し、1点追加するごとにラベルを O(1)（償却）で更新します。
+
+    - sum/ave: 有限の値の正確な和（2^-1074 を単位とする整数）と、NaN・無限大の個数
+    - max/min: 累積の最大値・最小値（NaN が入るとどちらも NaN になり np.max/np.min と一致）
+    - peak/dip: 末尾の「上昇後の平坦区間」だけを保持し、scipy.signal.find_peaks と同じ規則で確定
+    - fcst: Welford 型の逐次更新による最小二乗回帰のモーメント
+
+    max/min/peak/dip は全件再計算と完全に一致します。sum は全件の正確な和を正しく丸めた値
+    （math.fsum と完全に一致）なので、追加の仕方や回数によらず同じ値になります。np.sum（ペアワイズ加算）とは
+    np.sum 自身の丸め誤差の分だけ異なることがあり、NaN・無限大を含む場合は np.sum と同じ値です。
+    fcst は np.polyfit と丸め誤差の範囲（相対誤差 1e-9 程度）で一致します（すべての年が同じ系列も含む）。
+    """
+
+    def __init__(self, series_id=None):
+        self.series_id = series_id
+        self.count = 0
+        self.last_value = None
+        self.exact_sum = 0
+        self.positive_infinities = 0
+        self.negative_infinities = 0
+        self.nan_count = 0
+        self.max = None
+        self.min = None
+        # ピーク・ディップ候補（末尾の平坦区間の開始インデックス、値は last_value と同じ）
+        self.peak_candidate_start = None
+        self.dip_candidate_start = None
+        self.peak_indices = []
+        self.peak_values = []
+        self.dip_indices = []
+        self.dip_values = []
+        # 回帰用のモーメント（年は float に変換して扱う）
+        self.regression_count = 0
+        self.mean_year = 0.0
+        self.mean_value = 0.0
+        self.comoment_year_year = 0.0
+        self.comoment_year_value = 0.0
+        self.max_year = None
+
+    def append(self, value, year=None):
+        """
+        系列の末尾に1点追加します。year を省略した点は回帰（fcst）には使われません。
+        """
+        value = float(value)
+        index = self.count
+
+        # 累積和（有限の値は正確に足し、NaN・無限大は個数だけ数える）
+        if math.isfinite(value):
+            self.exact_sum += exact_float_units((value,))
+        elif math.isnan(value):
+            self.nan_count += 1
+        elif value > 0:
+            self.positive_infinities += 1
+        else:
+            self.negative_infinities += 1
+
+        # 最大値・最小値
+        if self.max is None:
+            self.max = value
+            self.min = value
+        elif math.isnan(value) or math.isnan(self.max):
+            self.max = math.nan
+            self.min = math.nan
+        else:
+            if value > self.max:
+                self.max = value
+            if value < self.min:
+                self.min = value
+
+        # ピーク・ディップ（末尾チェック）
+        if self.last_value is not None:
+            self.peak_candidate_start = self._update_extremum(
+                self.peak_candidate_start, self.last_value, value, index,
+                self.peak_indices, self.peak_values, rising=self.last_value < value,
+                falling=value < self.last_value,
+            )
+            self.dip_candidate_start = self._update_extremum(
+                self.dip_candidate_start, self.last_value, value, index,
+                self.dip_indices, self.dip_values, rising=value < self.last_value,
+                falling=self.last_value < value,
+            )
+
+        # 回帰のモーメント
+        if year is not None:
+            year = float(year)
+            self.regression_count += 1
+            delta_year = year - self.mean_year
+            self.mean_year += delta_year / self.regression_count
+            self.mean_value += (value - self.mean_value) / self.regression_count
+            self.comoment_year_year += delta_year * (year - self.mean_year)
+            self.comoment_year_value += delta_year * (value - self.mean_value)
+            if self.max_year is None or year > self.max_year:
+                self.max_year = year
+
+        self.last_value = value
+        self.count += 1
+
+    @property
+    def sum(self):
+        """
+        これまでに追加した値の和（np.sum と同じく、NaN か正負の無限大の両方を含めば NaN）。
+        """
+        if self.nan_count or (self.positive_infinities and self.negative_infinities):
+            return math.nan
+        if self.positive_infinities:
+            return math.inf
+        if self.negative_infinities:
+            return -math.inf
+        return units_to_float(self.exact_sum)
+
+    @staticmethod
+    def _update_extremum(candidate_start, previous, value, index, indices, values, rising, falling):
+        # find_peaks と同じく、上昇の直後から始まる平坦区間が下降で終わった場合のみ確定する。
+        # 平坦区間の中央（切り捨て）をインデックスとする。
+        if candidate_start is not None:
+            if value == previous:
+                return candidate_start
+            if falling:
+                indices.append((candidate_start + index - 1) // 2)
+                values.append(previous)
+        return index if rising else None
+
+    def extend(self, values, years=None):
+        """
+        複数の点を順に追加します。
+        """
+        if years is None:
+            for value in values:
+                self.append(value)
+        else:
+            for value, year in zip(values, years):
+                self.append(value, year)
+
+    def labels(self):
+        """
+        現在の状態から各タスクのラベルを返します（各 generate_*_label.py と同じキー名）。
+        """
+        if self.count == 0:
+            return {
+                'max': None, 'min': None, 'sum': None, 'ave': None,
+                'peak': [], 'dip': [], 'fcst': self._regression_labels(),
+            }
+        total = self.sum
+        return {
+            'max': self.max,
+            'min': self.min,
+            'sum': total,
+            'ave': total / self.count,
+            'peak': list(self.peak_values),
+            'dip': list(self.dip_values),
+            'fcst': self._regression_labels(),
+        }
+
+    def _regression_labels(self):
+        if self.regression_count < 2:
+            return {
+                'calculated_next_value_regression': None,
+                'next_year_for_prediction': None,
+                'regression_error': 'Not enough data points for linear regression (requires at least 2 points with corresponding years) or mismatched lengths.',
+            }
+        if self.comoment_year_year == 0:
+            # すべての年が同じ場合も np.polyfit と揃える。年が 0 なら np.polyfit は失敗し、
+            # それ以外では列を正規化した最小ノルム解（傾き = 平均 / (2 * 年)、切片 = 平均 / 2）を返す
+            if self.mean_year == 0:
+                return {
+                    'calculated_next_value_regression': None,
+                    'next_year_for_prediction': None,
+                    'regression_error': 'Failed to fit linear regression model: SVD did not converge in Linear Least Squares',
+                }
+            slope = self.mean_value / (2.0 * self.mean_year)
+            intercept = self.mean_value / 2.0
+        else:
+            slope = self.comoment_year_value / self.comoment_year_year
+            intercept = self.mean_value - slope * self.mean_year
+        next_year = self.max_year + 1
+        return {
+            'calculated_next_value_regression': slope * next_year + intercept,
+            'next_year_for_prediction': next_year,
+            'regression_slope': slope,
+            'regression_intercept': intercept,
+        }
+
+    def to_dict(self):
+        """
+        JSONに保存できる辞書に変換します。
+        """
+        state_dict = {key: getattr(self, key) for key in _STATE_FIELDS}
+        # 正確な和は桁数が多いため文字列で保存する
+        state_dict['exact_sum'] = str(self.exact_sum)
+        return state_dict
+
+    @classmethod
+    def from_dict(cls, state_dict):
+        """
+        to_dict() で保存した辞書から状態を復元します。
+        """
+        state = cls()
+        for key in _STATE_FIELDS:
+            value = state_dict.get(key, getattr(state, key))
+            setattr(state, key, list(value) if isinstance(value, list) else value)
+        state.exact_sum = int(state.exact_sum)
+        if 'exact_sum' not in state_dict and 'sum' in state_dict:
+            # 補償付き加算の累積和（sum, sum_compensation）で保存した古い状態
+            state._restore_legacy_sum(state_dict['sum'], state_dict.get('sum_compensation', 0.0))
+        return state
+
+    def _restore_legacy_sum(self, total, compensation):
+        if math.isnan(total):
+            self.nan_count = 1
+        elif math.isinf(total):
+            if total > 0:
+                self.positive_infinities = 1
+            else:
+                self.negative_infinities = 1
+        else:
+            self.exact_sum = exact_float_units([total] + ([compensation] if math.isfinite(compensation) else []))
+
+
+_STATE_FIELDS = [
+    'series_id', 'count', 'last_value', 'exact_sum', 'positive_infinities', 'negative_infinities', 'nan_count',
+    'max', 'min',
+    'peak_candidate_start', 'dip_candidate_start',
+    'peak_indices', 'peak_values', 'dip_indices', 'dip_values',
+    'regression_count', 'mean_year', 'mean_value',
+    'comoment_year_year', 'comoment_year_value', 'max_year',
+]
+
+
+def build_state_from_dataset(dataset):
+    """
+    既存のデータセット（'values' と任意の 'years_column'）から状態を作ります。
+    years_column の長さが values と異なる場合、年は回帰に使いません（fcst と同じ扱い）。
+    """
+    values = dataset.get('values', [])
+    years = dataset.get('years_column', [])
+    if years and len(years) == len(values):
+        # fcst と同じく、2桁の年は世紀を補った年として回帰に使う
+        time_axis = get_time_axis(years)
+        if time_axis.all_valid:
+            years = time_axis.years.tolist()
+    state = IncrementalSeriesState(dataset.get('id'))
+    try:
+        state.extend(values, years if years and len(years) == len(values) else None)
+    except ValueError:
+        # 年が数値に変換できない場合は年なしで作り直す
+        state = IncrementalSeriesState(dataset.get('id'))
+        state.extend(values)
+    return state
+
+
+def save_states_to_jsonl(states, file_path):
+    """
+    複数系列の状態を1行1系列のJSONLとして保存します。
+    """
+    temporary_path = file_path + '.tmp'
+    with open(temporary_path, 'w', encoding='utf-8') as outfile:
+        for state in states:
+            outfile.write(json.dumps(state.to_dict(), ensure_ascii=False) + '\n')
+    os.replace(temporary_path, file_path)
+
+
+def load_states_from_jsonl(file_path):
+    """
+    save_states_to_jsonl() で保存した状態を {series_id: 状態} の辞書として読み込みます。
+    """
+    states = {}
+    if not os.path.exists(file_path):
+        return states
+    with open(file_path, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            if line.strip():
+                state = IncrementalSeriesState.from_dict(json.loads(line))
+                states[state.series_id] = state
+    return states
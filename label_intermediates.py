@@ -0,0 +1,374 @@
+import random
+
+import numpy as np
+
+from label_numeric import TypedBatch, decode_dataset_column
+from label_record import DisplayArray, SeriesRecord, to_output_dict
+from label_tasks import TASKS, generate_labels, generate_labels_deterministic, get_seeded_task_function, record_seed
+from label_threshold import SortedBatchIndex, mask_answer
+from label_timeaxis import get_time_axis
+
+# 複数タスクで共通する中間データ（昇順の並び、累積和、1階差分、時間軸、極値など）を
+# レコードごとに1回だけ計算して共有するためのモジュール
+# 各タスクが必要とする中間データは label_tasks.TASKS の 'requires' で宣言します。
+# values はバッチ全体でまとめて変換したもの（label_numeric）を各レコードのキャッシュに入れて使い、
+# レコードごとに解析し直しません。
+
+
+def _compute_values(context):
+    return np.array(context.dataset['values'], dtype=float)
+
+
+def _compute_years(context):
+    return np.array(context.dataset.get('years_column', []))
+
+
+def _compute_time_axis(context):
+    return get_time_axis(context.dataset.get('years_column', []))
+
+
+def _compute_extremes(context):
+    values = context.get('values')
+    return {
+        'max': np.max(values),
+        'min': np.min(values),
+        'argmax': int(np.argmax(values)),
+        'argmin': int(np.argmin(values)),
+    }
+
+
+def _compute_sorted_order(context):
+    return SortedBatchIndex.from_values(context.get('values'))
+
+
+def _compute_first_differences(context):
+    return np.diff(context.get('values'))
+
+
+# 中間データ名 -> (依存する中間データ, 計算関数)
+INTERMEDIATES = {
+    'values': ((), _compute_values),
+    'years': ((), _compute_years),
+    'time_axis': ((), _compute_time_axis),
+    'extremes': (('values',), _compute_extremes),
+    'sorted_order': (('values',), _compute_sorted_order),
+    'first_differences': (('values',), _compute_first_differences),
+}
+
+
+def intermediate_closure(names):
+    """
+    中間データ名のリストに、それらが依存する中間データを加えた集合を返します。
+    """
+    closure = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name not in closure:
+            closure.add(name)
+            stack.extend(INTERMEDIATES[name][0])
+    return closure
+
+
+class SeriesContext:
+    """
+    1レコード分の中間データのキャッシュです。get() は中間データを初回だけ計算し、
+    release() で不要になった中間データを解放します。compute_counts には計算回数が記録されます。
+    """
+
+    __slots__ = ('dataset', '_cache', 'compute_counts')
+
+    def __init__(self, dataset, values=None):
+        self.dataset = dataset
+        self._cache = {} if values is None else {'values': values}
+        self.compute_counts = {}
+
+    def get(self, name):
+        if name not in self._cache:
+            self._cache[name] = INTERMEDIATES[name][1](self)
+            self.compute_counts[name] = self.compute_counts.get(name, 0) + 1
+        return self._cache[name]
+
+    def release(self, name):
+        self._cache.pop(name, None)
+
+    def cached_names(self):
+        return set(self._cache)
+
+
+def _record(context, labels, with_years=True):
+    # 出力の辞書は書き出すときに SeriesRecord.to_dict() で作る
+    years = context.get('years') if with_years else None
+    return SeriesRecord(context.dataset, context.get('values'), years, labels)
+
+
+def _gold(context, calculated_gold):
+    return _record(context, {'calculated_gold_value': calculated_gold})
+
+
+def _max(context):
+    return _gold(context, context.get('extremes')['max'])
+
+
+def _min(context):
+    return _gold(context, context.get('extremes')['min'])
+
+
+def _sum(context):
+    # np.sum（ペアワイズ加算）と一致させるため累積和は使わない
+    return _gold(context, np.sum(context.get('values')))
+
+
+def _ave(context):
+    return _gold(context, np.mean(context.get('values')))
+
+
+def _time_of_extreme(context, key):
+    time_axis = context.get('time_axis')
+    values = context.get('values')
+    if len(time_axis) != values.size or not time_axis.all_valid:
+        return None
+    index = context.get('extremes')[key]
+    return _record(context, {
+        'calculated_gold_value': time_axis.year_at(index),
+        'calculated_gold_index': index,
+    }, with_years=False)
+
+
+def _argmaxtime(context):
+    return _time_of_extreme(context, 'argmax')
+
+
+def _argmintime(context):
+    return _time_of_extreme(context, 'argmin')
+
+
+def _extrema_from_differences(differences, values, sign):
+    # 1階差分の符号から、平坦区間を含めて scipy.signal.find_peaks と同じ極値を求める
+    differences = differences * sign
+    changes = np.flatnonzero(differences != 0)
+    if changes.size < 2:
+        return []
+    # 区間 (changes[k] + 1 .. changes[k + 1]) が平坦区間で、左が上昇・右が下降なら極値
+    rising = differences[changes[:-1]] > 0
+    falling = differences[changes[1:]] < 0
+    is_extremum = rising & falling
+    left_edges = changes[:-1][is_extremum] + 1
+    right_edges = changes[1:][is_extremum]
+    return values[(left_edges + right_edges) // 2].tolist()
+
+
+def _peak(context):
+    return _record(context, {
+        'calculated_peak_values': _extrema_from_differences(
+            context.get('first_differences'), context.get('values'), 1),
+    })
+
+
+def _dip(context):
+    return _record(context, {
+        'calculated_values': _extrema_from_differences(
+            context.get('first_differences'), context.get('values'), -1),
+    })
+
+
+def _threshold(context, mode):
+    values = context.get('values')
+    if np.isnan(values).any():
+        return None
+    # 閾値は1つだけなので、昇順の索引（sorted_order）は作らずに比較の O(n) で答える
+    extremes = context.get('extremes')
+    min_val = extremes['min']
+    max_val = extremes['max']
+    if min_val == max_val:
+        threshold_val = round(min_val, 1)
+    else:
+        threshold_val = round(np.random.uniform(min_val, max_val), 1)
+    answer = mask_answer(values, threshold_val, mode)
+    return _record(context, {
+        'threshold_value': threshold_val,
+        'values_above_threshold': answer['values'].tolist(),
+    })
+
+
+def _exceed(context):
+    return _threshold(context, 'exceed')
+
+
+def _below(context):
+    return _threshold(context, 'below')
+
+
+def _range(context, result_key, reduce_range):
+    values = context.get('values')
+    if values.size < 2:
+        return None
+    start_index = np.random.randint(0, len(values) - 1)
+    end_index = np.random.randint(start_index + 1, len(values))
+    return _record(context, {
+        result_key: reduce_range(context, start_index, end_index),
+        'range_start_index': int(start_index),
+        'range_end_index': int(end_index),
+    })
+
+
+def _rangemax(context):
+    return _range(context, 'calculated_range_max',
+                  lambda c, s, e: np.max(c.get('values')[s:e + 1]))
+
+
+def _rangemin(context):
+    return _range(context, 'calculated_range_min',
+                  lambda c, s, e: np.min(c.get('values')[s:e + 1]))
+
+
+def _range_total(context, start_index, end_index):
+    # 累積和の差は大きさの異なる値（1e17 と 1 など）で桁落ちするため、既存スクリプトと同じく範囲を直接足す
+    return np.sum(context.get('values')[start_index:end_index + 1])
+
+
+def _rangesum(context):
+    return _range(context, 'calculated_range_min', _range_total)
+
+
+def _rangeave(context):
+    return _range(context, 'calculated_range_min',
+                  lambda c, s, e: _range_total(c, s, e) / (e + 1 - s))
+
+
+def _imp(context):
+    # generate_imp_label と同じく random.randint で位置を選び、pandas の線形補間と同じ np.interp で補間する。
+    # 他に NaN・無限大がある系列は補間に使う点が変わるため、元の関数に任せる
+    values = context.get('values')
+    if values.size < 3 or not np.isfinite(values).all():
+        return None
+    nan_index = random.randint(1, values.size - 2)
+    values_with_nan = values.copy()
+    values_with_nan[nan_index] = np.nan
+    gold = np.interp(nan_index, [nan_index - 1, nan_index + 1], [values[nan_index - 1], values[nan_index + 1]])
+    # values は入力のまま出力する（既存スクリプトは original_values に変換後の値を入れる）
+    return SeriesRecord(context.dataset, None, context.get('years'), {
+        'original_values': values,
+        'values_with_nan_display': DisplayArray(values_with_nan),
+        'nan_index': nan_index,
+        'gold_interpolated_value': float(gold),
+    })
+
+
+# タスク名 -> 中間データを使う実装（None を返した場合は元のラベル生成関数に任せる）
+CONTEXT_TASKS = {
+    'max': _max,
+    'min': _min,
+    'sum': _sum,
+    'ave': _ave,
+    'argmaxtime': _argmaxtime,
+    'argmintime': _argmintime,
+    'peak': _peak,
+    'dip': _dip,
+    'exceed': _exceed,
+    'below': _below,
+    'rangemax': _rangemax,
+    'rangemin': _rangemin,
+    'rangesum': _rangesum,
+    'rangeave': _rangeave,
+    'imp': _imp,
+}
+
+
+def plan_releases(task_names):
+    """
+    各タスクの実行後に解放してよい中間データを {タスクの位置: [中間データ名, ...]} で返します。
+    中間データは、それを（依存関係を含めて）必要とする最後のタスクの直後に解放されます。
+    """
+    last_use = {}
+    for position, task_name in enumerate(task_names):
+        requires = TASKS[task_name].get('requires', ()) if task_name in CONTEXT_TASKS else ()
+        for name in intermediate_closure(requires):
+            last_use[name] = position
+    releases = {}
+    for name, position in last_use.items():
+        releases.setdefault(position, []).append(name)
+    return releases
+
+
+def _decode_values(datasets):
+    # バッチ全体の values をまとめて変換し、レコードごとの配列（使えないレコードは None）のリストを返す。
+    # 空のもの、数値に変換できない要素を含むものは元のラベル生成関数に任せる
+    if isinstance(datasets, TypedBatch):
+        buffer, offsets, bad_values = datasets.buffer, datasets.offsets, {}
+    else:
+        buffer, offsets, bad_values = decode_dataset_column(datasets, 'values')
+    return [
+        buffer[offsets[position]:offsets[position + 1]]
+        if offsets[position + 1] > offsets[position] and position not in bad_values else None
+        for position in range(len(datasets))
+    ]
+
+
+def run_tasks_on_dataset(dataset, task_names, base_seed=None, releases=None, compact=False, values=None):
+    """
+    1レコードに対して複数のタスクを実行し、{タスク名: 結果の辞書} を返します。
+    中間データはこのレコードの処理中だけ保持され、不要になった時点で解放されます。
+    base_seed を指定すると、乱数を使うタスクは label_tasks.generate_labels_deterministic() と同じシードで計算します。
+    compact=True の場合、中間データを使うタスクの結果は辞書に変換せず SeriesRecord のまま返します。
+    values に変換済みの値の配列を渡すと、'values' を解析し直さずに使います（None なら元のラベル生成関数に任せる）。
+    """
+    if releases is None:
+        releases = plan_releases(task_names)
+    if values is None and 'values' in dataset:
+        values = _decode_values([dataset])[0]
+    context = SeriesContext(dataset, values)
+    results = {}
+    for position, task_name in enumerate(task_names):
+        if base_seed is not None and TASKS[task_name].get('randomized'):
+            seed = record_seed(base_seed, task_name, dataset.get('id'))
+            np.random.seed(seed)
+            random.seed(seed)
+        context_function = CONTEXT_TASKS.get(task_name)
+        result_item = context_function(context) if values is not None and context_function is not None else None
+        if result_item is None:
+            result_item = get_seeded_task_function(task_name, base_seed)(dataset)
+        results[task_name] = result_item if compact else to_output_dict(result_item)
+        for name in releases.get(position, ()):
+            context.release(name)
+    return results
+
+
+def generate_labels_memoized(task_names, datasets, base_seed=None, compact=False, report=None):
+    """
+    複数のレコードに対して複数のタスクを実行し、{タスク名: 結果の辞書のリスト} を返します。
+    中間データを使うタスク（CONTEXT_TASKS）はレコードごとにまとめて実行し、
+    それ以外のタスクはバッチ全体を label_tasks のバッチカーネルに渡します。
+    report（label_validation.ValidationReport）を渡すと、各タスクは検証を通過したレコードだけを処理し、
+    変換済みの values をそのまま使います（結果のリストは通過したレコードの順）。
+    """
+    results = {task_name: [] for task_name in task_names}
+    context_tasks = [task_name for task_name in task_names if task_name in CONTEXT_TASKS]
+    if context_tasks:
+        if report is not None:
+            decoded = [report.buffer[report.offsets[position]:report.offsets[position + 1]]
+                       for position in range(len(datasets))]
+            clean = {task_name: set(report.clean_positions(task_name)) for task_name in context_tasks}
+        else:
+            decoded = _decode_values(datasets)
+        plans = {}
+        for position, dataset in enumerate(datasets):
+            record_tasks = (tuple(context_tasks) if report is None
+                            else tuple(task_name for task_name in context_tasks if position in clean[task_name]))
+            if not record_tasks:
+                continue
+            releases = plans.get(record_tasks)
+            if releases is None:
+                releases = plans[record_tasks] = plan_releases(record_tasks)
+            record_results = run_tasks_on_dataset(dataset, record_tasks, base_seed, releases, compact, decoded[position])
+            for task_name, result_item in record_results.items():
+                results[task_name].append(result_item)
+    for task_name in task_names:
+        if task_name in CONTEXT_TASKS:
+            continue
+        task_batch = report.clean_batch(task_name) if report is not None else datasets
+        if base_seed is None:
+            results[task_name] = generate_labels(task_name, task_batch)
+        else:
+            results[task_name] = generate_labels_deterministic(task_name, task_batch, base_seed)
+    return results
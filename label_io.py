@@ -0,0 +1,221 @@
+import contextlib
+import json
+import sys
+
+# ファイル名の代わりに '-' を指定すると標準入力・標準出力を使います。
+STDIO_PATH = '-'
+
+
+def open_jsonl_input(file_path):
+    """
+    入力用のテキストストリームを with 文で使える形で開きます。
+    '-' の場合は標準入力（UTF-8）を返し、with を抜けても閉じません。
+    """
+    if file_path == STDIO_PATH:
+        sys.stdin.reconfigure(encoding='utf-8')
+        return contextlib.nullcontext(sys.stdin)
+    return open(file_path, 'r', encoding='utf-8')
+
+
+def open_jsonl_output(file_path):
+    """
+    出力用のテキストストリームを with 文で使える形で開きます。
+    '-' の場合は行バッファリングの標準出力（UTF-8）を返し、with を抜けても閉じません。
+    """
+    if file_path == STDIO_PATH:
+        sys.stdout.reconfigure(encoding='utf-8', line_buffering=True)
+        return contextlib.nullcontext(sys.stdout)
+    return open(file_path, 'w', encoding='utf-8')
+
+
+def iter_datasets_from_jsonl(file, source_name='<stdin>', first_line_number=1):
+    """
+    開いたJSONLストリーム（または行のリスト）からデータセットを1件ずつ読み込みます。
+    load_datasets_from_jsonl と同様に、'id' がなければ行番号から付与し、
+    不正な行は警告を標準エラー出力に出してスキップします。
+    ファイルの途中から読む場合は first_line_number に先頭行の行番号を渡してください。
+    """
+    for line_number, line in enumerate(file, first_line_number):
+        if not line.strip():
+            continue
+        try:
+            dataset = json.loads(line)
+        except json.JSONDecodeError:
+            print(f"警告: '{source_name}' の {line_number} 行目が有効なJSONではありません。スキップします: {line.strip()}", file=sys.stderr)
+            continue
+        if 'id' not in dataset:
+            dataset['id'] = f"line_{line_number}"
+        yield dataset
+
+
+# ラベルのみの出力（サイドカー）で、入力の 'values' を float に変換しただけのフィールドを示すキー
+NORMALIZED_FIELDS_KEY = '_normalized_fields'
+
+
+def _as_float_list(values_list):
+    try:
+        return [float(value) for value in values_list]
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_label_fields(dataset, result_item):
+    """
+    ラベル生成関数の結果から、入力にない（または入力と異なる）フィールドだけを取り出します。
+    'values' を float に変換しただけの場合は値を持たず、NORMALIZED_FIELDS_KEY に名前だけ記録します。
+    """
+    label_fields = {'id': result_item.get('id', dataset.get('id'))}
+    normalized = []
+    for key, value in result_item.items():
+        if key == 'id':
+            continue
+        if key in dataset:
+            original = dataset[key]
+            if value == original and type(value) is type(original):
+                continue
+            if key == 'values' and isinstance(original, list) and value == _as_float_list(original):
+                normalized.append(key)
+                continue
+        label_fields[key] = value
+    if normalized:
+        label_fields[NORMALIZED_FIELDS_KEY] = normalized
+    return label_fields
+
+
+def join_label_fields(dataset, label_fields):
+    """
+    extract_label_fields() の結果と入力のデータセットから、元の形式（{**dataset, ...}）の辞書を復元します。
+    """
+    result_item = dict(dataset)
+    for key in label_fields.get(NORMALIZED_FIELDS_KEY, []):
+        result_item[key] = _as_float_list(result_item[key])
+    for key, value in label_fields.items():
+        if key != NORMALIZED_FIELDS_KEY:
+            result_item[key] = value
+    return result_item
+
+
+def stream_labels(generate_function, input_path, output_path, ensure_ascii=False, labels_only=False):
+    """
+    入力を1行ずつ読み込み、ラベルを付与した結果をすぐに出力へ書き出します。
+    ラベル生成関数が表示する警告などのメッセージはすべて標準エラー出力に送られるため、
+    標準出力はJSONLの結果だけになります。処理した件数を返します。
+    labels_only=True の場合は id と計算されたフィールドだけを書き出します（JoinedLabelReader で復元可能）。
+    """
+    processed_count = 0
+    with open_jsonl_input(input_path) as infile, open_jsonl_output(output_path) as outfile:
+        with contextlib.redirect_stdout(sys.stderr):
+            for dataset in iter_datasets_from_jsonl(infile, input_path):
+                result_item = generate_function(dataset)
+                if labels_only:
+                    label_fields = extract_label_fields(dataset, result_item)
+                    outfile.write(json.dumps(label_fields, ensure_ascii=ensure_ascii, separators=(',', ':')) + '\n')
+                else:
+                    outfile.write(json.dumps(result_item, ensure_ascii=ensure_ascii) + '\n')
+                processed_count += 1
+    return processed_count
+
+
+def run_stream_cli(generate_function, argv, default_output, ensure_ascii=False):
+    """
+    各 generate_*_label.py のコマンドライン引数 [--labels-only] [入力ファイル] [出力ファイル] を処理します。
+    出力ファイルを省略した場合はスクリプト既定の出力ファイル名を使います。
+    """
+    labels_only = '--labels-only' in argv
+    argv = [arg for arg in argv if arg != '--labels-only']
+    if not argv:
+        print("エラー: 入力ファイルを指定してください（'-' で標準入力）。", file=sys.stderr)
+        return 1
+    input_path = argv[0]
+    output_path = argv[1] if len(argv) > 1 else default_output
+    try:
+        processed_count = stream_labels(generate_function, input_path, output_path,
+                                        ensure_ascii=ensure_ascii, labels_only=labels_only)
+    except BrokenPipeError:
+        # パイプの後段が先に終了した場合は静かに終了する
+        return 0
+    except IOError as e:
+        print(f"エラー: 入出力中にエラーが発生しました: {e}", file=sys.stderr)
+        return 1
+    print(f"'{input_path}' の {processed_count} 件を処理し、'{output_path}' に書き出しました。", file=sys.stderr)
+    return 0
+
+
+class JoinedLabelReader:
+    """
+    ラベルのみの出力（サイドカー）と元の入力JSONLを id で結合し、
+    従来の出力と同じ形式のレコードを必要なときに復元するリーダーです。
+
+    - 反復: サイドカーの順にレコードを返します。入力が同じ順序であれば両方を先頭から読むだけで済み、
+      順序が異なる場合にだけ入力ファイルの id -> 行の位置の索引を作ります。
+    - get(id): 索引を使って1件だけ復元します。
+    """
+
+    def __init__(self, input_path, sidecar_path):
+        self.input_path = input_path
+        self.sidecar_path = sidecar_path
+        self._input_offsets = None
+        self._sidecar_offsets = None
+
+    @staticmethod
+    def _build_offsets(file_path, assign_line_ids):
+        offsets = {}
+        with open(file_path, 'rb') as infile:
+            line_number = 0
+            while True:
+                offset = infile.tell()
+                line = infile.readline()
+                if not line:
+                    break
+                line_number += 1
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                record_id = record.get('id', f"line_{line_number}" if assign_line_ids else None)
+                offsets[record_id] = (offset, line_number)
+        return offsets
+
+    @staticmethod
+    def _read_line_at(file_path, offset):
+        with open(file_path, 'rb') as infile:
+            infile.seek(offset)
+            return json.loads(infile.readline())
+
+    def _input_dataset(self, record_id):
+        if self._input_offsets is None:
+            self._input_offsets = self._build_offsets(self.input_path, assign_line_ids=True)
+        if record_id not in self._input_offsets:
+            raise KeyError(f"入力ファイル '{self.input_path}' に id '{record_id}' のデータセットがありません。")
+        offset, line_number = self._input_offsets[record_id]
+        dataset = self._read_line_at(self.input_path, offset)
+        if 'id' not in dataset:
+            dataset['id'] = f"line_{line_number}"
+        return dataset
+
+    def get(self, record_id):
+        """
+        id を指定して1件のレコードを復元します。
+        """
+        if self._sidecar_offsets is None:
+            self._sidecar_offsets = self._build_offsets(self.sidecar_path, assign_line_ids=False)
+        if record_id not in self._sidecar_offsets:
+            raise KeyError(f"'{self.sidecar_path}' に id '{record_id}' のラベルがありません。")
+        label_fields = self._read_line_at(self.sidecar_path, self._sidecar_offsets[record_id][0])
+        return join_label_fields(self._input_dataset(record_id), label_fields)
+
+    def __iter__(self):
+        with open(self.input_path, 'r', encoding='utf-8') as infile, \
+                open(self.sidecar_path, 'r', encoding='utf-8') as sidecar:
+            datasets = iter_datasets_from_jsonl(infile, self.input_path)
+            for line in sidecar:
+                if not line.strip():
+                    continue
+                label_fields = json.loads(line)
+                record_id = label_fields.get('id')
+                dataset = next(datasets, None) if datasets is not None else None
+                if dataset is None or dataset.get('id') != record_id:
+                    # 順序が一致しなくなったら索引による読み込みに切り替える
+                    datasets = None
+                    dataset = self._input_dataset(record_id)
+                yield join_label_fields(dataset, label_fields)
@@ -0,0 +1,189 @@
+import io
+import json
+import math
+
+import numpy as np
+
+from label_record import DisplayArray, SeriesRecord
+
+# NumPy 配列を tolist() で Python のリストに変換せずに JSON として書き出すエンコーダー
+# 浮動小数点数は Python の float の repr（最短表現）と同じ文字列になり、
+# 出力は json.dumps(item, ensure_ascii=...) とバイト単位で一致します。
+# 長い系列でも一度に Python の float オブジェクトを作るのは chunk_size 個までです。
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+
+
+def _json_float(value):
+    # json.dumps（allow_nan=True）と同じ表記
+    if value != value:
+        return 'NaN'
+    if value == math.inf:
+        return 'Infinity'
+    if value == -math.inf:
+        return '-Infinity'
+    return float.__repr__(value)
+
+
+def _json_key(key):
+    # json.dumps と同じく、str 以外のキー（int・float・bool・None）を文字列に変換する
+    if isinstance(key, str):
+        return key
+    if isinstance(key, float):
+        return _json_float(key)
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, int):
+        return int.__repr__(key)
+    raise TypeError(f'keys must be str, int, float, bool or None, not {key.__class__.__name__}')
+
+
+def _display_float(value):
+    # generate_imp_label の表示用の値と同じ表記（NaN は "NaN"、それ以外は str(float)）
+    return '"NaN"' if value != value else f'"{float.__repr__(value)}"'
+
+
+def _iter_array_chunks(array, chunk_size):
+    for start in range(0, array.size, chunk_size):
+        yield array[start:start + chunk_size]
+
+
+def write_float_array(write, array, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    float 配列を JSON の配列として write（文字列を受け取る関数）に書き出します。
+    """
+    array = np.asarray(array, dtype=np.float64).ravel()
+    write('[')
+    first = True
+    for chunk in _iter_array_chunks(array, chunk_size):
+        formatter = float.__repr__ if np.isfinite(chunk).all() else _json_float
+        if not first:
+            write(', ')
+        write(', '.join(map(formatter, chunk.tolist())))
+        first = False
+    write(']')
+
+
+def write_int_array(write, array, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    整数配列を JSON の配列として write に書き出します。
+    """
+    array = np.asarray(array).ravel()
+    write('[')
+    first = True
+    for chunk in _iter_array_chunks(array, chunk_size):
+        if not first:
+            write(', ')
+        write(', '.join(map(str, chunk.tolist())))
+        first = False
+    write(']')
+
+
+def write_display_array(write, array, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    float 配列を表示用の文字列の配列（例: ["1.5", "NaN", "2.0"]）として write に書き出します。
+    """
+    array = np.asarray(array, dtype=np.float64).ravel()
+    write('[')
+    first = True
+    for chunk in _iter_array_chunks(array, chunk_size):
+        if not first:
+            write(', ')
+        write(', '.join(map(_display_float, chunk.tolist())))
+        first = False
+    write(']')
+
+
+def write_array(write, array, ensure_ascii=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    配列の dtype に応じて JSON の配列を書き出します（文字列などはリストに変換して json.dumps を使う）。
+    """
+    if array.dtype.kind == 'f':
+        write_float_array(write, array, chunk_size)
+    elif array.dtype.kind in 'iu':
+        write_int_array(write, array, chunk_size)
+    else:
+        write(json.dumps(array.tolist(), ensure_ascii=ensure_ascii))
+
+
+def encode_array(array, ensure_ascii=False, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    配列を JSON の文字列に変換します。
+    """
+    parts = []
+    write_array(parts.append, array, ensure_ascii, chunk_size)
+    return ''.join(parts)
+
+
+class ArrayTextCache:
+    """
+    同じ配列オブジェクトの JSON 文字列を再利用するためのキャッシュです。
+    SeriesRecord は複数のタスクで同じ values 配列を共有するため、1レコードの配列は1回だけ文字列化されます。
+    配列への参照を保持するので、バッチごとに clear() してください。
+    """
+
+    def __init__(self):
+        self._texts = {}
+
+    def get(self, array, ensure_ascii=False):
+        key = (id(array), ensure_ascii)
+        entry = self._texts.get(key)
+        if entry is None or entry[0] is not array:
+            entry = (array, encode_array(array, ensure_ascii))
+            self._texts[key] = entry
+        return entry[1]
+
+    def clear(self):
+        self._texts.clear()
+
+
+def _record_fields(item):
+    # (キー, 値) を出力の順序で返す。SeriesRecord の配列は NumPy 配列のまま返す
+    if isinstance(item, SeriesRecord):
+        fields = dict(item.dataset)
+        if item.years is not None:
+            fields['years_column'] = item.years if item.years.size > 0 else item.dataset.get('years_column', [])
+        if item.values is not None:
+            fields['values'] = item.values
+        fields.update(item.labels)
+        return fields.items()
+    return item.items()
+
+
+def write_record(write, item, ensure_ascii=False, cache=None):
+    """
+    辞書または SeriesRecord を JSON のオブジェクトとして write に書き出します。
+    値が NumPy 配列のフィールドは tolist() を通さずに書き出します。
+    str 以外のキーは json.dumps と同じく文字列に変換します（1 -> "1"、True -> "true"、None -> "null"）。
+    """
+    write('{')
+    first = True
+    for key, value in _record_fields(item):
+        if not first:
+            write(', ')
+        write(json.dumps(_json_key(key), ensure_ascii=ensure_ascii))
+        write(': ')
+        if isinstance(value, np.ndarray):
+            write(cache.get(value, ensure_ascii) if cache is not None else encode_array(value, ensure_ascii))
+        elif isinstance(value, DisplayArray):
+            write_display_array(write, value.array)
+        else:
+            write(json.dumps(value, ensure_ascii=ensure_ascii))
+        first = False
+    write('}')
+
+
+def dumps(item, ensure_ascii=False, cache=None):
+    """
+    json.dumps(item, ensure_ascii=ensure_ascii) と同じ文字列を返します（SeriesRecord も受け付けます）。
+    NumPy 配列を含まない辞書はそのまま json.dumps で変換します。
+    """
+    if isinstance(item, dict) and not any(isinstance(value, (np.ndarray, DisplayArray)) for value in item.values()):
+        return json.dumps(item, ensure_ascii=ensure_ascii)
+    buffer = io.StringIO()
+    write_record(buffer.write, item, ensure_ascii, cache)
+    return buffer.getvalue()
@@ -0,0 +1,249 @@
+import numpy as np
+
+from label_numeric import TypedBatch, decode_numeric_lists
+
+# 複数レコードをまとめて処理するベクトル化カーネル
+# 各カーネルは (datasets, fallback_function) を受け取り、
+# 既存のラベル生成関数と同じ辞書のリストを同じ順序で返します。
+
+
+def concat_values(datasets):
+    """
+    有効な（'values' が空でなく、すべて数値に変換できる）レコードの 'values' を
+    1本の float64 バッファに連結します。
+    戻り値は (buffer, offsets, valid_positions) で、
+    i 番目の有効レコードの値は buffer[offsets[i]:offsets[i + 1]] です。
+    数値に変換できない要素を含むレコードは valid_positions に含まれないため、
+    呼び出し側で元のラベル生成関数に任せてください。
+    label_validation で検証済みの TypedBatch は変換済みのバッファをそのまま返します。
+    """
+    if isinstance(datasets, TypedBatch):
+        return datasets.buffer, datasets.offsets, list(range(len(datasets)))
+
+    candidate_positions = []
+    lists = []
+    for position, dataset in enumerate(datasets):
+        values_list = dataset.get('values')
+        if not values_list or not isinstance(values_list, (list, tuple)):
+            continue
+        candidate_positions.append(position)
+        lists.append(values_list)
+
+    buffer, offsets, bad_tokens = decode_numeric_lists(lists)
+    if not bad_tokens:
+        return buffer, offsets, candidate_positions
+
+    bad_lists = {list_index for list_index, _, _ in bad_tokens}
+    keep = [i for i in range(len(lists)) if i not in bad_lists]
+    lengths = np.diff(offsets)[keep]
+    buffer = np.concatenate([buffer[offsets[i]:offsets[i + 1]] for i in keep]) if keep else np.zeros(0)
+    offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    return buffer, offsets, [candidate_positions[i] for i in keep]
+
+
+def _gold_result(dataset, values_slice, calculated_gold):
+    # 既存の generate_gold_and_create_dictionary と同じ形の辞書を作る
+    years = np.array(dataset.get('years_column', []))
+    return {
+        **dataset,
+        'years_column': years.tolist() if years.size > 0 else dataset.get('years_column', []),
+        'values': values_slice.tolist(),
+        'calculated_gold_value': calculated_gold,
+    }
+
+
+def _batch_gold(datasets, fallback_function, reduce_batch):
+    """
+    max/min/sum/ave のような「values 全体を1つの値に集約する」タスクの共通処理です。
+    無効なレコードは既存の関数に任せ、警告メッセージや出力形式を元のスクリプトと揃えます。
+    """
+    # 変換できない要素を含むレコードは元の関数に任せ、同じ挙動（例外を含む）にする
+    buffer, offsets, valid_positions = concat_values(datasets)
+
+    results = [None] * len(datasets)
+    if valid_positions:
+        golds = reduce_batch(buffer, offsets)
+        for i, position in enumerate(valid_positions):
+            values_slice = buffer[offsets[i]:offsets[i + 1]]
+            results[position] = _gold_result(datasets[position], values_slice, golds[i])
+    for position, dataset in enumerate(datasets):
+        if results[position] is None:
+            results[position] = fallback_function(dataset)
+    return results
+
+
+def _reduce_max(buffer, offsets):
+    return np.maximum.reduceat(buffer, offsets[:-1])
+
+
+def _reduce_min(buffer, offsets):
+    return np.minimum.reduceat(buffer, offsets[:-1])
+
+
+def _reduce_sum(buffer, offsets):
+    # np.add.reduceat は np.sum（ペアワイズ加算）と丸め誤差が異なるため、
+    # 既存の出力と一致させるためにスライスごとに np.sum を使う
+    return [np.sum(buffer[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+
+def _reduce_mean(buffer, offsets):
+    return [np.mean(buffer[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+
+def segment_arg_extreme(buffer, offsets, mode='max'):
+    """
+    連結バッファの各区間について、最大値（mode='min' なら最小値）が最初に現れる区間内の位置を一度に求めます。
+    np.argmax/np.argmin と同じく、NaN を含む区間では最初の NaN の位置を返します。
+    すべての区間は空でない必要があります。
+    """
+    starts = offsets[:-1]
+    lengths = np.diff(offsets)
+    reducer = np.maximum if mode == 'max' else np.minimum
+    extremes = np.repeat(reducer.reduceat(buffer, starts), lengths)
+    hits = (buffer == extremes) | (np.isnan(extremes) & np.isnan(buffer))
+    positions = np.where(hits, np.arange(buffer.size), buffer.size)
+    return np.minimum.reduceat(positions, starts) - starts
+
+
+def _batch_time_of_extreme(datasets, fallback_function, mode):
+    # 年の解析はレコード（同じ years_column）ごとに1回だけ行われ、キャッシュされる
+    from label_timeaxis import get_time_axis
+
+    buffer, offsets, valid_positions = concat_values(datasets)
+
+    results = [None] * len(datasets)
+    if valid_positions:
+        arg_positions = segment_arg_extreme(buffer, offsets, mode)
+        for i, position in enumerate(valid_positions):
+            dataset = datasets[position]
+            time_axis = get_time_axis(dataset.get('years_column', []))
+            length = offsets[i + 1] - offsets[i]
+            if len(time_axis) != length or not time_axis.all_valid:
+                continue
+            index = int(arg_positions[i])
+            results[position] = {
+                **dataset,
+                'values': buffer[offsets[i]:offsets[i + 1]].tolist(),
+                'calculated_gold_value': time_axis.year_at(index),
+                'calculated_gold_index': index,
+            }
+    for position, dataset in enumerate(datasets):
+        if results[position] is None:
+            results[position] = fallback_function(dataset)
+    return results
+
+
+def batch_argmaxtime(datasets, fallback_function):
+    return _batch_time_of_extreme(datasets, fallback_function, 'max')
+
+
+def batch_argmintime(datasets, fallback_function):
+    return _batch_time_of_extreme(datasets, fallback_function, 'min')
+
+
+def batch_exceed(datasets, fallback_function):
+    # 索引の実装は label_threshold にある
+    from label_threshold import batch_random_threshold
+
+    return batch_random_threshold(datasets, fallback_function, 'exceed')
+
+
+def batch_below(datasets, fallback_function):
+    from label_threshold import batch_random_threshold
+
+    return batch_random_threshold(datasets, fallback_function, 'below')
+
+
+def _batch_extrema(datasets, fallback_function, sign, result_key):
+    # ピーク・谷の検出は label_backends のカーネル（選択されたバックエンド）で行う
+    from label_backends import get_kernel
+
+    buffer, offsets, valid_positions = concat_values(datasets)
+
+    results = [None] * len(datasets)
+    if valid_positions:
+        extremum_positions, counts = get_kernel('extrema')(buffer, offsets, sign)
+        extremum_values = buffer[extremum_positions]
+        value_offsets = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=value_offsets[1:])
+        for i, position in enumerate(valid_positions):
+            dataset = datasets[position]
+            years = np.array(dataset.get('years_column', []))
+            results[position] = {
+                **dataset,
+                'years_column': years.tolist() if years.size > 0 else dataset.get('years_column', []),
+                'values': buffer[offsets[i]:offsets[i + 1]].tolist(),
+                result_key: extremum_values[value_offsets[i]:value_offsets[i + 1]].tolist(),
+            }
+    for position, dataset in enumerate(datasets):
+        if results[position] is None:
+            results[position] = fallback_function(dataset)
+    return results
+
+
+def batch_peak(datasets, fallback_function):
+    return _batch_extrema(datasets, fallback_function, 1.0, 'calculated_peak_values')
+
+
+def batch_dip(datasets, fallback_function):
+    return _batch_extrema(datasets, fallback_function, -1.0, 'calculated_values')
+
+
+def batch_backtest(datasets, fallback_function):
+    from label_backtest import batch_backtest as batch_backtest_impl
+
+    return batch_backtest_impl(datasets, fallback_function)
+
+
+def batch_gapimp(datasets, fallback_function, base_seed=0):
+    from label_imputation import batch_gap_imputation
+
+    return batch_gap_imputation(datasets, fallback_function, base_seed)
+
+
+def batch_rolling(datasets, fallback_function):
+    from label_rolling import batch_rolling_statistics
+
+    return batch_rolling_statistics(datasets, fallback_function)
+
+
+def batch_order(datasets, fallback_function):
+    from label_order import batch_order_statistics
+
+    return batch_order_statistics(datasets, fallback_function)
+
+
+def batch_max(datasets, fallback_function):
+    return _batch_gold(datasets, fallback_function, _reduce_max)
+
+
+def batch_min(datasets, fallback_function):
+    return _batch_gold(datasets, fallback_function, _reduce_min)
+
+
+def batch_sum(datasets, fallback_function):
+    return _batch_gold(datasets, fallback_function, _reduce_sum)
+
+
+def batch_ave(datasets, fallback_function):
+    return _batch_gold(datasets, fallback_function, _reduce_mean)
+
+
+# タスク名 -> バッチカーネル
+BATCH_KERNELS = {
+    'max': batch_max,
+    'min': batch_min,
+    'sum': batch_sum,
+    'ave': batch_ave,
+    'argmaxtime': batch_argmaxtime,
+    'argmintime': batch_argmintime,
+    'exceed': batch_exceed,
+    'below': batch_below,
+    'peak': batch_peak,
+    'dip': batch_dip,
+    'backtest': batch_backtest,
+    'gapimp': batch_gapimp,
+    'rolling': batch_rolling,
+    'order': batch_order,
+}
@@ -0,0 +1,145 @@
+import itertools
+import math
+
+import numpy as np
+
+# "366.7" のような文字列で表された数値のリストを、バッチ全体で1本の float64 バッファに変換するモジュール
+# レコードごとに np.array(..., dtype=float) を呼ぶ代わりに np.fromiter で一度に変換し、
+# 数値に変換できない要素があってもバッチ全体を失敗させずに位置を報告します。
+
+# 有限の float の和を正確に持つための単位（すべての有限の float は 2^-1074 の整数倍）
+EXACT_SUM_BITS = 1074
+
+
+def exact_float_units(values):
+    """
+    有限の float の和を 2^-1074 を単位とする整数で正確に返します（足す順序によらず同じ値）。
+    """
+    total = 0
+    for value in values:
+        numerator, denominator = value.as_integer_ratio()
+        total += numerator << (EXACT_SUM_BITS - denominator.bit_length() + 1)
+    return total
+
+
+def units_to_float(units):
+    """
+    exact_float_units() の整数を float に丸めます（正しく丸めた値。範囲を超える場合は無限大）。
+    """
+    try:
+        return units / (1 << EXACT_SUM_BITS)
+    except OverflowError:
+        return math.inf if units > 0 else -math.inf
+
+
+def _decode_tokens_slowly(tokens, list_index, bad_tokens):
+    # 数値に変換できない要素を特定するための遅い経路（問題のあるリストにだけ使う）
+    decoded = np.empty(len(tokens), dtype=np.float64)
+    for position, token in enumerate(tokens):
+        try:
+            decoded[position] = float(token)
+        except (ValueError, TypeError):
+            decoded[position] = np.nan
+            bad_tokens.append((list_index, position, token))
+    return decoded
+
+
+def decode_numeric_lists(lists):
+    """
+    数値（または数値文字列）のリストのリストを1本の float64 バッファに変換します。
+    戻り値は (buffer, offsets, bad_tokens) で、i 番目のリストの値は buffer[offsets[i]:offsets[i + 1]] です。
+    bad_tokens は変換できなかった要素の (リストの番号, リスト内の位置, 元の要素) のリストで、
+    その位置のバッファの値は NaN になります。
+    """
+    lengths = [len(tokens) for tokens in lists]
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    total = int(offsets[-1])
+
+    try:
+        buffer = np.fromiter(itertools.chain.from_iterable(lists), dtype=np.float64, count=total)
+        return buffer, offsets, []
+    except (ValueError, TypeError):
+        pass
+
+    buffer = np.empty(total, dtype=np.float64)
+    bad_tokens = []
+    for list_index, tokens in enumerate(lists):
+        start, end = offsets[list_index], offsets[list_index + 1]
+        try:
+            buffer[start:end] = np.fromiter(tokens, dtype=np.float64, count=end - start)
+        except (ValueError, TypeError):
+            buffer[start:end] = _decode_tokens_slowly(tokens, list_index, bad_tokens)
+    return buffer, offsets, bad_tokens
+
+
+def group_bad_tokens(bad_tokens):
+    """
+    bad_tokens を {リストの番号: [(位置, 元の要素), ...]} の辞書にまとめます。
+    """
+    grouped = {}
+    for list_index, position, token in bad_tokens:
+        grouped.setdefault(list_index, []).append((position, token))
+    return grouped
+
+
+def decode_dataset_column(datasets, key='values'):
+    """
+    各データセットの key（'values' や 'years_column'）をまとめて変換します。
+    key がない、またはリストでないデータセットは長さ0として扱います。
+    戻り値は (buffer, offsets, {データセットの位置: [(位置, 元の要素), ...]}) です。
+    """
+    lists = []
+    for dataset in datasets:
+        tokens = dataset.get(key)
+        lists.append(tokens if isinstance(tokens, (list, tuple)) else [])
+    buffer, offsets, bad_tokens = decode_numeric_lists(lists)
+    return buffer, offsets, group_bad_tokens(bad_tokens)
+
+
+def select_segments(buffer, offsets, positions):
+    """
+    連結バッファから positions 番目の区間だけを取り出して連結し、(buffer, offsets) を返します。
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    lengths = offsets[positions + 1] - offsets[positions]
+    new_offsets = np.zeros(positions.size + 1, dtype=np.int64)
+    np.cumsum(lengths, out=new_offsets[1:])
+    if new_offsets[-1] == 0:
+        return np.zeros(0, dtype=buffer.dtype), new_offsets
+    index = np.repeat(offsets[positions] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return buffer[index], new_offsets
+
+
+def segmented_cumsum(array, offsets):
+    """
+    連結バッファの区間ごとの累積和を返します（区間をまたいで足し込まないので、長いバッチでも桁落ちしません）。
+    """
+    return np.concatenate([np.cumsum(array[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+                          + [np.zeros(0)])
+
+
+def window_sums(cumulative, offsets, window):
+    """
+    segmented_cumsum() の結果から、各区間の長さ window の窓（区間内に収まるもの）の和を返します。
+    戻り値は (窓の和の配列, 窓の開始位置の配列)で、区間の順・開始位置の順に並びます。
+    """
+    lengths = np.diff(offsets)
+    counts = np.maximum(lengths - window + 1, 0)
+    first = np.zeros(counts.size + 1, dtype=np.int64)
+    np.cumsum(counts, out=first[1:])
+    starts = np.repeat(offsets[:-1], counts) + np.arange(first[-1]) - np.repeat(first[:-1], counts)
+    before = np.where(np.isin(starts, offsets[:-1]), 0.0, cumulative[np.maximum(starts - 1, 0)])
+    return cumulative[starts + window - 1] - before, starts
+
+
+class TypedBatch(list):
+    """
+    事前検証を通過したデータセットのリストに、'values' を変換済みの (buffer, offsets) を添えたものです。
+    label_kernels.concat_values() はこのバッチを受け取ると変換をやり直さずにそのまま使います。
+    """
+
+    def __init__(self, datasets, buffer, offsets):
+        super().__init__(datasets)
+        self.buffer = buffer
+        self.offsets = offsets
@@ -0,0 +1,199 @@
+import sys
+
+import numpy as np
+
+from label_io import run_stream_cli
+from label_numeric import TypedBatch, decode_dataset_column, select_segments
+from label_timeaxis import get_time_axis
+
+# 順序統計量（中央値、分位点、k 番目に大きい値）のラベル
+# 全体をソートする代わりに np.partition による選択（introselect）（1系列あたり O(n)）を使い、
+# 1つの系列で必要な順位（各分位点の前後の順位と k 番目に大きい値の順位）は1回の選択でまとめて求めます。
+# 選択に必要な順位は系列の長さだけで決まるため、バッチ内の同じ長さの系列を2次元配列に積み、まとめて選択します。
+#
+# 分位点は np.quantile（method='linear'）と同じ定義で、q * (n - 1) 番目の前後の順序統計量を線形補間します
+# （補間の式も NumPy と同じにして、丸め誤差まで一致させます）。中央値は np.median と同じく、
+# 要素数が偶数なら中央の2つの平均です。NaN や無限大を含む系列は扱いません。
+# 各値が現れる位置は、その順序統計量と等しい値が最初に現れる位置（np.argmax と同じ規則）で、
+# 年は label_timeaxis で解釈した年（2桁の年は世紀を補ったもの）です（years_column が values と対応しない場合は None）。
+
+QUANTILES = (0.25, 0.5, 0.75)
+DEFAULT_K = 2
+# 同じ長さの系列を一度に選択する行列の要素数の上限（メモリ使用量を抑えるため）
+BLOCK_ELEMENTS = 1 << 20
+
+
+def _quantile_ranks(length, quantiles):
+    # 各分位点について、補間に使う下側・上側の順位と上側の重み
+    positions = np.asarray(quantiles, dtype=np.float64) * (length - 1)
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.minimum(lower + 1, length - 1)
+    return lower, upper, positions - lower
+
+
+def _lerp(lower_values, upper_values, weights):
+    # NumPy の分位点の補間と同じ式（重みが 0.5 以上では上側の値から戻る）
+    difference = upper_values - lower_values
+    return np.where(weights >= 0.5, upper_values - difference * (1 - weights), lower_values + difference * weights)
+
+
+def select_order_statistics(matrix, ranks):
+    """
+    同じ長さの系列を積んだ2次元配列 matrix（行が系列）について、各行の昇順で ranks 番目の値と、
+    その値が最初に現れる列の位置を返します。戻り値はどちらも (行数, len(ranks)) の配列です。
+    """
+    ranks = np.asarray(ranks, dtype=np.int64)
+    unique_ranks, inverse = np.unique(ranks, return_inverse=True)
+    partitioned = np.partition(matrix, unique_ranks, axis=1)
+    selected = partitioned[:, unique_ranks][:, inverse]
+    # 同じ値が複数ある場合に選ばれる位置を決定的にするため、最初に現れる位置を探す
+    first_positions = np.argmax(matrix[:, None, :] == selected[:, :, None], axis=2)
+    return selected, first_positions
+
+
+def order_statistics(buffer, offsets, quantiles=QUANTILES, k=DEFAULT_K):
+    """
+    連結バッファの各区間について、分位点・中央値・k 番目に大きい値とその位置をまとめて計算します。
+    戻り値は区間ごとの辞書のリストで、k 番目に大きい値は区間の長さが k 未満なら None です。
+    """
+    lengths = np.diff(offsets)
+    statistics = [None] * lengths.size
+    for length in np.unique(lengths).tolist():
+        if length == 0:
+            continue
+        lower, upper, weights = _quantile_ranks(length, quantiles)
+        median_lower, median_upper, median_weight = _quantile_ranks(length, (0.5,))
+        ranks = [lower, upper, median_lower, median_upper]
+        if length >= k:
+            ranks.append(np.array([length - k], dtype=np.int64))
+        ranks = np.concatenate(ranks)
+        count = len(quantiles)
+
+        same_length = np.flatnonzero(lengths == length)
+        rows_per_block = max(1, BLOCK_ELEMENTS // (length * ranks.size))
+        for block_start in range(0, same_length.size, rows_per_block):
+            segments = same_length[block_start:block_start + rows_per_block]
+            matrix = buffer[offsets[segments][:, None] + np.arange(length)]
+            selected, first_positions = select_order_statistics(matrix, ranks)
+            _store_statistics(statistics, segments, selected, first_positions, weights, median_weight[0] > 0, count,
+                              length >= k)
+    return statistics
+
+
+def _store_statistics(statistics, segments, selected, first_positions, weights, even_length, count, has_kth):
+    quantile_values = _lerp(selected[:, :count], selected[:, count:2 * count], weights)
+    median_lower, median_upper = selected[:, 2 * count], selected[:, 2 * count + 1]
+    median_values = (median_lower + median_upper) / 2 if even_length else median_lower
+    for row, segment in enumerate(segments.tolist()):
+        positions = first_positions[row].tolist()
+        statistics[segment] = {
+            'quantiles': quantile_values[row].tolist(),
+            'quantile_indices': [sorted({positions[j], positions[count + j]}) for j in range(count)],
+            'median': float(median_values[row]),
+            'median_indices': sorted({positions[2 * count], positions[2 * count + 1]}),
+            'kth_largest': float(selected[row, -1]) if has_kth else None,
+            'kth_largest_index': positions[-1] if has_kth else None,
+        }
+
+
+def _years_of(time_axis, indices):
+    if time_axis is None:
+        return None
+    return [time_axis.year_at(index) for index in indices]
+
+
+def _build_results(datasets, buffer, offsets, quantiles, k):
+    statistics = order_statistics(buffer, offsets, quantiles, k)
+
+    results = []
+    for i, dataset in enumerate(datasets):
+        stats = statistics[i]
+        years_list = dataset.get('years_column', [])
+        time_axis = get_time_axis(years_list)
+        if len(time_axis) != offsets[i + 1] - offsets[i] or not time_axis.all_valid:
+            time_axis = None
+        kth_index = stats['kth_largest_index']
+        years = np.array(years_list)
+        results.append({
+            **dataset,
+            'years_column': years.tolist() if years.size > 0 else years_list,
+            'values': buffer[offsets[i]:offsets[i + 1]].tolist(),
+            'calculated_median': stats['median'],
+            'calculated_median_indices': stats['median_indices'],
+            'calculated_median_years': _years_of(time_axis, stats['median_indices']),
+            'quantile_levels': list(quantiles),
+            'calculated_quantiles': stats['quantiles'],
+            'calculated_quantile_indices': stats['quantile_indices'],
+            'calculated_quantile_years': (None if time_axis is None
+                                          else [_years_of(time_axis, indices) for indices in stats['quantile_indices']]),
+            'kth_largest_k': k,
+            'calculated_kth_largest': stats['kth_largest'],
+            'calculated_kth_largest_index': kth_index,
+            'calculated_kth_largest_year': (None if time_axis is None or kth_index is None
+                                            else time_axis.year_at(kth_index)),
+        })
+    return results
+
+
+def generate_order_statistics_and_create_dictionary(dataset, quantiles=QUANTILES, k=DEFAULT_K):
+    """
+    'values' の中央値、分位点、k 番目に大きい値と、それぞれが現れる位置・年を計算し、新しい辞書を作成します。
+    """
+    if 'values' not in dataset or not dataset['values']:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' には 'values' キーが存在しないか、空です。順序統計量を計算できません。")
+        return {
+            **dataset,
+            'calculated_median': None,
+            'calculated_quantiles': None,
+            'calculated_kth_largest': None,
+        }
+
+    values = np.array(dataset['values'], dtype=float)
+    if not np.isfinite(values).all():
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'values' に NaN または無限大が含まれています。順序統計量を計算できません。")
+        return {
+            **dataset,
+            'values': values.tolist(),
+            'calculated_median': None,
+            'calculated_quantiles': None,
+            'calculated_kth_largest': None,
+        }
+    if len(values) < k:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'values' の要素が {k} 未満です。{k} 番目に大きい値は計算できません。")
+
+    offsets = np.array([0, len(values)], dtype=np.int64)
+    return _build_results([dataset], values, offsets, quantiles, k)[0]
+
+
+def batch_order_statistics(datasets, fallback_function, quantiles=QUANTILES, k=DEFAULT_K):
+    """
+    バッチカーネル: NaN・無限大を含まない k 点以上の数値の系列をまとめて処理し、それ以外は fallback_function に任せます。
+    quantiles と k を変える場合は、fallback_function も同じ値で呼び出すもの（functools.partial など）にしてください。
+    """
+    if isinstance(datasets, TypedBatch):
+        buffer, offsets, bad_values = datasets.buffer, datasets.offsets, {}
+    else:
+        buffer, offsets, bad_values = decode_dataset_column(datasets, 'values')
+    lengths = np.diff(offsets)
+    non_finite_counts = np.zeros(lengths.size, dtype=np.int64)
+    nonempty = lengths > 0
+    non_finite_counts[nonempty] = np.add.reduceat(~np.isfinite(buffer), offsets[:-1][nonempty])
+    valid_positions = [p for p in range(len(datasets))
+                       if p not in bad_values and lengths[p] >= k and non_finite_counts[p] == 0]
+
+    results = [None] * len(datasets)
+    if valid_positions:
+        valid_buffer, valid_offsets = select_segments(buffer, offsets, valid_positions)
+        built = _build_results([datasets[p] for p in valid_positions], valid_buffer, valid_offsets, quantiles, k)
+        for position, result_item in zip(valid_positions, built):
+            results[position] = result_item
+    for position, dataset in enumerate(datasets):
+        if results[position] is None:
+            results[position] = fallback_function(dataset)
+    return results
+
+
+if __name__ == "__main__":
+    # 例: python label_order.py test.jsonl order_statistics_output.jsonl
+    sys.exit(run_stream_cli(generate_order_statistics_and_create_dictionary, sys.argv[1:],
+                            "order_statistics_output.jsonl"))
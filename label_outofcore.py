@@ -0,0 +1,502 @@
+import itertools
+import json
+import os
+import re
+
+import numpy as np
+
+# 1レコードの 'values' が非常に長い（10^8 点以上）場合に、
+# 全体を Python の float のリストに展開せずチャンク単位でラベルを計算するためのモジュール
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+_READ_BLOCK_SIZE = 1 << 24
+
+
+# JSON の構造を表す括弧の深さの増減（'[' と '{' で +1、']' と '}' で -1）
+_BRACKET_DELTAS = np.zeros(256, dtype=np.int8)
+_BRACKET_DELTAS[[ord('['), ord('{')]] = 1
+_BRACKET_DELTAS[[ord(']'), ord('}')]] = -1
+# キーの検索で、ブロックの境界をまたぐ一致のために次のブロックへ持ち越すバイト数
+_KEY_OVERLAP = 256
+
+
+def _backslash_run(data, position, carried):
+    # data[position] の直前に続くバックスラッシュの数（data の先頭まで続く場合は前のブロックの分 carried を足す）
+    start = position
+    while start > 0 and data[start - 1] == 0x5c:
+        start -= 1
+    return position - start + (carried if start == 0 else 0)
+
+
+class _JsonStructure:
+    """
+    バイト列 data の括弧の深さと文字列の内外を、data の先頭での状態 (depth, in_string, backslashes) から求めます。
+    NumPy でまとめて計算し、引用符と括弧の位置だけを保持します。
+    """
+
+    def __init__(self, data, depth, in_string, backslashes):
+        self.data = data
+        self.depth = depth
+        self.in_string = in_string
+        self.backslashes = backslashes
+        array = np.frombuffer(data, dtype=np.uint8)
+        quotes = np.flatnonzero(array == 0x22)
+        if data.find(b'\\') >= 0 or backslashes:
+            # エスケープされた引用符（直前のバックスラッシュが奇数個）を除く
+            preceded = np.flatnonzero(array[np.maximum(quotes - 1, 0)] == 0x5c)
+            if backslashes and quotes.size and quotes[0] == 0:
+                preceded = np.union1d(preceded, [0])
+            escaped = [i for i in preceded.tolist() if _backslash_run(data, int(quotes[i]), backslashes) % 2 == 1]
+            quotes = np.delete(quotes, escaped)
+        self.quotes = quotes
+        brackets = np.flatnonzero(_BRACKET_DELTAS[array])
+        outside = (np.searchsorted(quotes, brackets) + in_string) % 2 == 0
+        self.brackets = brackets[outside]
+        self.bracket_depths = depth + np.cumsum(_BRACKET_DELTAS[array[self.brackets]], dtype=np.int64)
+
+    def state_at(self, position):
+        """
+        data[position] の直前の (depth, in_string, backslashes) を返します。
+        """
+        count = int(np.searchsorted(self.brackets, position))
+        depth = self.depth if count == 0 else int(self.bracket_depths[count - 1])
+        in_string = (self.in_string + int(np.searchsorted(self.quotes, position))) % 2
+        return depth, in_string, _backslash_run(self.data, position, self.backslashes)
+
+    def is_top_level_key(self, position):
+        # position の引用符が、最上位のオブジェクト（深さ 1）の文字列の外にあるか
+        depth, in_string, _ = self.state_at(position)
+        return depth == 1 and not in_string
+
+
+def _find_top_level_array(infile, file_path, key):
+    # 最上位のオブジェクトのキー key の配列を探し、(読み込み済みのバイト列, その先頭の位置, 一致) を返す
+    key_pattern = re.compile(rb'"' + re.escape(json.dumps(key)[1:-1].encode('utf-8')) + rb'"\s*:\s*\[')
+    state = (0, 0, 0)
+    buffer = b''
+    buffer_offset = 0
+    while True:
+        block = infile.read(_READ_BLOCK_SIZE)
+        if not block:
+            raise KeyError(f"'{file_path}' の最上位のオブジェクトに配列 '{key}' が見つかりません。")
+        buffer += block
+        structure = _JsonStructure(buffer, *state)
+        for match in key_pattern.finditer(buffer):
+            if structure.is_top_level_key(match.start()):
+                return buffer, buffer_offset, match
+        keep = min(len(buffer), _KEY_OVERLAP)
+        state = structure.state_at(len(buffer) - keep)
+        buffer_offset += len(buffer) - keep
+        buffer = buffer[len(buffer) - keep:]
+
+
+def iter_json_array_chunks(file_path, key='values', chunk_size=DEFAULT_CHUNK_SIZE, span=None):
+    """
+    JSONファイル（1レコード）の最上位のオブジェクトの数値配列 key を少しずつ読み込み、
+    chunk_size 個ずつの float64 配列として順に返します（最後のチャンクのみ短くなり得ます）。
+    入れ子のオブジェクトの中や文字列の中の同じ名前のキーは無視します。
+    要素は数値でも "366.7" のような数値文字列でも構いません。
+    span に辞書を渡すと、配列部分（'[' から ']' まで）のバイト位置を 'start', 'end' に記録します。
+    """
+    with open(file_path, 'rb') as infile:
+        buffer, buffer_offset, match = _find_top_level_array(infile, file_path, key)
+        if span is not None:
+            span['start'] = buffer_offset + match.end() - 1
+        remainder = buffer[match.end():]
+        consumed = buffer_offset + match.end()
+
+        pending = []
+        pending_count = 0
+        finished = False
+        while not finished:
+            end_position = remainder.find(b']')
+            if end_position >= 0:
+                body = remainder[:end_position]
+                if span is not None:
+                    span['end'] = consumed + end_position + 1
+                finished = True
+                carry = b''
+            else:
+                # 区切りの途中で切れた数値は次のブロックに持ち越す
+                last_comma = remainder.rfind(b',')
+                body = remainder[:last_comma] if last_comma >= 0 else b''
+                carry = remainder[last_comma + 1:] if last_comma >= 0 else remainder
+
+            body = body.translate(None, b'"')
+            if body.strip():
+                tokens = body.split(b',')
+                parsed = np.array(tokens, dtype=bytes).astype(np.float64)
+                pending.append(parsed)
+                pending_count += parsed.size
+
+            while pending_count >= chunk_size:
+                merged = np.concatenate(pending) if len(pending) > 1 else pending[0]
+                yield merged[:chunk_size]
+                rest = merged[chunk_size:]
+                pending = [rest] if rest.size else []
+                pending_count = rest.size
+
+            if not finished:
+                block = infile.read(_READ_BLOCK_SIZE)
+                if not block:
+                    raise ValueError(f"'{file_path}' の配列 '{key}' が閉じられていません。")
+                consumed += len(remainder) - len(carry)
+                remainder = carry + block
+
+        if pending_count:
+            yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+
+def load_record_without_arrays(file_path, spans):
+    """
+    iter_json_array_chunks() で記録した配列の位置を空配列に置き換えて、
+    残りのフィールド（id, value_header, gold など）だけを読み込みます。
+    """
+    pieces = []
+    position = 0
+    with open(file_path, 'rb') as infile:
+        for span in sorted(spans, key=lambda s: s['start']):
+            infile.seek(position)
+            pieces.append(infile.read(span['start'] - position))
+            pieces.append(b'[]')
+            position = span['end']
+        infile.seek(position)
+        pieces.append(infile.read())
+    return json.loads(b''.join(pieces).decode('utf-8'))
+
+
+def open_values_memmap(file_path):
+    """
+    .npy ファイル、または生の little-endian float64 バイナリをメモリマップで開きます。
+    """
+    if file_path.endswith('.npy'):
+        return np.load(file_path, mmap_mode='r')
+    return np.memmap(file_path, dtype='<f8', mode='r')
+
+
+def iter_array_chunks(array, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    メモリマップされた配列をコピーせずにチャンク単位のビューとして返します。
+    """
+    for start in range(0, len(array), chunk_size):
+        yield array[start:start + chunk_size]
+
+
+def convert_json_values_to_raw(json_path, raw_path, key='values', chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    JSONレコードの数値配列を生の float64 バイナリに書き出します（一度だけ変換し、以後はメモリマップで利用）。
+    書き出した要素数を返します。
+    """
+    count = 0
+    with open(raw_path, 'wb') as outfile:
+        for chunk in iter_json_array_chunks(json_path, key, chunk_size):
+            outfile.write(chunk.astype('<f8', copy=False).tobytes())
+            count += chunk.size
+    return count
+
+
+def _run_extrema(runs_values, runs_starts, next_start, previous_value, strict_less):
+    # 連続する同じ値を1つのランとみなし、前のランより大きく次のランより大きいランを極値とする。
+    # これは scipy.signal.find_peaks の平坦区間の扱い（中央のインデックス）と一致する。
+    left = np.concatenate(([previous_value], runs_values[:-1]))
+    interior_values = runs_values[:-1]
+    interior_left = left[:-1]
+    following = runs_values[1:]
+    is_extremum = strict_less(interior_left, interior_values) & strict_less(following, interior_values)
+    ends = np.concatenate((runs_starts[1:], [next_start])) - 1
+    indices = (runs_starts[:-1] + ends[:-1]) // 2
+    return indices[is_extremum], interior_values[is_extremum]
+
+
+class _ExtremaScanner:
+    """
+    チャンクの境界をまたぐ平坦区間も正しく扱うピーク（またはディップ）検出器です。
+    末尾の未確定のラン（値と開始位置）とその直前のランの値だけを持ち越します。
+    """
+
+    def __init__(self, strict_less):
+        self.strict_less = strict_less
+        self.previous_value = np.nan
+        self.tail_value = None
+        self.tail_start = None
+        self.indices = []
+        self.values = []
+
+    def update(self, chunk, offset):
+        if chunk.size == 0:
+            return
+        changes = np.flatnonzero(chunk[1:] != chunk[:-1]) + 1
+        runs_starts = np.concatenate(([0], changes)) + offset
+        runs_values = chunk[runs_starts - offset]
+
+        previous_value = self.previous_value
+        if self.tail_value is not None:
+            if self.tail_value == chunk[0]:
+                runs_starts[0] = self.tail_start
+            else:
+                runs_values = np.concatenate(([self.tail_value], runs_values))
+                runs_starts = np.concatenate(([self.tail_start], runs_starts))
+
+        next_start = offset + chunk.size
+        if runs_values.size > 1:
+            # 系列の先頭のランは直前の値が NaN 扱いのため極値にならない
+            indices, values = _run_extrema(runs_values, runs_starts, next_start, previous_value, self.strict_less)
+            self.indices.append(indices)
+            self.values.append(values)
+            self.previous_value = runs_values[-2]
+        self.tail_value = runs_values[-1]
+        self.tail_start = runs_starts[-1]
+
+    def result(self):
+        if not self.indices:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        return np.concatenate(self.indices), np.concatenate(self.values)
+
+
+class ChunkedSeriesAccumulator:
+    """
+    チャンクを順に受け取り、max/min/sum/ave/peak/dip/fcst と閾値ラベルを計算します。
+    メモリ使用量はチャンクサイズと結果（ピークや閾値を超える点）の大きさにのみ比例します。
+    年（x 軸）を渡さない場合、回帰はインデックス（0, 1, 2, ...）に対して行います。
+    """
+
+    def __init__(self, thresholds=()):
+        self.count = 0
+        self.sum = 0.0
+        self.sum_compensation = 0.0
+        self.max = None
+        self.min = None
+        self.peaks = _ExtremaScanner(np.less)
+        self.dips = _ExtremaScanner(np.greater)
+        self.thresholds = [float(t) for t in thresholds]
+        self.above = [[] for _ in self.thresholds]
+        self.below = [[] for _ in self.thresholds]
+        # 回帰のモーメント（Chan らの並列アルゴリズムでチャンクごとに合成）
+        self.regression_count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.comoment_xx = 0.0
+        self.comoment_xy = 0.0
+        self.max_x = None
+
+    def update(self, chunk, x_chunk=None):
+        chunk = np.asarray(chunk, dtype=np.float64)
+        if chunk.size == 0:
+            return
+        offset = self.count
+
+        # 合計は np.sum（チャンク内）と Neumaier 加算（チャンク間）
+        chunk_sum = float(np.sum(chunk))
+        total = self.sum + chunk_sum
+        if abs(self.sum) >= abs(chunk_sum):
+            self.sum_compensation += (self.sum - total) + chunk_sum
+        else:
+            self.sum_compensation += (chunk_sum - total) + self.sum
+        self.sum = total
+
+        chunk_max = np.max(chunk)
+        chunk_min = np.min(chunk)
+        self.max = chunk_max if self.max is None else np.maximum(self.max, chunk_max)
+        self.min = chunk_min if self.min is None else np.minimum(self.min, chunk_min)
+
+        self.peaks.update(chunk, offset)
+        self.dips.update(chunk, offset)
+
+        for i, threshold in enumerate(self.thresholds):
+            above = np.flatnonzero(chunk > threshold)
+            below = np.flatnonzero(chunk < threshold)
+            self.above[i].append((above + offset, chunk[above]))
+            self.below[i].append((below + offset, chunk[below]))
+
+        if x_chunk is None:
+            x_chunk = np.arange(offset, offset + chunk.size, dtype=np.float64)
+        else:
+            x_chunk = np.asarray(x_chunk, dtype=np.float64)
+        self._update_regression(x_chunk, chunk)
+        self.count += chunk.size
+
+    def _update_regression(self, x_chunk, y_chunk):
+        n_b = x_chunk.size
+        mean_x_b = float(np.mean(x_chunk))
+        mean_y_b = float(np.mean(y_chunk))
+        dx = x_chunk - mean_x_b
+        comoment_xx_b = float(np.dot(dx, dx))
+        comoment_xy_b = float(np.dot(dx, y_chunk - mean_y_b))
+        n_a = self.regression_count
+        n = n_a + n_b
+        delta_x = mean_x_b - self.mean_x
+        delta_y = mean_y_b - self.mean_y
+        self.comoment_xx += comoment_xx_b + delta_x * delta_x * n_a * n_b / n
+        self.comoment_xy += comoment_xy_b + delta_x * delta_y * n_a * n_b / n
+        self.mean_x += delta_x * n_b / n
+        self.mean_y += delta_y * n_b / n
+        self.regression_count = n
+        chunk_max_x = float(np.max(x_chunk))
+        self.max_x = chunk_max_x if self.max_x is None else max(self.max_x, chunk_max_x)
+
+    def labels(self):
+        """
+        タスクごとのラベルを、既存スクリプトと同じフィールド名で返します。
+        ピーク・閾値の結果は NumPy 配列のまま返すので、書き出しには write_out_of_core_record() を使ってください。
+        """
+        if self.count == 0:
+            return {}
+        total = self.sum + self.sum_compensation
+        peak_indices, peak_values = self.peaks.result()
+        dip_indices, dip_values = self.dips.result()
+        labels = {
+            'max': {'calculated_gold_value': float(self.max)},
+            'min': {'calculated_gold_value': float(self.min)},
+            'sum': {'calculated_gold_value': total},
+            'ave': {'calculated_gold_value': total / self.count},
+            'peak': {'calculated_peak_values': peak_values, 'peak_indices': peak_indices},
+            'dip': {'calculated_values': dip_values, 'dip_indices': dip_indices},
+        }
+        if self.thresholds:
+            labels['exceed'] = [
+                self._threshold_label(threshold, parts)
+                for threshold, parts in zip(self.thresholds, self.above)
+            ]
+            labels['below'] = [
+                self._threshold_label(threshold, parts)
+                for threshold, parts in zip(self.thresholds, self.below)
+            ]
+        if self.regression_count >= 2 and self.comoment_xx > 0:
+            slope = self.comoment_xy / self.comoment_xx
+            intercept = self.mean_y - slope * self.mean_x
+            next_x = self.max_x + 1
+            labels['fcst'] = {
+                'calculated_next_value_regression': slope * next_x + intercept,
+                'next_year_for_prediction': next_x,
+                'regression_slope': slope,
+                'regression_intercept': intercept,
+            }
+        return labels
+
+    @staticmethod
+    def _threshold_label(threshold, parts):
+        indices = np.concatenate([p[0] for p in parts]) if parts else np.zeros(0, dtype=np.int64)
+        values = np.concatenate([p[1] for p in parts]) if parts else np.zeros(0)
+        return {
+            'threshold_value': threshold,
+            'values_above_threshold': values,
+            'threshold_indices': indices,
+            'threshold_count': int(values.size),
+        }
+
+
+def evaluate_chunked_series(value_chunks, x_chunks=None, thresholds=()):
+    """
+    値のチャンク（と同じ長さの x 軸のチャンク）からラベルを計算します。
+    x 軸のチャンクの数が値のチャンクと異なる場合は ValueError を送出します。
+    """
+    accumulator = ChunkedSeriesAccumulator(thresholds)
+    if x_chunks is None:
+        for chunk in value_chunks:
+            accumulator.update(chunk)
+    else:
+        # 片方だけが先に尽きた場合も長さの不一致として扱う
+        for chunk, x_chunk in itertools.zip_longest(value_chunks, x_chunks):
+            if chunk is None or x_chunk is None or len(chunk) != len(x_chunk):
+                raise ValueError("'values' と 'years_column' の長さが一致しません。")
+            accumulator.update(chunk, x_chunk)
+    return accumulator.labels()
+
+
+def generate_out_of_core_record(file_path, thresholds=None, use_years=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    巨大な1レコードのJSONファイルからラベルを計算し、出力用の辞書を返します。
+    出力には values/years_column を埋め込まず、元ファイル内の位置（values_ref/years_column_ref）で参照します。
+    thresholds を省略した場合は既存スクリプトと同様に [min, max] の一様乱数（小数第1位に丸め）を使うため、
+    最初の走査で min/max を求め、閾値ラベル用にもう一度走査します。
+    """
+    values_span = {}
+    years_span = {}
+    record_has_years = use_years and _has_array(file_path, 'years_column')
+
+    def run(threshold_list):
+        value_chunks = iter_json_array_chunks(file_path, 'values', chunk_size, span=values_span)
+        year_chunks = iter_json_array_chunks(file_path, 'years_column', chunk_size, span=years_span) if record_has_years else None
+        return evaluate_chunked_series(value_chunks, year_chunks, threshold_list)
+
+    if thresholds is None:
+        labels = run(())
+        if labels:
+            min_val = labels['min']['calculated_gold_value']
+            max_val = labels['max']['calculated_gold_value']
+            threshold_val = round(min_val, 1) if min_val == max_val else round(np.random.uniform(min_val, max_val), 1)
+            labels = run([threshold_val])
+    else:
+        labels = run(thresholds)
+
+    spans = [values_span] + ([years_span] if years_span else [])
+    record = load_record_without_arrays(file_path, spans)
+    record.pop('values', None)
+    record.pop('years_column', None)
+    record['values_ref'] = {'path': file_path, 'format': 'json', 'key': 'values', **values_span}
+    if years_span:
+        record['years_column_ref'] = {'path': file_path, 'format': 'json', 'key': 'years_column', **years_span}
+    record['labels'] = labels
+    return record
+
+
+def _has_array(file_path, key):
+    try:
+        next(iter_json_array_chunks(file_path, key, chunk_size=1), None)
+    except KeyError:
+        return False
+    return True
+
+
+def _write_json_value(outfile, value, chunk_size):
+    # NumPy 配列はチャンクごとに文字列化し、全体を一度に Python のリストにしない
+    if isinstance(value, np.ndarray):
+        outfile.write('[')
+        for start in range(0, value.size, chunk_size):
+            if start:
+                outfile.write(', ')
+            outfile.write(json.dumps(value[start:start + chunk_size].tolist())[1:-1])
+        outfile.write(']')
+    elif isinstance(value, dict):
+        outfile.write('{')
+        for i, (key, item) in enumerate(value.items()):
+            if i:
+                outfile.write(', ')
+            outfile.write(json.dumps(key, ensure_ascii=False) + ': ')
+            _write_json_value(outfile, item, chunk_size)
+        outfile.write('}')
+    elif isinstance(value, list):
+        outfile.write('[')
+        for i, item in enumerate(value):
+            if i:
+                outfile.write(', ')
+            _write_json_value(outfile, item, chunk_size)
+        outfile.write(']')
+    else:
+        outfile.write(json.dumps(value, ensure_ascii=False))
+
+
+def write_out_of_core_record(outfile, record, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    generate_out_of_core_record() の結果を1行のJSONとして書き出します。
+    """
+    _write_json_value(outfile, record, chunk_size)
+    outfile.write('\n')
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("使い方: python label_outofcore.py <入力JSONファイル> [出力JSONLファイル]", file=sys.stderr)
+        sys.exit(1)
+    input_json_file = sys.argv[1]
+    output_jsonl_file = sys.argv[2] if len(sys.argv) > 2 else "outofcore_output.jsonl"
+    if not os.path.exists(input_json_file):
+        print(f"エラー: ファイル '{input_json_file}' が見つかりません。", file=sys.stderr)
+        sys.exit(1)
+
+    result_record = generate_out_of_core_record(input_json_file)
+    with open(output_jsonl_file, 'w', encoding='utf-8') as outfile:
+        write_out_of_core_record(outfile, result_record)
+    print(f"処理結果を '{output_jsonl_file}' に書き出しました。", file=sys.stderr)
@@ -0,0 +1,104 @@
+import numpy as np
+
+# ラベル生成の途中結果を保持するコンパクトなレコード型
+# 既存スクリプトはタスクごとに {**dataset, 'years_column': years.tolist(), 'values': values.tolist(), ...}
+# を作りますが、SeriesRecord は元のデータセットへの参照と NumPy 配列、ラベルのフィールドだけを持ち、
+# 辞書への変換は書き出すとき（to_dict()）にだけ行います。
+
+
+class DisplayArray:
+    """
+    表示用の文字列の配列として書き出す float 配列の目印です（generate_imp_label の values_with_nan_display）。
+    label_json は配列から直接書き出し、to_dict() では tolist() で文字列のリストにします。
+    """
+
+    __slots__ = ('array',)
+
+    def __init__(self, array):
+        self.array = array
+
+    def tolist(self):
+        return ['NaN' if value != value else str(value) for value in self.array.tolist()]
+
+
+class SeriesRecord:
+    """
+    1レコード分のラベル生成結果です。
+
+    dataset : 元のデータセット（コピーせずに参照する。'values' 以外のフィールドはそのまま出力される）
+    values  : float64 の値の配列（None の場合は元のデータセットの values をそのまま出力する）
+    years   : years_column の配列（None の場合は元のデータセットの years_column をそのまま出力する）
+    labels  : タスクが計算したフィールドの辞書（出力の末尾に追加される。NumPy 配列のままでもよい）
+    """
+
+    __slots__ = ('dataset', 'values', 'years', 'labels')
+
+    def __init__(self, dataset, values, years=None, labels=None):
+        self.dataset = dataset
+        self.values = values
+        self.years = years
+        self.labels = labels if labels is not None else {}
+
+    @classmethod
+    def from_dataset(cls, dataset, with_years=True):
+        """
+        データセットの values（と years_column）を配列に変換して SeriesRecord を作ります。
+        """
+        values = np.array(dataset['values'], dtype=float)
+        years = np.array(dataset.get('years_column', [])) if with_years else None
+        return cls(dataset, values, years)
+
+    @property
+    def id(self):
+        return self.dataset.get('id')
+
+    def with_labels(self, labels):
+        """
+        配列と元のデータセットを共有したまま、ラベルだけが異なる SeriesRecord を返します。
+        """
+        return SeriesRecord(self.dataset, self.values, self.years, labels)
+
+    def years_output(self):
+        # 既存スクリプトと同じく、空の years_column は元の値をそのまま出力する
+        if self.years is None or self.years.size == 0:
+            return self.dataset.get('years_column', [])
+        return self.years.tolist()
+
+    def get(self, key, default=None):
+        """
+        to_dict().get(key, default) と同じ値を、辞書全体を作らずに返します。
+        """
+        if key in self.labels:
+            return _plain(self.labels[key])
+        if key == 'values' and self.values is not None:
+            return self.values.tolist()
+        if key == 'years_column' and self.years is not None:
+            return self.years_output()
+        return self.dataset.get(key, default)
+
+    def to_dict(self):
+        """
+        既存スクリプトの出力と同じキーの順序・値の辞書に変換します。
+        """
+        result_item = dict(self.dataset)
+        if self.years is not None:
+            result_item['years_column'] = self.years_output()
+        if self.values is not None:
+            result_item['values'] = self.values.tolist()
+        for key, value in self.labels.items():
+            result_item[key] = _plain(value)
+        return result_item
+
+
+def _plain(value):
+    # ラベルの NumPy 配列と DisplayArray は書き出すときにだけリストにする
+    return value.tolist() if isinstance(value, (np.ndarray, DisplayArray)) else value
+
+
+def to_output_dict(result_item):
+    """
+    SeriesRecord なら辞書に変換し、辞書ならそのまま返します。
+    """
+    if isinstance(result_item, SeriesRecord):
+        return result_item.to_dict()
+    return result_item
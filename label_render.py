@@ -0,0 +1,263 @@
+import json
+import string
+import sys
+
+from label_io import iter_datasets_from_jsonl, open_jsonl_input, open_jsonl_output
+
+# ラベル付きの結果から LLM 用の質問（prompt）と答え（answer）をまとめて作るモジュール
+# タスクごとのテンプレートは最初に一度だけ解析（コンパイル）し、系列の本文（"年: 値" の並び）は
+# バッチ内のレコードごとに一度だけ作って、同じバッチの複数のタスクで使い回します。
+# label_writer.py の --prompts を指定すると、ラベル生成と同じパスでタスクごとの prompt/answer JSONL を書き出します。
+
+PROMPT_FILE_SUFFIX = '_prompts.jsonl'
+
+# 共通のフィールド: value_header、series（系列の本文）
+# タスクごとのフィールドは TASK_FIELDS の関数が結果から作ります。
+TEMPLATES = {
+    'max': ("{series}\nWhat is the maximum value of {value_header} in this series?", "{answer}"),
+    'min': ("{series}\nWhat is the minimum value of {value_header} in this series?", "{answer}"),
+    'ave': ("{series}\nWhat is the average value of {value_header} in this series?", "{answer}"),
+    'sum': ("{series}\nWhat is the sum of all values of {value_header} in this series?", "{answer}"),
+    'maxtime': ("{series}\nWhat is the latest year in this series of {value_header}?", "{answer}"),
+    'mintime': ("{series}\nWhat is the earliest year in this series of {value_header}?", "{answer}"),
+    'argmaxtime': ("{series}\nIn which year did {value_header} reach its maximum?", "{answer}"),
+    'argmintime': ("{series}\nIn which year did {value_header} reach its minimum?", "{answer}"),
+    'comp': ("{series}\nCompare the value of {value_header} in {start} with the value in {end}. "
+             "Answer with '>', '<' or '='.", "{answer}"),
+    'dif': ("{series}\nWhat is the absolute difference in {value_header} between {start} and {end}?", "{answer}"),
+    'fcst': ("{series}\nUsing a linear trend, predict the value of {value_header} for {next_year}.", "{answer}"),
+    'imp': ("{series}\nOne value of {value_header} is missing (NaN) in {missing}. "
+            "Estimate it by linear interpolation.", "{answer}"),
+    'exceed': ("{series}\nList all values of {value_header} greater than {threshold}.", "{answer}"),
+    'below': ("{series}\nList all values of {value_header} less than {threshold}.", "{answer}"),
+    'peak': ("{series}\nList the values of {value_header} at local peaks of this series.", "{answer}"),
+    'dip': ("{series}\nList the values of {value_header} at local dips of this series.", "{answer}"),
+    'rangemax': ("{series}\nWhat is the maximum value of {value_header} from {start} to {end}?", "{answer}"),
+    'rangemin': ("{series}\nWhat is the minimum value of {value_header} from {start} to {end}?", "{answer}"),
+    'rangeave': ("{series}\nWhat is the average value of {value_header} from {start} to {end}?", "{answer}"),
+    'rangesum': ("{series}\nWhat is the sum of the values of {value_header} from {start} to {end}?", "{answer}"),
+    'order': ("{series}\nWhat is the median value of {value_header} in this series?", "{answer}"),
+}
+
+
+def _number_text(value):
+    # 整数の値は小数点なしで、それ以外は float の repr（JSON の出力と同じ桁数）で表す
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def _list_text(values):
+    return ', '.join(_number_text(value) for value in values) if values else 'none'
+
+
+def _point_text(result_item, index):
+    # 位置 index の時点を、年があれば年で、なければ位置で表す
+    years = result_item.get('years_column') or []
+    if index is None:
+        return None
+    if 0 <= index < len(years):
+        return str(years[index])
+    return f"position {index}"
+
+
+def _gold(field, formatter=_number_text):
+    def fields(result_item):
+        value = result_item.get(field)
+        return None if value is None else {'answer': formatter(value)}
+    return fields
+
+
+def _range(field, start_key, end_key):
+    def fields(result_item):
+        value = result_item.get(field)
+        if value is None or result_item.get(start_key) is None:
+            return None
+        return {
+            'answer': _number_text(value),
+            'start': _point_text(result_item, result_item.get(start_key)),
+            'end': _point_text(result_item, result_item.get(end_key)),
+        }
+    return fields
+
+
+def _threshold(result_item):
+    if result_item.get('threshold_value') is None:
+        return None
+    return {
+        'answer': _list_text(result_item.get('values_above_threshold')),
+        'threshold': _number_text(result_item.get('threshold_value')),
+    }
+
+
+def _fcst(result_item):
+    value = result_item.get('calculated_next_value_regression')
+    if value is None:
+        return None
+    return {'answer': _number_text(value), 'next_year': _number_text(result_item.get('next_year_for_prediction'))}
+
+
+def _imp(result_item):
+    value = result_item.get('gold_interpolated_value')
+    if value is None:
+        return None
+    return {'answer': _number_text(value), 'missing': _point_text(result_item, result_item.get('nan_index'))}
+
+
+# タスクごとに結果から answer とテンプレートのフィールドを作る関数（ラベルがない結果では None）
+TASK_FIELDS = {
+    'max': _gold('calculated_gold_value'),
+    'min': _gold('calculated_gold_value'),
+    'ave': _gold('calculated_gold_value'),
+    'sum': _gold('calculated_gold_value'),
+    'maxtime': _gold('calculated_gold_value', str),
+    'mintime': _gold('calculated_gold_value', str),
+    'argmaxtime': _gold('calculated_gold_value', str),
+    'argmintime': _gold('calculated_gold_value', str),
+    'comp': _range('calculated_comparison_symbol', 'comparison_start_index', 'comparison_end_index'),
+    'dif': _range('calculated_difference', 'difference_start_index', 'difference_end_index'),
+    'fcst': _fcst,
+    'imp': _imp,
+    'exceed': _threshold,
+    'below': _threshold,
+    'peak': _gold('calculated_peak_values', _list_text),
+    'dip': _gold('calculated_values', _list_text),
+    'rangemax': _range('calculated_range_max', 'range_start_index', 'range_end_index'),
+    # rangemin/rangeave/rangesum の結果は calculated_range_min に入っている
+    'rangemin': _range('calculated_range_min', 'range_start_index', 'range_end_index'),
+    'rangeave': _range('calculated_range_min', 'range_start_index', 'range_end_index'),
+    'rangesum': _range('calculated_range_min', 'range_start_index', 'range_end_index'),
+    'order': _gold('calculated_median'),
+}
+
+# 系列の本文に使う値のフィールド（既定は 'values'）
+SERIES_FIELDS = {
+    'imp': 'values_with_nan_display',
+    'fcst': 'original_values_for_regression',
+}
+
+
+class CompiledTemplate:
+    """
+    str.format 形式のテンプレートを一度だけ解析し、文字列の断片とフィールド名の並びとして保持します。
+    """
+
+    __slots__ = ('template', 'pieces', 'field_names')
+
+    def __init__(self, template):
+        self.template = template
+        self.pieces = []
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(template):
+            if literal:
+                self.pieces.append((True, literal))
+            if field_name is not None:
+                if format_spec or conversion:
+                    raise ValueError(f"テンプレートの書式指定には対応していません: '{template}'")
+                self.pieces.append((False, field_name))
+        self.field_names = [piece for is_literal, piece in self.pieces if not is_literal]
+
+    def render(self, fields):
+        return ''.join([piece if is_literal else fields[piece] for is_literal, piece in self.pieces])
+
+
+def compile_templates(templates=TEMPLATES):
+    return {task_name: (CompiledTemplate(question), CompiledTemplate(answer))
+            for task_name, (question, answer) in templates.items()}
+
+
+def _series_text(values, years):
+    if len(years) == len(values):
+        return '\n'.join([f"{year}: {_number_text(value)}" for year, value in zip(years, values)])
+    return ', '.join([_number_text(value) for value in values])
+
+
+class SeriesTextCache:
+    """
+    バッチ内の系列の本文（"年: 値" を改行でつないだもの）を、同じ内容の系列ごとに一度だけ作ります。
+    キーは値のフィールド名と、値・年の内容（型を含む）です。id が重複したり、タスクによって
+    同じ id の値が異なったりしても、別の系列の本文を返すことはありません。
+    """
+
+    def __init__(self):
+        self._texts = {}
+
+    def get(self, result_item, values_field):
+        values = result_item.get(values_field) or []
+        years = result_item.get('years_column') or []
+        # 1 と 1.0、2019 と 2019.0 は等しいが本文が異なるため、型もキーに含める
+        key = (values_field, tuple(values), tuple(map(type, values)), tuple(years), tuple(map(type, years)))
+        try:
+            text = self._texts.get(key)
+        except TypeError:
+            # リストなどハッシュできない要素を含む系列はキャッシュしない
+            return _series_text(values, years)
+        if text is None:
+            text = self._texts[key] = _series_text(values, years)
+        return text
+
+
+class PromptRenderer:
+    """
+    コンパイル済みのテンプレートでタスクの結果（辞書または label_record.SeriesRecord）を prompt/answer の辞書に変換します。
+    """
+
+    def __init__(self, templates=TEMPLATES):
+        self.compiled = compile_templates(templates)
+
+    def render_batch(self, task_name, results, cache=None):
+        """
+        1バッチ分の結果を {'id', 'task', 'prompt', 'answer'} のリストにします。ラベルのない結果は除きます。
+        """
+        question, answer = self.compiled[task_name]
+        task_fields = TASK_FIELDS[task_name]
+        values_field = SERIES_FIELDS.get(task_name, 'values')
+        cache = cache if cache is not None else SeriesTextCache()
+        items = []
+        for result_item in results:
+            fields = task_fields(result_item)
+            if fields is None:
+                continue
+            fields['value_header'] = result_item.get('value_header') or 'the value'
+            fields['series'] = cache.get(result_item, values_field)
+            items.append({
+                'id': result_item.get('id'),
+                'task': task_name,
+                'prompt': question.render(fields),
+                'answer': answer.render(fields),
+            })
+        return items
+
+
+def prompt_file_name(task_name):
+    return f"{task_name}{PROMPT_FILE_SUFFIX}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='既存のラベルの出力ファイルから prompt/answer JSONL を作ります。')
+    parser.add_argument('task', choices=sorted(TEMPLATES))
+    parser.add_argument('input', help="タスクの出力JSONL（'-' で標準入力）")
+    parser.add_argument('output', nargs='?', default=None, help="出力JSONL（既定: <task>_prompts.jsonl、'-' で標準出力）")
+    args = parser.parse_args()
+
+    output_path = args.output or prompt_file_name(args.task)
+    renderer = PromptRenderer()
+    count = 0
+    try:
+        with open_jsonl_input(args.input) as infile, open_jsonl_output(output_path) as outfile:
+            batch = []
+            for result_item in iter_datasets_from_jsonl(infile, args.input):
+                batch.append(result_item)
+                if len(batch) >= 1024:
+                    items = renderer.render_batch(args.task, batch)
+                    outfile.write(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items))
+                    count += len(items)
+                    batch = []
+            items = renderer.render_batch(args.task, batch)
+            outfile.write(''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items))
+            count += len(items)
+    except FileNotFoundError:
+        print(f"エラー: ファイル '{args.input}' が見つかりません。", file=sys.stderr)
+        sys.exit(1)
+    print(f"{count} 件の prompt/answer を '{output_path}' に書き出しました。", file=sys.stderr)
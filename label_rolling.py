@@ -0,0 +1,159 @@
+import sys
+
+import numpy as np
+
+from label_backends import get_kernel
+from label_io import run_stream_cli
+from label_numeric import TypedBatch, decode_dataset_column, select_segments, segmented_cumsum, window_sums
+
+# 移動統計量（移動平均、移動合計、移動最大・最小、移動標準偏差）のラベル
+# 窓の和は系列ごとの累積和の差で、移動最大・最小は label_backends の rolling_extrema カーネル
+# （NumPy では van Herk / Gil-Werman 法、ループ実装では単調な両端キュー）で求めるため、
+# 窓の大きさによらず1系列あたり O(n) で、バッチ全体をまとめて計算します。
+# 各リストの k 番目の値は values[k:k + window] の窓の統計量です（窓の末尾の年は years_column[k + window - 1]）。
+# 標準偏差は np.std と同じく母標準偏差（ddof=0）です。NaN・無限大を含む窓の値は np.sum / np.std などと同じになります。
+
+DEFAULT_WINDOW = 3
+# 窓の分散が系列全体の分散のこの割合以下なら、その窓は直接計算し直す
+RECOMPUTE_TOLERANCE = 1e-4
+# 出力の移動統計量のキーと rolling_statistics() の戻り値のキーの対応
+ROLLING_FIELDS = {
+    'calculated_moving_average': 'mean',
+    'calculated_rolling_sum': 'sum',
+    'calculated_rolling_max': 'max',
+    'calculated_rolling_min': 'min',
+    'calculated_rolling_std': 'std',
+}
+
+
+def _exact_windows(buffer, starts, window):
+    # 指定した開始位置の窓だけを直接（窓ごとに2パスで）計算する
+    windows = buffer[starts[:, None] + np.arange(window)]
+    with np.errstate(invalid='ignore'):  # 無限大を含む窓は np.std と同じく NaN にする
+        return windows.sum(axis=1), windows.std(axis=1)
+
+
+def rolling_statistics(buffer, offsets, window=DEFAULT_WINDOW):
+    """
+    連結バッファの各区間について、区間内に収まる長さ window の窓ごとの統計量をまとめて計算します。
+    戻り値は {'sum', 'mean', 'max', 'min', 'std', 'counts'} の辞書で、counts は区間ごとの窓の数です。
+    """
+    lengths = np.diff(offsets)
+    counts = np.maximum(lengths - window + 1, 0)
+
+    # NaN・無限大は累積和に入れず、それを含む窓はあとで直接計算する
+    finite = np.isfinite(buffer)
+    finite_buffer = np.where(finite, buffer, 0.0)
+    non_finite_counts, starts = window_sums(segmented_cumsum((~finite).astype(np.float64), offsets), offsets, window)
+    sums, _ = window_sums(segmented_cumsum(finite_buffer, offsets), offsets, window)
+
+    # 分散は系列の平均を引いてから2乗和を取り、桁落ちを抑える
+    nonempty = lengths > 0
+    finite_lengths = np.zeros(lengths.size)
+    series_sums = np.zeros(lengths.size)
+    finite_lengths[nonempty] = np.add.reduceat(finite, offsets[:-1][nonempty])
+    series_sums[nonempty] = np.add.reduceat(finite_buffer, offsets[:-1][nonempty])
+    series_means = series_sums / np.maximum(finite_lengths, 1)
+    centered = np.where(finite, buffer - np.repeat(series_means, lengths), 0.0)
+    series_variances = np.zeros(lengths.size)
+    series_variances[nonempty] = np.add.reduceat(centered * centered, offsets[:-1][nonempty])
+    series_variances /= np.maximum(finite_lengths, 1)
+    centered_sums, _ = window_sums(segmented_cumsum(centered, offsets), offsets, window)
+    centered_squares, _ = window_sums(segmented_cumsum(centered * centered, offsets), offsets, window)
+    variances = np.maximum(centered_squares / window - (centered_sums / window) ** 2, 0.0)
+    stds = np.sqrt(variances)
+
+    # 系列全体に比べて分散がごく小さい窓は累積和の差の丸め誤差が目立つため、
+    # 非有限値を含む窓と合わせて窓ごとに直接計算し直す（通常はごく一部なので全体は O(n) のまま）
+    exact = np.flatnonzero((non_finite_counts > 0)
+                           | (variances <= RECOMPUTE_TOLERANCE * np.repeat(series_variances, counts)))
+    if exact.size > 0:
+        sums[exact], stds[exact] = _exact_windows(buffer, starts[exact], window)
+
+    rolling_extrema = get_kernel('rolling_extrema')
+    return {
+        'sum': sums,
+        'mean': sums / window,
+        'max': rolling_extrema(buffer, offsets, window, True),
+        'min': rolling_extrema(buffer, offsets, window, False),
+        'std': stds,
+        'counts': counts,
+    }
+
+
+def _build_results(datasets, buffer, offsets, window):
+    statistics = rolling_statistics(buffer, offsets, window)
+    window_offsets = np.zeros(len(datasets) + 1, dtype=np.int64)
+    np.cumsum(statistics['counts'], out=window_offsets[1:])
+
+    results = []
+    for i, dataset in enumerate(datasets):
+        windows = slice(window_offsets[i], window_offsets[i + 1])
+        years = np.array(dataset.get('years_column', []))
+        results.append({
+            **dataset,
+            'years_column': years.tolist() if years.size > 0 else dataset.get('years_column', []),
+            'values': buffer[offsets[i]:offsets[i + 1]].tolist(),
+            'rolling_window': window,
+            **{field: statistics[name][windows].tolist() for field, name in ROLLING_FIELDS.items()},
+        })
+    return results
+
+
+def generate_rolling_statistics_and_create_dictionary(dataset, window=DEFAULT_WINDOW):
+    """
+    'values' の長さ window の移動統計量を計算し、元のデータセットの情報と合わせて新しい辞書を作成します。
+    """
+    if 'values' not in dataset or not dataset['values']:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' には 'values' キーが存在しないか、空です。移動統計量を計算できません。")
+        # 窓が1つもない場合と同じく、すべての移動統計量を空のリストで返す
+        return {
+            **dataset,
+            'rolling_window': window,
+            **{field: [] for field in ROLLING_FIELDS},
+        }
+
+    values = np.array(dataset['values'], dtype=float)
+    if len(values) < window:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'values' の要素が窓の大きさ {window} 未満です。移動統計量を計算できません。")
+
+    offsets = np.array([0, len(values)], dtype=np.int64)
+    return _build_results([dataset], values, offsets, window)[0]
+
+
+def batch_rolling_statistics(datasets, fallback_function):
+    """
+    バッチカーネル: 窓の大きさ以上の数値の系列をまとめて処理し、それ以外は fallback_function に任せます。
+    """
+    if isinstance(datasets, TypedBatch):
+        buffer, offsets, bad_values = datasets.buffer, datasets.offsets, {}
+    else:
+        buffer, offsets, bad_values = decode_dataset_column(datasets, 'values')
+    lengths = np.diff(offsets)
+    valid_positions = [p for p in range(len(datasets)) if p not in bad_values and lengths[p] >= DEFAULT_WINDOW]
+
+    results = [None] * len(datasets)
+    if valid_positions:
+        valid_buffer, valid_offsets = select_segments(buffer, offsets, valid_positions)
+        built = _build_results([datasets[p] for p in valid_positions], valid_buffer, valid_offsets, DEFAULT_WINDOW)
+        for position, result_item in zip(valid_positions, built):
+            results[position] = result_item
+    for position, dataset in enumerate(datasets):
+        if results[position] is None:
+            results[position] = fallback_function(dataset)
+    return results
+
+
+if __name__ == "__main__":
+    import argparse
+    import functools
+
+    # 例: python label_rolling.py test.jsonl rolling_output.jsonl --window 5
+    window_parser = argparse.ArgumentParser(add_help=False)
+    window_parser.add_argument('--window', type=int, default=DEFAULT_WINDOW)
+    window_args, remaining_argv = window_parser.parse_known_args()
+    if window_args.window < 1:
+        print("エラー: --window には1以上を指定してください。", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(run_stream_cli(functools.partial(generate_rolling_statistics_and_create_dictionary, window=window_args.window),
+                            remaining_argv, "rolling_output.jsonl"))
@@ -0,0 +1,286 @@
+import contextlib
+import hashlib
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+
+from label_io import iter_datasets_from_jsonl, open_jsonl_input, open_jsonl_output
+
+# モデルの予測を、生成した gold のラベルと突き合わせて採点するモジュール
+# 予測の JSONL（1行に {"id", "task", "prediction"}）と各タスクの出力ファイルを (id, タスク) で結合します。
+# gold が大きい場合は、両方を (id, タスク) のハッシュで partitions 個の一時ファイルに分け（grace hash join）、
+# 分割ごとに gold だけを辞書に読み込んで予測を流すため、メモリ使用量は gold 全体 / partitions 程度に収まります。
+#
+# タスクごとの採点方法:
+#   numeric : 数値の許容誤差（|予測 - gold| <= atol + rtol * |gold|）で正解かどうか
+#   set     : 値の集合（重複を数える）の F1（peak/dip の極値、exceed/below の値のリスト）
+#   exact   : 文字列の完全一致（comp の記号、maxtime/mintime の年など）
+# 同じ (id, タスク) への2つ目以降の予測と、gold のない予測は unmatched_predictions として数えます。
+
+DEFAULT_RTOL = 1e-2
+DEFAULT_ATOL = 1e-6
+# set の値を比べるときに丸める小数点以下の桁数
+SET_DECIMALS = 6
+# 1つの分割に読み込む gold のおおよそのバイト数
+PARTITION_BYTES = 256 << 20
+
+# タスク -> (採点方法, gold のフィールド)
+SCORING = {
+    'max': ('numeric', 'calculated_gold_value'),
+    'min': ('numeric', 'calculated_gold_value'),
+    'ave': ('numeric', 'calculated_gold_value'),
+    'sum': ('numeric', 'calculated_gold_value'),
+    'maxtime': ('exact', 'calculated_gold_value'),
+    'mintime': ('exact', 'calculated_gold_value'),
+    'argmaxtime': ('exact', 'calculated_gold_value'),
+    'argmintime': ('exact', 'calculated_gold_value'),
+    'comp': ('exact', 'calculated_comparison_symbol'),
+    'dif': ('numeric', 'calculated_difference'),
+    'fcst': ('numeric', 'calculated_next_value_regression'),
+    'imp': ('numeric', 'gold_interpolated_value'),
+    'exceed': ('set', 'values_above_threshold'),
+    'below': ('set', 'values_above_threshold'),
+    'peak': ('set', 'calculated_peak_values'),
+    'dip': ('set', 'calculated_values'),
+    'rangemax': ('numeric', 'calculated_range_max'),
+    # rangemin/rangeave/rangesum の結果は calculated_range_min に入っている
+    'rangemin': ('numeric', 'calculated_range_min'),
+    'rangeave': ('numeric', 'calculated_range_min'),
+    'rangesum': ('numeric', 'calculated_range_min'),
+    'order': ('numeric', 'calculated_median'),
+}
+
+_NUMBER_PATTERN = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?|[-+]?(?:inf|nan)\b', re.IGNORECASE)
+
+
+def _numbers_in(prediction):
+    # 予測（数値、数値のリスト、または "611, 636.6" のような文字列）に含まれる数値のリスト
+    if isinstance(prediction, bool) or prediction is None:
+        return []
+    if isinstance(prediction, (int, float)):
+        return [float(prediction)]
+    if isinstance(prediction, (list, tuple)):
+        numbers = []
+        for item in prediction:
+            numbers.extend(_numbers_in(item))
+        return numbers
+    return [float(token) for token in _NUMBER_PATTERN.findall(str(prediction))]
+
+
+def score_numeric(prediction, gold, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    numbers = _numbers_in(prediction)
+    if not numbers:
+        return 0.0
+    predicted = numbers[0]
+    return 1.0 if abs(predicted - gold) <= atol + rtol * abs(gold) else 0.0
+
+
+def score_set(prediction, gold):
+    """
+    予測と gold の値を SET_DECIMALS 桁に丸めた多重集合の F1 を返します（両方が空なら 1.0）。
+    """
+    predicted = {}
+    for number in _numbers_in(prediction):
+        key = round(number, SET_DECIMALS)
+        predicted[key] = predicted.get(key, 0) + 1
+    expected = {}
+    for number in gold:
+        key = round(float(number), SET_DECIMALS)
+        expected[key] = expected.get(key, 0) + 1
+    predicted_count = sum(predicted.values())
+    expected_count = sum(expected.values())
+    if predicted_count == 0 and expected_count == 0:
+        return 1.0
+    common = sum(min(count, expected.get(key, 0)) for key, count in predicted.items())
+    return 2.0 * common / (predicted_count + expected_count)
+
+
+def score_exact(prediction, gold):
+    if prediction is None:
+        return 0.0
+    return 1.0 if str(prediction).strip() == str(gold).strip() else 0.0
+
+
+def score_prediction(task_name, prediction, gold, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL):
+    method, _ = SCORING[task_name]
+    if method == 'numeric':
+        return score_numeric(prediction, gold, rtol, atol)
+    if method == 'set':
+        return score_set(prediction, gold)
+    return score_exact(prediction, gold)
+
+
+def _join_key(record_id, task_name):
+    return f"{task_name}\t{json.dumps(record_id, ensure_ascii=False, sort_keys=True)}"
+
+
+def _partition_of(key, partitions):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') % partitions
+
+
+def _gold_value(task_name, result_item):
+    # 採点に使う gold の値（ラベルがない、または NaN の場合は None）
+    gold = result_item.get(SCORING[task_name][1])
+    if gold is None or (isinstance(gold, float) and math.isnan(gold)):
+        return None
+    return gold
+
+
+class ScoreSummary:
+    """
+    タスクごとの採点結果の集計です（件数と得点の合計なので、分割ごとの集計を足し合わせられます）。
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def _task(self, task_name):
+        return self.tasks.setdefault(task_name, {
+            'scored': 0,
+            'score_sum': 0.0,
+            'missing_predictions': 0,
+            'unmatched_predictions': 0,
+            'unscorable_gold': 0,
+        })
+
+    def add_score(self, task_name, score):
+        counts = self._task(task_name)
+        counts['scored'] += 1
+        counts['score_sum'] += score
+
+    def count(self, task_name, key, amount=1):
+        self._task(task_name)[key] += amount
+
+    def report(self):
+        return {
+            task_name: {
+                **counts,
+                'mean_score': counts['score_sum'] / counts['scored'] if counts['scored'] else None,
+            }
+            for task_name, counts in sorted(self.tasks.items())
+        }
+
+
+def _iter_gold(gold_files):
+    # (結合キー, タスク, id, gold の値) を返す。ラベルのないものは gold の値が None
+    for task_name, gold_path in gold_files.items():
+        with open_jsonl_input(gold_path) as infile:
+            for result_item in iter_datasets_from_jsonl(infile, gold_path):
+                record_id = result_item.get('id')
+                yield _join_key(record_id, task_name), task_name, record_id, _gold_value(task_name, result_item)
+
+
+def _iter_predictions(predictions_path):
+    with open_jsonl_input(predictions_path) as infile:
+        for prediction_item in iter_datasets_from_jsonl(infile, predictions_path):
+            task_name = prediction_item.get('task')
+            record_id = prediction_item.get('id')
+            yield _join_key(record_id, task_name), task_name, record_id, prediction_item.get('prediction')
+
+
+def _score_partition(gold_rows, prediction_rows, summary, rtol, atol, scores_file):
+    gold = {}
+    for key, task_name, record_id, gold_value in gold_rows:
+        if gold_value is None:
+            summary.count(task_name, 'unscorable_gold')
+            continue
+        gold[key] = gold_value
+    for key, task_name, record_id, prediction in prediction_rows:
+        if task_name not in SCORING or key not in gold:
+            summary.count(task_name if task_name in SCORING else str(task_name), 'unmatched_predictions')
+            continue
+        score = score_prediction(task_name, prediction, gold.pop(key), rtol, atol)
+        summary.add_score(task_name, score)
+        if scores_file is not None:
+            scores_file.write(json.dumps({'id': record_id, 'task': task_name, 'score': score}, ensure_ascii=False) + '\n')
+    for key in gold:
+        summary.count(key.split('\t', 1)[0], 'missing_predictions')
+
+
+def _spill(rows, directory, prefix, partitions):
+    # 行を分割ごとの一時ファイルに書き出し、そのパスのリストを返す
+    paths = [os.path.join(directory, f'{prefix}-{index:04d}.jsonl') for index in range(partitions)]
+    files = [open(path, 'w', encoding='utf-8') for path in paths]
+    try:
+        for row in rows:
+            files[_partition_of(row[0], partitions)].write(json.dumps(row, ensure_ascii=False) + '\n')
+    finally:
+        for spill_file in files:
+            spill_file.close()
+    return paths
+
+
+def _read_spill(path):
+    with open(path, 'r', encoding='utf-8') as infile:
+        for line in infile:
+            yield json.loads(line)
+
+
+def default_partitions(gold_files):
+    """
+    gold のファイルの合計サイズから分割数を決めます（PARTITION_BYTES ごとに1つ）。
+    """
+    total = sum(os.path.getsize(path) for path in gold_files.values() if os.path.exists(path))
+    return max(1, -(-total // PARTITION_BYTES))
+
+
+def score_predictions(predictions_path, gold_files, partitions=None, rtol=DEFAULT_RTOL, atol=DEFAULT_ATOL,
+                      scores_path=None, work_dir=None):
+    """
+    予測を gold_files（{タスク名: 出力ファイル}）の gold と (id, タスク) で結合して採点し、ScoreSummary を返します。
+    scores_path を指定すると、予測ごとの得点を JSONL で書き出します（分割数が1より大きい場合は分割の順）。
+    """
+    unknown_tasks = [task_name for task_name in gold_files if task_name not in SCORING]
+    if unknown_tasks:
+        raise KeyError(f"採点方法が定義されていないタスクです: {unknown_tasks}")
+    partitions = partitions or default_partitions(gold_files)
+    summary = ScoreSummary()
+
+    with (open_jsonl_output(scores_path) if scores_path is not None else contextlib.nullcontext()) as scores_file:
+        if partitions == 1:
+            _score_partition(_iter_gold(gold_files), _iter_predictions(predictions_path), summary, rtol, atol, scores_file)
+            return summary
+        with tempfile.TemporaryDirectory(dir=work_dir) as spill_dir:
+            gold_paths = _spill(_iter_gold(gold_files), spill_dir, 'gold', partitions)
+            prediction_paths = _spill(_iter_predictions(predictions_path), spill_dir, 'predictions', partitions)
+            for gold_path, prediction_path in zip(gold_paths, prediction_paths):
+                _score_partition(_read_spill(gold_path), _read_spill(prediction_path), summary, rtol, atol, scores_file)
+                os.remove(gold_path)
+                os.remove(prediction_path)
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='モデルの予測を gold のラベルと突き合わせて採点します。')
+    parser.add_argument('predictions', help="予測のJSONL（1行に {\"id\", \"task\", \"prediction\"}、'-' で標準入力）")
+    parser.add_argument('--gold', action='append', required=True, metavar='TASK=PATH',
+                        help='タスクと gold の出力ファイル（複数指定可）')
+    parser.add_argument('--partitions', type=int, default=None, help='分割数（既定: gold の大きさから決める）')
+    parser.add_argument('--rtol', type=float, default=DEFAULT_RTOL)
+    parser.add_argument('--atol', type=float, default=DEFAULT_ATOL)
+    parser.add_argument('--scores', default=None, help='予測ごとの得点を書き出すJSONL')
+    parser.add_argument('--output', default='-', help="集計結果のJSON（既定: 標準出力）")
+    parser.add_argument('--work-dir', default=None, help='分割の一時ファイルを置くディレクトリ')
+    args = parser.parse_args()
+
+    gold_files = {}
+    for spec in args.gold:
+        task_name, separator, gold_path = spec.partition('=')
+        if not separator or task_name not in SCORING:
+            print(f"エラー: --gold は TASK=PATH の形式で、採点できるタスクを指定してください: '{spec}'", file=sys.stderr)
+            sys.exit(1)
+        gold_files[task_name] = gold_path
+
+    try:
+        score_summary = score_predictions(args.predictions, gold_files, args.partitions, args.rtol, args.atol,
+                                          args.scores, args.work_dir)
+    except FileNotFoundError as error:
+        print(f"エラー: ファイル '{error.filename}' が見つかりません。", file=sys.stderr)
+        sys.exit(1)
+    with open_jsonl_output(args.output) as outfile:
+        outfile.write(json.dumps(score_summary.report(), ensure_ascii=False, indent=2) + '\n')
@@ -0,0 +1,262 @@
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from label_intermediates import generate_labels_memoized
+from label_json import ArrayTextCache, dumps
+from label_tasks import TASKS, load_all_tasks
+
+
+def _label_batch(task_name, datasets):
+    # 結果は SeriesRecord のまま返し、レスポンスを作るときに label_json で直接書き出す
+    return generate_labels_memoized([task_name], datasets, compact=True)[task_name]
+
+
+class MicroBatcher:
+    """
+    同時に届いたリクエストをタスクごとにまとめ、バッチカーネルを1回で呼び出すためのクラスです。
+    最初のリクエストが届いてから max_latency_ms 経過するか、
+    レコード数が max_batch_size に達した時点でバッチを実行します。
+    """
+
+    def __init__(self, max_batch_size=256, max_latency_ms=5.0, workers=2):
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='label-batch')
+        self._queues = {}
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._metrics = {
+            'started_at': time.time(),
+            'requests_total': 0,
+            'records_total': 0,
+            'batches_total': 0,
+            'batch_records_total': 0,
+            'batch_seconds_total': 0.0,
+            'errors_total': 0,
+            'tasks': {},
+        }
+
+    def submit(self, task_name, datasets):
+        """
+        タスクとレコードのリストを投入し、結果のリストを受け取る Future を返します。
+        """
+        if task_name not in TASKS:
+            raise KeyError(f"未知のタスクです: '{task_name}'")
+        future = Future()
+        with self._lock:
+            task_queue = self._queues.get(task_name)
+            if task_queue is None:
+                task_queue = queue.Queue()
+                self._queues[task_name] = task_queue
+                collector = threading.Thread(
+                    target=self._collect, args=(task_name, task_queue),
+                    name=f'label-collector-{task_name}', daemon=True,
+                )
+                self._collectors[task_name] = collector
+                collector.start()
+            self._metrics['requests_total'] += 1
+            self._metrics['records_total'] += len(datasets)
+        task_queue.put((datasets, future))
+        return future
+
+    def _collect(self, task_name, task_queue):
+        while True:
+            item = task_queue.get()
+            if item is None:
+                break
+            items = [item]
+            record_count = len(item[0])
+            deadline = time.monotonic() + self.max_latency
+            while record_count < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = task_queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    task_queue.put(None)
+                    break
+                items.append(item)
+                record_count += len(item[0])
+            self._executor.submit(self._run_batch, task_name, items)
+
+    def _run_batch(self, task_name, items):
+        datasets = []
+        for item_datasets, _ in items:
+            datasets.extend(item_datasets)
+        started = time.perf_counter()
+        try:
+            results = _label_batch(task_name, datasets)
+        except Exception:
+            # まとめたバッチが失敗した場合は、他のリクエストを巻き込まないようリクエストごとに実行し直す
+            self._run_items_separately(task_name, items)
+            return
+        elapsed = time.perf_counter() - started
+
+        with self._lock:
+            self._metrics['batches_total'] += 1
+            self._metrics['batch_records_total'] += len(datasets)
+            self._metrics['batch_seconds_total'] += elapsed
+            task_metrics = self._metrics['tasks'].setdefault(task_name, {'batches': 0, 'records': 0})
+            task_metrics['batches'] += 1
+            task_metrics['records'] += len(datasets)
+
+        offset = 0
+        for item_datasets, future in items:
+            future.set_result(results[offset:offset + len(item_datasets)])
+            offset += len(item_datasets)
+
+    def _run_items_separately(self, task_name, items):
+        for item_datasets, future in items:
+            try:
+                results = _label_batch(task_name, item_datasets)
+            except Exception as e:
+                with self._lock:
+                    self._metrics['errors_total'] += 1
+                future.set_exception(e)
+                continue
+            future.set_result(results)
+
+    def metrics(self):
+        with self._lock:
+            snapshot = json.loads(json.dumps(self._metrics))
+        batches = snapshot['batches_total']
+        snapshot['uptime_seconds'] = time.time() - snapshot.pop('started_at')
+        snapshot['mean_batch_size'] = snapshot['batch_records_total'] / batches if batches else 0.0
+        snapshot['mean_batch_seconds'] = snapshot['batch_seconds_total'] / batches if batches else 0.0
+        snapshot['max_batch_size'] = self.max_batch_size
+        snapshot['max_latency_ms'] = self.max_latency * 1000.0
+        return snapshot
+
+    def close(self):
+        with self._lock:
+            for task_queue in self._queues.values():
+                task_queue.put(None)
+        for collector in self._collectors.values():
+            collector.join()
+        self._executor.shutdown(wait=True)
+
+
+class LabelRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET  /health  : 稼働確認
+    GET  /metrics : バッチ処理の統計
+    POST /label   : {"tasks": [...], "records": [...]} を受け取り、タスクごとの結果を返す
+                    （"task" や "record" で単数指定も可能）
+    """
+
+    batcher = None
+    request_timeout = 60.0
+
+    def _send_json(self, status, payload):
+        self._send_body(status, json.dumps(payload, ensure_ascii=False))
+
+    def _send_results(self, results):
+        # json.dumps({'results': results}) と同じ文字列を、結果を辞書に変換せずに作る
+        cache = ArrayTextCache()
+        parts = [
+            json.dumps(name, ensure_ascii=False) + ': [' + ', '.join([dumps(item, False, cache) for item in items]) + ']'
+            for name, items in results.items()
+        ]
+        self._send_body(200, '{"results": {' + ', '.join(parts) + '}}')
+
+    def _send_body(self, status, text):
+        body = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'tasks': sorted(TASKS)})
+        elif self.path == '/metrics':
+            self._send_json(200, self.batcher.metrics())
+        else:
+            self._send_json(404, {'error': f"'{self.path}' は存在しません。"})
+
+    def do_POST(self):
+        if self.path != '/label':
+            self._send_json(404, {'error': f"'{self.path}' は存在しません。"})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            payload = json.loads(self.rfile.read(length).decode('utf-8'))
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send_json(400, {'error': f'リクエストが有効なJSONではありません: {e}'})
+            return
+
+        if not isinstance(payload, dict):
+            self._send_json(400, {'error': 'リクエストは JSON のオブジェクトで指定してください。'})
+            return
+
+        task_names = payload.get('tasks') or ([payload['task']] if 'task' in payload else [])
+        datasets = payload.get('records')
+        if datasets is None:
+            datasets = [payload['record']] if 'record' in payload else []
+        if not isinstance(task_names, list) or not all(isinstance(name, str) for name in task_names):
+            task_names = []
+        unknown = [name for name in task_names if name not in TASKS]
+        if (not task_names or unknown or not isinstance(datasets, list)
+                or not all(isinstance(dataset, dict) for dataset in datasets)):
+            self._send_json(400, {
+                'error': 'tasks と records を正しく指定してください。',
+                'unknown_tasks': unknown,
+            })
+            return
+
+        futures = {name: self.batcher.submit(name, datasets) for name in task_names}
+        try:
+            results = {name: future.result(timeout=self.request_timeout) for name, future in futures.items()}
+        except Exception as e:
+            self._send_json(500, {'error': f'ラベル生成中にエラーが発生しました: {e}'})
+            return
+        self._send_results(results)
+
+    def log_message(self, format, *args):
+        # アクセスログは stderr に出す（既定の動作と同じ）
+        sys.stderr.write(f"{self.address_string()} - {format % args}\n")
+
+
+def create_server(host='127.0.0.1', port=8765, max_batch_size=256, max_latency_ms=5.0, workers=2):
+    """
+    ラベル生成サーバーを作成します（serve_forever() はまだ呼びません）。
+    すべてのタスクのモジュールとスレッドプールは起動時に準備されます。
+    """
+    load_all_tasks()
+    batcher = MicroBatcher(max_batch_size=max_batch_size, max_latency_ms=max_latency_ms, workers=workers)
+    handler = type('BoundLabelRequestHandler', (LabelRequestHandler,), {'batcher': batcher})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.batcher = batcher
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='ローカルのラベル生成HTTPサーバー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch-size', type=int, default=256)
+    parser.add_argument('--max-latency-ms', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    server = create_server(args.host, args.port, args.max_batch_size, args.max_latency_ms, args.workers)
+    print(f"ラベル生成サーバーを http://{args.host}:{args.port} で起動しました。", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
@@ -0,0 +1,354 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from label_io import iter_datasets_from_jsonl
+from label_json import ArrayTextCache
+from label_stats import LabelStatistics, load_statistics, save_statistics, write_report
+from label_intermediates import generate_labels_memoized
+from label_tasks import TASKS, task_ensure_ascii, task_output_files
+from label_writer import FanOutWriter
+
+# 共有のローカルファイルシステムだけを使って、複数マシン（または複数プロセス）で
+# ラベル生成を分担するための shard / work / merge コマンド
+#
+#   作業ディレクトリの構成:
+#     run.json                   この実行の識別子（入力の指紋とシャード数などから決まる run_id）
+#     manifests/shard-0000.json  各シャードの定義（run_id を含む）
+#     shard-0000/                各シャードの出力（タスクごとのファイルと order.txt）
+#     shard-0000/stats.json      シャードのラベルの分布の要約（merge で結合してレポートにする）
+#     shard-0000/_DONE           シャードの処理が完了したことを示す印
+#
+# 乱数を使うタスクはレコードの id から決まるシードで計算するため、
+# ラベルはシャード数や分割方法に関係なく同じになります。
+
+RUN_FILE = 'run.json'
+ORDER_FILE = 'order.txt'
+STATS_FILE = 'stats.json'
+REPORT_FILE = 'label_stats.json'
+DONE_FILE = '_DONE'
+
+
+def shard_of_id(record_id, num_shards):
+    """
+    id のハッシュからシャード番号を決めます（プロセスによらず同じ値）。
+    """
+    key = json.dumps(record_id, ensure_ascii=False, sort_keys=True).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), 'little') % num_shards
+
+
+def build_line_index(input_path):
+    """
+    入力JSONLの各行の開始バイト位置のリストを返します（最後の要素はファイルサイズ）。
+    """
+    offsets = [0]
+    with open(input_path, 'rb') as infile:
+        for line in infile:
+            offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def input_fingerprint(input_path):
+    """
+    入力ファイルの指紋（絶対パス・サイズ・更新時刻から決まる文字列）を返します。
+    """
+    status = os.stat(input_path)
+    key = f'{os.path.abspath(input_path)}\0{status.st_size}\0{status.st_mtime_ns}'.encode('utf-8')
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+def _run_id(fingerprint, num_shards, task_names, mode, seed):
+    key = json.dumps([fingerprint, num_shards, list(task_names), mode, seed], ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+
+def _clear_work_dir(work_dir):
+    # 前の実行が残したものだけ（run.json、manifests/、shard-*/）を消す
+    run_path = os.path.join(work_dir, RUN_FILE)
+    if os.path.exists(run_path):
+        os.remove(run_path)
+    for name in os.listdir(work_dir):
+        path = os.path.join(work_dir, name)
+        if os.path.isdir(path) and (name == 'manifests' or name.startswith('shard-')):
+            shutil.rmtree(path)
+
+
+def _manifest_path(work_dir, shard_index):
+    return os.path.join(work_dir, 'manifests', f'shard-{shard_index:04d}.json')
+
+
+def _shard_dir(work_dir, shard_index):
+    return os.path.join(work_dir, f'shard-{shard_index:04d}')
+
+
+def create_shards(input_path, num_shards, work_dir, task_names, mode='hash', seed=0, overwrite=False):
+    """
+    入力を num_shards 個のシャードに分け、作業ディレクトリにシャードの定義（manifest）を書き出します。
+    mode='hash' は id のハッシュで分け（各ワーカーは入力全体を読み、自分の分だけ処理）、
+    mode='range' は行の索引からほぼ同じバイト数の連続した範囲に分けます（各ワーカーは自分の範囲だけを読む）。
+    作業ディレクトリが空でない場合は FileExistsError を送出します。overwrite=True なら前の実行の
+    manifest とシャードの出力を消してから作ります。作成した manifest のパスのリストを返します。
+    """
+    if mode not in ('hash', 'range'):
+        raise ValueError(f"mode は 'hash' か 'range' を指定してください: '{mode}'")
+    if os.path.isdir(work_dir) and os.listdir(work_dir):
+        if not overwrite:
+            raise FileExistsError(f"作業ディレクトリ '{work_dir}' は空ではありません（前の実行の結果を消すには overwrite を指定してください）。")
+        _clear_work_dir(work_dir)
+    os.makedirs(os.path.join(work_dir, 'manifests'), exist_ok=True)
+    fingerprint = input_fingerprint(input_path)
+    run_id = _run_id(fingerprint, num_shards, task_names, mode, seed)
+
+    ranges = [None] * num_shards
+    if mode == 'range':
+        line_offsets = build_line_index(input_path)
+        total_size = line_offsets[-1]
+        line_count = len(line_offsets) - 1
+        line = 0
+        for shard_index in range(num_shards):
+            first_line = line
+            target = total_size * (shard_index + 1) // num_shards
+            while line < line_count and (line_offsets[line + 1] <= target or shard_index == num_shards - 1):
+                line += 1
+            ranges[shard_index] = {
+                'start': line_offsets[first_line],
+                'end': line_offsets[line],
+                'first_line_number': first_line + 1,
+            }
+
+    manifest_paths = []
+    for shard_index in range(num_shards):
+        manifest = {
+            'run_id': run_id,
+            'input': os.path.abspath(input_path),
+            'input_fingerprint': fingerprint,
+            'mode': mode,
+            'shard_index': shard_index,
+            'num_shards': num_shards,
+            'tasks': list(task_names),
+            'seed': seed,
+            'output_dir': os.path.abspath(_shard_dir(work_dir, shard_index)),
+        }
+        if ranges[shard_index] is not None:
+            manifest['byte_range'] = ranges[shard_index]
+        manifest_path = _manifest_path(work_dir, shard_index)
+        with open(manifest_path, 'w', encoding='utf-8') as outfile:
+            json.dump(manifest, outfile, ensure_ascii=False, indent=2)
+        manifest_paths.append(manifest_path)
+    # すべての manifest を書き終えてから実行の識別子を書き出す（merge はこれと一致する manifest だけを使う）
+    with open(os.path.join(work_dir, RUN_FILE), 'w', encoding='utf-8') as outfile:
+        json.dump({'run_id': run_id, 'input_fingerprint': fingerprint, 'num_shards': num_shards},
+                  outfile, ensure_ascii=False, indent=2)
+    return manifest_paths
+
+
+def _load_run_manifests(work_dir):
+    # run.json と一致する manifest をシャード番号の順に返す。前の実行の manifest が混ざっている場合や、
+    # シャードが欠けている場合、入力が shard の後に変更された場合は RuntimeError
+    with open(os.path.join(work_dir, RUN_FILE), 'r', encoding='utf-8') as infile:
+        run = json.load(infile)
+    manifest_dir = os.path.join(work_dir, 'manifests')
+    manifests = []
+    for name in sorted(os.listdir(manifest_dir)):
+        with open(os.path.join(manifest_dir, name), 'r', encoding='utf-8') as infile:
+            manifests.append(json.load(infile))
+    stale = [m.get('shard_index') for m in manifests
+             if m.get('run_id') != run['run_id'] or m.get('num_shards') != run['num_shards']]
+    if stale:
+        raise RuntimeError(f"別の実行の manifest が残っています: シャード {stale}")
+    indices = sorted(m['shard_index'] for m in manifests)
+    if indices != list(range(run['num_shards'])):
+        raise RuntimeError(f"シャードの manifest が揃っていません: {indices}（{run['num_shards']} 個のはず）")
+    if input_fingerprint(manifests[0]['input']) != run['input_fingerprint']:
+        raise RuntimeError(f"入力 '{manifests[0]['input']}' が shard の後に変更されています。")
+    return sorted(manifests, key=lambda m: m['shard_index'])
+
+
+def _iter_shard_datasets(manifest):
+    # (行番号, データセット) を順に返す
+    if manifest['mode'] == 'range':
+        byte_range = manifest['byte_range']
+        with open(manifest['input'], 'rb') as infile:
+            infile.seek(byte_range['start'])
+            position = byte_range['start']
+            line_number = byte_range['first_line_number']
+            while position < byte_range['end']:
+                raw_line = infile.readline()
+                if not raw_line:
+                    break
+                position += len(raw_line)
+                for dataset in iter_datasets_from_jsonl([raw_line.decode('utf-8')], manifest['input'], line_number):
+                    yield line_number, dataset
+                line_number += 1
+        return
+
+    with open(manifest['input'], 'r', encoding='utf-8') as infile:
+        for line_number, line in enumerate(infile, 1):
+            for dataset in iter_datasets_from_jsonl([line], manifest['input'], line_number):
+                if shard_of_id(dataset['id'], manifest['num_shards']) == manifest['shard_index']:
+                    yield line_number, dataset
+
+
+def run_shard(manifest_path, batch_size=1024):
+    """
+    1つのシャードを処理します。出力はシャードの出力ディレクトリに書き出し、
+    最後に完了の印を作ります。処理した件数を返します。
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as infile:
+        manifest = json.load(infile)
+    output_dir = manifest['output_dir']
+    os.makedirs(output_dir, exist_ok=True)
+    done_path = os.path.join(output_dir, DONE_FILE)
+    if os.path.exists(done_path):
+        os.remove(done_path)
+
+    task_names = manifest['tasks']
+    output_files = {
+        task_name: os.path.join(output_dir, file_name)
+        for task_name, file_name in task_output_files(task_names).items()
+    }
+    order_path = os.path.join(output_dir, ORDER_FILE)
+    statistics = LabelStatistics(task_names)
+    processed_count = 0
+
+    array_cache = ArrayTextCache()
+
+    with FanOutWriter() as writer:
+        line_numbers = []
+        batch = []
+
+        def run_batch():
+            writer.write(order_path, ''.join(f'{n}\n' for n in line_numbers))
+            task_results = generate_labels_memoized(task_names, batch, manifest['seed'], compact=True)
+            for task_name in task_names:
+                results = task_results[task_name]
+                statistics.update(task_name, results)
+                writer.write_records(output_files[task_name], results, task_ensure_ascii(task_name), array_cache)
+            array_cache.clear()
+
+        for line_number, dataset in _iter_shard_datasets(manifest):
+            line_numbers.append(line_number)
+            batch.append(dataset)
+            if len(batch) >= batch_size:
+                run_batch()
+                processed_count += len(batch)
+                line_numbers, batch = [], []
+        # 空のシャードでも出力ファイルを作る
+        run_batch()
+        processed_count += len(batch)
+
+    save_statistics(statistics, os.path.join(output_dir, STATS_FILE))
+    with open(done_path, 'w', encoding='utf-8') as outfile:
+        outfile.write(f'{processed_count}\n')
+    return processed_count
+
+
+def merge_shards(work_dir, output_dir='.'):
+    """
+    すべてのシャードの出力を元の入力の順序に並べ直し、タスクごとの最終的なファイルに書き出します。
+    各シャードのラベルの分布の要約も結合し、出力ディレクトリにレポート（label_stats.json）を書き出します。
+    未完了のシャードがある場合や、manifest が現在の実行（run.json）と一致しない場合は RuntimeError を送出します。
+    """
+    manifests = _load_run_manifests(work_dir)
+    unfinished = [m['shard_index'] for m in manifests if not os.path.exists(os.path.join(m['output_dir'], DONE_FILE))]
+    if unfinished:
+        raise RuntimeError(f"未完了のシャードがあります: {unfinished}")
+
+    task_names = manifests[0]['tasks']
+    os.makedirs(output_dir, exist_ok=True)
+    statistics = LabelStatistics(task_names)
+    for manifest in manifests:
+        stats_path = os.path.join(manifest['output_dir'], STATS_FILE)
+        if os.path.exists(stats_path):
+            statistics.merge(load_statistics(stats_path))
+    write_report(statistics, os.path.join(output_dir, REPORT_FILE))
+    for task_name, file_name in task_output_files(task_names).items():
+        opened = []
+        try:
+            streams = []
+            for manifest in manifests:
+                order_file = open(os.path.join(manifest['output_dir'], ORDER_FILE), 'r', encoding='utf-8')
+                result_file = open(os.path.join(manifest['output_dir'], file_name), 'r', encoding='utf-8')
+                opened.extend([order_file, result_file])
+                streams.append(zip((int(n) for n in order_file), result_file))
+            with open(os.path.join(output_dir, file_name), 'w', encoding='utf-8') as outfile:
+                for _, line in heapq.merge(*streams, key=lambda item: item[0]):
+                    outfile.write(line)
+        finally:
+            for stream in opened:
+                stream.close()
+
+
+def run_local(input_path, num_shards, work_dir, task_names, output_dir='.', mode='hash', seed=0, overwrite=False):
+    """
+    1台のマシンで shard → 複数のワーカープロセス → merge を実行します（動作確認用）。
+    """
+    manifest_paths = create_shards(input_path, num_shards, work_dir, task_names, mode, seed, overwrite)
+    workers = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), 'work', manifest_path],
+                         stdout=subprocess.DEVNULL)
+        for manifest_path in manifest_paths
+    ]
+    failed = [i for i, worker in enumerate(workers) if worker.wait() != 0]
+    if failed:
+        raise RuntimeError(f"ワーカーが失敗しました: {failed}")
+    merge_shards(work_dir, output_dir)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='共有ファイルシステム上でラベル生成を分割実行します。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    shard_parser = subparsers.add_parser('shard', help='入力をシャードに分割する')
+    shard_parser.add_argument('input')
+    shard_parser.add_argument('--num-shards', type=int, required=True)
+    shard_parser.add_argument('--work-dir', required=True)
+    shard_parser.add_argument('--tasks', default=','.join(TASKS))
+    shard_parser.add_argument('--mode', choices=['hash', 'range'], default='hash')
+    shard_parser.add_argument('--seed', type=int, default=0)
+    shard_parser.add_argument('--overwrite', action='store_true', help='作業ディレクトリに残っている前の実行の結果を消す')
+
+    work_parser = subparsers.add_parser('work', help='1つのシャードを処理する')
+    work_parser.add_argument('manifest')
+
+    merge_parser = subparsers.add_parser('merge', help='シャードの出力を結合する')
+    merge_parser.add_argument('work_dir')
+    merge_parser.add_argument('--output-dir', default='.')
+
+    local_parser = subparsers.add_parser('run-local', help='1台のマシンで shard/work/merge を実行する')
+    local_parser.add_argument('input')
+    local_parser.add_argument('--num-shards', type=int, default=4)
+    local_parser.add_argument('--work-dir', required=True)
+    local_parser.add_argument('--output-dir', default='.')
+    local_parser.add_argument('--tasks', default=','.join(TASKS))
+    local_parser.add_argument('--mode', choices=['hash', 'range'], default='hash')
+    local_parser.add_argument('--seed', type=int, default=0)
+    local_parser.add_argument('--overwrite', action='store_true', help='作業ディレクトリに残っている前の実行の結果を消す')
+
+    args = parser.parse_args()
+    if args.command in ('shard', 'run-local'):
+        selected_tasks = [name for name in args.tasks.split(',') if name]
+        unknown_tasks = [name for name in selected_tasks if name not in TASKS]
+        if unknown_tasks:
+            print(f"エラー: 未知のタスクです: {unknown_tasks}", file=sys.stderr)
+            sys.exit(1)
+
+    if args.command == 'shard':
+        paths = create_shards(args.input, args.num_shards, args.work_dir, selected_tasks, args.mode, args.seed,
+                              args.overwrite)
+        print(f"{len(paths)} 個のシャードを '{args.work_dir}' に作成しました。", file=sys.stderr)
+    elif args.command == 'work':
+        count = run_shard(args.manifest)
+        print(f"'{args.manifest}' の {count} 件を処理しました。", file=sys.stderr)
+    elif args.command == 'merge':
+        merge_shards(args.work_dir, args.output_dir)
+        print(f"'{args.work_dir}' のシャードを '{args.output_dir}' に結合しました。", file=sys.stderr)
+    else:
+        run_local(args.input, args.num_shards, args.work_dir, selected_tasks, args.output_dir, args.mode, args.seed,
+                  args.overwrite)
+        print(f"{args.num_shards} シャードで処理し、'{args.output_dir}' に結合しました。", file=sys.stderr)
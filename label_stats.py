@@ -0,0 +1,376 @@
+import json
+import math
+import sys
+
+import numpy as np
+
+from label_numeric import exact_float_units, units_to_float
+
+# ラベル生成の実行中に、各タスクのラベルの分布を要約するモジュール
+# 出力ファイルを読み直さずに、件数・ヒストグラム・近似分位点をバッチごとに更新します。
+# 要約は並列のワーカーやシャードごとに作り、あとで merge() で結合できます。
+# 結合は厳密です（どう分割し、どの順序で結合しても、1回で数えたのと同じ結果）。
+# 合計は 2^-1074（float の最小単位）を単位とする整数で正確に持ち、報告するときに1回だけ丸めます。
+#
+# 数値の要約は対数の幅のバケット（DDSketch と同じ方式）で値を数えるため、バケットの境界はデータに依存せず、
+# 分位点の推定値の相対誤差は RELATIVE_ACCURACY 以下です。
+
+RELATIVE_ACCURACY = 0.01
+REPORT_QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# タスクごとの要約: (要約の名前, 種類, 結果のフィールド, 値の変換)
+# 種類は 'numeric'（数値の分布）か 'category'（値ごとの件数）です。
+# フィールドがない、または None のラベルは missing として数えます。
+SUMMARY_SPECS = {
+    'max': [('gold_value', 'numeric', 'calculated_gold_value', None)],
+    'min': [('gold_value', 'numeric', 'calculated_gold_value', None)],
+    'ave': [('gold_value', 'numeric', 'calculated_gold_value', None)],
+    'sum': [('gold_value', 'numeric', 'calculated_gold_value', None)],
+    'maxtime': [('gold_year', 'category', 'calculated_gold_value', None)],
+    'mintime': [('gold_year', 'category', 'calculated_gold_value', None)],
+    'argmaxtime': [('gold_year', 'category', 'calculated_gold_value', None)],
+    'argmintime': [('gold_year', 'category', 'calculated_gold_value', None)],
+    'comp': [('comparison_symbol', 'category', 'calculated_comparison_symbol', None)],
+    'dif': [('difference', 'numeric', 'calculated_difference', None)],
+    'fcst': [('next_value', 'numeric', 'calculated_next_value_regression', None)],
+    'imp': [('interpolated_value', 'numeric', 'gold_interpolated_value', None)],
+    'exceed': [('threshold_set_size', 'numeric', 'values_above_threshold', len)],
+    'below': [('threshold_set_size', 'numeric', 'values_above_threshold', len)],
+    'peak': [('peak_count', 'numeric', 'calculated_peak_values', len)],
+    'dip': [('dip_count', 'numeric', 'calculated_values', len)],
+    'rangemax': [('range_value', 'numeric', 'calculated_range_max', None)],
+    'rangemin': [('range_value', 'numeric', 'calculated_range_min', None)],
+    # rangeave/rangesum の結果も calculated_range_min に入っている（既存の出力との互換のため）
+    'rangeave': [('range_value', 'numeric', 'calculated_range_min', None)],
+    'rangesum': [('range_value', 'numeric', 'calculated_range_min', None)],
+    'backtest': [('mae', 'numeric', 'backtest_mae', None)],
+    'gapimp': [('masked_points', 'numeric', 'nan_indices', len)],
+    'rolling': [('window_count', 'numeric', 'calculated_moving_average', len)],
+    'order': [('median', 'numeric', 'calculated_median', None)],
+}
+
+
+class CategorySketch:
+    """
+    値ごとの件数です（キーは JSON に書き出せるよう文字列にします）。
+    """
+
+    kind = 'category'
+
+    def __init__(self):
+        self.counts = {}
+        self.missing = 0
+
+    def add(self, items):
+        for item in items:
+            if item is None:
+                self.missing += 1
+            else:
+                key = str(item)
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def merge(self, other):
+        for key, count in other.counts.items():
+            self.counts[key] = self.counts.get(key, 0) + count
+        self.missing += other.missing
+        return self
+
+    def to_dict(self):
+        return {'kind': self.kind, 'counts': self.counts, 'missing': self.missing}
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls()
+        sketch.counts = dict(state['counts'])
+        sketch.missing = state['missing']
+        return sketch
+
+    def report(self):
+        total = sum(self.counts.values())
+        return {
+            'count': total,
+            'missing': self.missing,
+            'counts': dict(sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))),
+            'ratios': {key: count / total for key, count in self.counts.items()} if total else {},
+        }
+
+
+class QuantileSketch:
+    """
+    数値の分布の要約です。正の値と負の値をそれぞれ対数の幅のバケット
+    （バケット k は (gamma^(k-1), gamma^k]、gamma = (1 + alpha) / (1 - alpha)）で数え、
+    0、NaN・無限大、欠損は別に数えます。
+    有限の値の合計は exact_total（2^-1074 を単位とする整数）で正確に持ちます。
+    """
+
+    kind = 'numeric'
+
+    def __init__(self, alpha=RELATIVE_ACCURACY):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero_count = 0
+        self.non_finite = 0
+        self.missing = 0
+        self.exact_total = 0
+        self.minimum = math.inf
+        self.maximum = -math.inf
+
+    @property
+    def total(self):
+        return units_to_float(self.exact_total)
+
+    @property
+    def count(self):
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zero_count
+
+    def _add_buckets(self, store, magnitudes):
+        keys, counts = np.unique(np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def add(self, items):
+        values = []
+        for item in items:
+            if item is None:
+                self.missing += 1
+                continue
+            try:
+                values.append(float(item))
+            except (TypeError, ValueError):
+                self.missing += 1
+        if not values:
+            return
+        array = np.array(values, dtype=np.float64)
+        finite = np.isfinite(array)
+        self.non_finite += int(array.size - finite.sum())
+        array = array[finite]
+        if array.size == 0:
+            return
+        self._add_buckets(self.positive, array[array > 0])
+        self._add_buckets(self.negative, -array[array < 0])
+        self.zero_count += int((array == 0).sum())
+        self.exact_total += exact_float_units(array.tolist())
+        self.minimum = min(self.minimum, float(array.min()))
+        self.maximum = max(self.maximum, float(array.max()))
+
+    def merge(self, other):
+        if other.alpha != self.alpha:
+            raise ValueError(f"相対精度の異なる要約は結合できません: {self.alpha} と {other.alpha}")
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.non_finite += other.non_finite
+        self.missing += other.missing
+        self.exact_total += other.exact_total
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    def _buckets(self):
+        # (下端, 上端, 件数, 代表値) を値の昇順に返す
+        buckets = []
+        for key in sorted(self.negative, reverse=True):
+            upper = self.gamma ** key
+            buckets.append((-upper, -upper / self.gamma, self.negative[key], -2 * upper / (self.gamma + 1)))
+        if self.zero_count:
+            buckets.append((0.0, 0.0, self.zero_count, 0.0))
+        for key in sorted(self.positive):
+            upper = self.gamma ** key
+            buckets.append((upper / self.gamma, upper, self.positive[key], 2 * upper / (self.gamma + 1)))
+        return buckets
+
+    def quantile(self, q):
+        """
+        q 分位点の推定値（相対誤差 alpha 以下）を返します。値がなければ None です。
+        """
+        count = self.count
+        if count == 0:
+            return None
+        rank = q * (count - 1)
+        seen = 0
+        for _, _, bucket_count, representative in self._buckets():
+            seen += bucket_count
+            if seen > rank:
+                return min(max(representative, self.minimum), self.maximum)
+        return self.maximum
+
+    def to_dict(self):
+        return {
+            'kind': self.kind,
+            'alpha': self.alpha,
+            'positive': {str(key): count for key, count in self.positive.items()},
+            'negative': {str(key): count for key, count in self.negative.items()},
+            'zero_count': self.zero_count,
+            'non_finite': self.non_finite,
+            'missing': self.missing,
+            'total': self.total,
+            'exact_total': str(self.exact_total),
+            'minimum': self.minimum if self.count else None,
+            'maximum': self.maximum if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['alpha'])
+        sketch.positive = {int(key): count for key, count in state['positive'].items()}
+        sketch.negative = {int(key): count for key, count in state['negative'].items()}
+        sketch.zero_count = state['zero_count']
+        sketch.non_finite = state['non_finite']
+        sketch.missing = state['missing']
+        if 'exact_total' in state:
+            sketch.exact_total = int(state['exact_total'])
+        else:
+            # exact_total のない古い要約は合計の float から復元する
+            sketch.exact_total = exact_float_units([float(state['total'])])
+        sketch.minimum = state['minimum'] if state['minimum'] is not None else math.inf
+        sketch.maximum = state['maximum'] if state['maximum'] is not None else -math.inf
+        return sketch
+
+    def report(self):
+        count = self.count
+        return {
+            'count': count,
+            'missing': self.missing,
+            'non_finite': self.non_finite,
+            'min': self.minimum if count else None,
+            'max': self.maximum if count else None,
+            'mean': self.total / count if count else None,
+            'quantiles': {str(q): self.quantile(q) for q in REPORT_QUANTILES},
+            'histogram': [[lower, upper, bucket_count] for lower, upper, bucket_count, _ in self._buckets()],
+        }
+
+
+SKETCH_CLASSES = {
+    CategorySketch.kind: CategorySketch,
+    QuantileSketch.kind: QuantileSketch,
+}
+
+
+def _field_values(results, field, transform):
+    for result_item in results:
+        value = result_item.get(field)
+        if value is not None and transform is not None:
+            try:
+                value = transform(value)
+            except TypeError:
+                value = None
+        yield value
+
+
+class LabelStatistics:
+    """
+    タスクごとの要約の集まりです。update() でバッチの結果を加え、merge() で別のワーカーの要約を結合します。
+    """
+
+    def __init__(self, task_names=(), alpha=RELATIVE_ACCURACY):
+        self.alpha = alpha
+        self.records = {}
+        self.sketches = {}
+        for task_name in task_names:
+            self._ensure_task(task_name)
+
+    def _ensure_task(self, task_name):
+        if task_name in self.sketches:
+            return
+        self.records[task_name] = 0
+        self.sketches[task_name] = {}
+        for summary_name, kind, _, _ in SUMMARY_SPECS.get(task_name, []):
+            sketch_class = SKETCH_CLASSES[kind]
+            self.sketches[task_name][summary_name] = (
+                sketch_class(self.alpha) if sketch_class is QuantileSketch else sketch_class())
+
+    def update(self, task_name, results):
+        """
+        task_name の1バッチ分の結果（辞書のリスト）を要約に加えます。
+        """
+        self._ensure_task(task_name)
+        self.records[task_name] += len(results)
+        for summary_name, _, field, transform in SUMMARY_SPECS.get(task_name, []):
+            self.sketches[task_name][summary_name].add(_field_values(results, field, transform))
+
+    def merge(self, other):
+        for task_name, sketches in other.sketches.items():
+            self._ensure_task(task_name)
+            self.records[task_name] += other.records[task_name]
+            for summary_name, sketch in sketches.items():
+                self.sketches[task_name][summary_name].merge(sketch)
+        return self
+
+    def to_dict(self):
+        return {
+            'alpha': self.alpha,
+            'tasks': {
+                task_name: {
+                    'records': self.records[task_name],
+                    'summaries': {name: sketch.to_dict() for name, sketch in sketches.items()},
+                }
+                for task_name, sketches in self.sketches.items()
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        statistics = cls(alpha=state['alpha'])
+        for task_name, task_state in state['tasks'].items():
+            statistics.records[task_name] = task_state['records']
+            statistics.sketches[task_name] = {
+                name: SKETCH_CLASSES[sketch_state['kind']].from_dict(sketch_state)
+                for name, sketch_state in task_state['summaries'].items()
+            }
+        return statistics
+
+    def report(self):
+        """
+        タスクごとのレコード数と各要約の分布（件数・比率、または最小・最大・平均・分位点・ヒストグラム）を返します。
+        """
+        return {
+            task_name: {
+                'records': self.records[task_name],
+                **{name: sketch.report() for name, sketch in sketches.items()},
+            }
+            for task_name, sketches in self.sketches.items()
+        }
+
+
+def save_statistics(statistics, path):
+    """
+    結合できる形（バケットの件数など）で要約を書き出します。
+    """
+    with open(path, 'w', encoding='utf-8') as outfile:
+        json.dump(statistics.to_dict(), outfile, ensure_ascii=False)
+
+
+def load_statistics(path):
+    with open(path, 'r', encoding='utf-8') as infile:
+        return LabelStatistics.from_dict(json.load(infile))
+
+
+def write_report(statistics, path):
+    """
+    分布のレポートを JSON で書き出します。
+    """
+    with open(path, 'w', encoding='utf-8') as outfile:
+        json.dump(statistics.report(), outfile, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='保存した要約を結合し、ラベルの分布のレポートを書き出します。')
+    parser.add_argument('inputs', nargs='+', help='save_statistics() で書き出した要約のファイル')
+    parser.add_argument('--output', default='label_stats_report.json')
+    args = parser.parse_args()
+
+    merged = LabelStatistics()
+    for input_path in args.inputs:
+        try:
+            merged.merge(load_statistics(input_path))
+        except FileNotFoundError:
+            print(f"エラー: ファイル '{input_path}' が見つかりません。", file=sys.stderr)
+            sys.exit(1)
+    write_report(merged, args.output)
+    print(f"{len(args.inputs)} 個の要約を結合し、'{args.output}' に書き出しました。", file=sys.stderr)
@@ -0,0 +1,326 @@
+import functools
+import hashlib
+import importlib
+import json
+import random
+
+import numpy as np
+
+# 各ラベル生成タスクのレジストリ
+# タスク名 -> 実装モジュール、ラベル生成関数、既定の入力ファイル、既定の出力ファイル
+# 出力ファイル名と ensure_ascii（json.dumps の引数）は各スクリプトの __main__ で使われているものと同じです。
+# randomized は乱数（np.random / random）で位置や閾値を選ぶタスクを表します。
+# seed_argument は、ラベル生成関数とバッチカーネルがキーワード引数 base_seed で乱数のシードを受け取るタスクです。
+# requires はタスクが使う共有の中間データ（label_intermediates.INTERMEDIATES の名前）です。
+# min_length（既定 1）、needs_years（years_column が values と同じ長さの数値であること）、
+# finite_values（NaN や無限大を含まないこと）は label_validation での事前検証の条件です。
+TASKS = {
+    'max': {
+        'module': 'generate_max_label',
+        'function': 'generate_gold_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'max_with_gold.jsonl',
+        'requires': ['values', 'years', 'extremes'],
+    },
+    'min': {
+        'module': 'generate_min_label',
+        'function': 'generate_gold_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'min_with_gold.jsonl',
+        'requires': ['values', 'years', 'extremes'],
+    },
+    'ave': {
+        'module': 'generate_ave_label',
+        'function': 'generate_gold_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'ave_with_gold.jsonl',
+        'requires': ['values', 'years'],
+    },
+    'sum': {
+        'module': 'generate_sum_label',
+        'function': 'generate_gold_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'sum_with_gold.jsonl',
+        'requires': ['values', 'years'],
+    },
+    'maxtime': {
+        'module': 'generate_maxtime_label',
+        'function': 'generate_gold_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'maxtime_with_gold.jsonl',
+    },
+    'mintime': {
+        'module': 'generate_mintime_label',
+        'function': 'generate_gold_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'mintime_with_gold.jsonl',
+    },
+    # maxtime/mintime は years_column の文字列の最大・最小を返す（既存の出力との互換のため変更しない）。
+    # argmaxtime/argmintime は値が最大・最小となる時点の年を世紀を補って返す。
+    'argmaxtime': {
+        'module': 'label_timeaxis',
+        'function': 'generate_argmaxtime_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'argmaxtime_with_gold.jsonl',
+        'requires': ['values', 'time_axis', 'extremes'],
+        'needs_years': True,
+    },
+    'argmintime': {
+        'module': 'label_timeaxis',
+        'function': 'generate_argmintime_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'argmintime_with_gold.jsonl',
+        'requires': ['values', 'time_axis', 'extremes'],
+        'needs_years': True,
+    },
+    'peak': {
+        'module': 'generate_peak_label',
+        'function': 'generate_peaks_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'peaks_output.jsonl',
+        'requires': ['values', 'years', 'first_differences'],
+    },
+    'dip': {
+        'module': 'generate_dip_label',
+        'function': 'generate_peaks_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'peaks_output.jsonl',
+        'requires': ['values', 'years', 'first_differences'],
+    },
+    'exceed': {
+        'module': 'generate_exceed_label',
+        'function': 'generate_threshold_values_and_create_dictionary',
+        'input': 'test_for_threshold.jsonl',
+        'output': 'threshold_output.jsonl',
+        'ensure_ascii': True,
+        'randomized': True,
+        'requires': ['values', 'years', 'extremes'],
+        'finite_values': True,
+    },
+    'below': {
+        'module': 'generate_below_label',
+        'function': 'generate_threshold_values_and_create_dictionary',
+        'input': 'test_for_threshold.jsonl',
+        'output': 'threshold_output.jsonl',
+        'ensure_ascii': True,
+        'randomized': True,
+        'requires': ['values', 'years', 'extremes'],
+        'finite_values': True,
+    },
+    # order は中央値・分位点（0.25/0.5/0.75）・2番目に大きい値と、それぞれが現れる年
+    'order': {
+        'module': 'label_order',
+        'function': 'generate_order_statistics_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'order_statistics_output.jsonl',
+        'min_length': 2,
+        'finite_values': True,
+    },
+    # rolling は長さ3の窓の移動平均・移動合計・移動最大・移動最小・移動標準偏差
+    'rolling': {
+        'module': 'label_rolling',
+        'function': 'generate_rolling_statistics_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'rolling_output.jsonl',
+        'min_length': 3,
+    },
+    'comp': {
+        'module': 'generate_comp_label',
+        'function': 'generate_comparison_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'comparison_output.jsonl',
+        'randomized': True,
+        'min_length': 2,
+    },
+    'dif': {
+        'module': 'generate_dif_label',
+        'function': 'generate_difference_and_create_dictionary',
+        'input': 'test_for_difference.jsonl',
+        'output': 'dif_output.jsonl',
+        'ensure_ascii': True,
+        'randomized': True,
+        'min_length': 2,
+    },
+    'fcst': {
+        'module': 'generate_fcst_label',
+        'function': 'generate_regression_prediction_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'regression_prediction_output.jsonl',
+        'min_length': 2,
+        'needs_years': True,
+    },
+    # backtest は fcst と同じ線形回帰をすべての時点で当てはめ直すローリング・オリジンのバックテスト
+    'backtest': {
+        'module': 'label_backtest',
+        'function': 'generate_backtest_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'backtest_output.jsonl',
+        'min_length': 3,
+        'needs_years': True,
+        'finite_values': True,
+    },
+    'imp': {
+        'module': 'generate_imp_label',
+        'function': 'generate_interpolation_and_create_dictionary',
+        'input': 'test_for_interpolation.jsonl',
+        'output': 'interpolation_output.jsonl',
+        'ensure_ascii': True,
+        'randomized': True,
+        'requires': ['values', 'years'],
+        'min_length': 3,
+    },
+    # gapimp は複数の欠損区間を id から決まる乱数で選び、複数の補間方法の gold を計算する
+    'gapimp': {
+        'module': 'label_imputation',
+        'function': 'generate_gap_imputation_and_create_dictionary',
+        'input': 'test_for_interpolation.jsonl',
+        'output': 'gap_interpolation_output.jsonl',
+        'ensure_ascii': True,
+        'seed_argument': True,
+        'min_length': 3,
+        'finite_values': True,
+    },
+    'rangemax': {
+        'module': 'generate_rangemax_label',
+        'function': 'generate_rangemax_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'rangemax_output.jsonl',
+        'randomized': True,
+        'requires': ['values', 'years'],
+        'min_length': 2,
+    },
+    'rangemin': {
+        'module': 'generate_rangemin_label',
+        'function': 'generate_rangemin_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'rangemin_output.jsonl',
+        'randomized': True,
+        'requires': ['values', 'years'],
+        'min_length': 2,
+    },
+    'rangeave': {
+        'module': 'generate_rangeave_label',
+        'function': 'generate_rangemin_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'rangemin_output.jsonl',
+        'randomized': True,
+        'requires': ['values', 'years'],
+        'min_length': 2,
+    },
+    'rangesum': {
+        'module': 'generate_rangesum_label',
+        'function': 'generate_rangemin_and_create_dictionary',
+        'input': 'test.jsonl',
+        'output': 'rangemin_output.jsonl',
+        'randomized': True,
+        'requires': ['values', 'years'],
+        'min_length': 2,
+    },
+}
+
+# 読み込み済みのラベル生成関数のキャッシュ
+_loaded_functions = {}
+
+
+def get_task_function(task_name):
+    """
+    タスク名に対応するラベル生成関数（1レコードを受け取り辞書を返す関数）を返します。
+    モジュールは初回呼び出し時にのみインポートされます。
+    """
+    if task_name not in TASKS:
+        raise KeyError(f"未知のタスクです: '{task_name}'")
+    function = _loaded_functions.get(task_name)
+    if function is None:
+        spec = TASKS[task_name]
+        module = importlib.import_module(spec['module'])
+        function = getattr(module, spec['function'])
+        _loaded_functions[task_name] = function
+    return function
+
+
+def load_all_tasks():
+    """
+    すべてのタスクのモジュールを事前にインポートします（サーバー起動時のウォームアップ用）。
+    """
+    for task_name in TASKS:
+        get_task_function(task_name)
+    return sorted(TASKS)
+
+
+def task_ensure_ascii(task_name):
+    """
+    タスクの出力を書き出すときの json.dumps の ensure_ascii を返します。
+    """
+    return TASKS[task_name].get('ensure_ascii', False)
+
+
+def task_output_files(task_names):
+    """
+    複数タスクを同時に実行するときの出力ファイル名を {タスク名: ファイル名} で返します。
+    既存スクリプトの出力ファイル名を使いますが、選択したタスクの間で同じ名前になる場合
+    （peak と dip、rangemin/rangeave/rangesum など）は '<タスク名>_output.jsonl' にします。
+    """
+    usage = {}
+    for task_name in task_names:
+        usage.setdefault(TASKS[task_name]['output'], []).append(task_name)
+    return {
+        task_name: TASKS[task_name]['output'] if len(usage[TASKS[task_name]['output']]) == 1 else f'{task_name}_output.jsonl'
+        for task_name in task_names
+    }
+
+
+def get_seeded_task_function(task_name, base_seed=None):
+    """
+    get_task_function() と同じですが、seed_argument のタスクで base_seed を指定した場合は
+    そのシードを渡すラベル生成関数を返します。
+    """
+    function = get_task_function(task_name)
+    if base_seed is None or not TASKS[task_name].get('seed_argument'):
+        return function
+    return functools.partial(function, base_seed=base_seed)
+
+
+def generate_labels(task_name, datasets, base_seed=None):
+    """
+    複数のデータセットに対してタスクのラベルを生成し、結果の辞書のリストを返します。
+    ベクトル化されたバッチカーネルが登録されているタスクはそれを使い、
+    それ以外はレコードごとに既存のラベル生成関数を呼び出します。
+    base_seed は seed_argument のタスクにだけ渡されます（None なら各関数の既定のシード）。
+    """
+    # 循環インポートを避けるためここでインポート
+    from label_kernels import BATCH_KERNELS
+
+    function = get_seeded_task_function(task_name, base_seed)
+    kernel = BATCH_KERNELS.get(task_name)
+    if kernel is not None:
+        if base_seed is not None and TASKS[task_name].get('seed_argument'):
+            return kernel(datasets, function, base_seed=base_seed)
+        return kernel(datasets, function)
+    return [function(dataset) for dataset in datasets]
+
+
+def record_seed(base_seed, task_name, record_id):
+    """
+    (基本シード, タスク名, レコードの id) から決まる 32 ビットのシードを返します。
+    Python の hash() はプロセスごとに変わるため使いません。
+    """
+    key = f"{base_seed}:{task_name}:{json.dumps(record_id, ensure_ascii=False, sort_keys=True)}"
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=4).digest(), 'little')
+
+
+def generate_labels_deterministic(task_name, datasets, base_seed=0):
+    """
+    generate_labels() と同じですが、乱数を使うタスクではレコードごとに
+    record_seed() で np.random と random を初期化してから計算します。
+    seed_argument のタスクには base_seed をそのまま渡します（乱数はレコードの id とシードから決まります）。
+    これにより、結果は処理の順序や分割（シャード数、バッチの大きさ）に依存しません。
+    """
+    if not TASKS[task_name].get('randomized'):
+        return generate_labels(task_name, datasets, base_seed)
+    results = []
+    for dataset in datasets:
+        seed = record_seed(base_seed, task_name, dataset.get('id'))
+        np.random.seed(seed)
+        random.seed(seed)
+        results.extend(generate_labels(task_name, [dataset]))
+    return results
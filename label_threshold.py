@@ -0,0 +1,200 @@
+import numpy as np
+
+from label_kernels import concat_values
+from label_numeric import select_segments
+
+# exceed/below ラベル用に、系列ごとの昇順コピー（と元のインデックス）を一度だけ作り、
+# 任意の数の閾値を二分探索（O(log n)）で答えるためのモジュール
+# 閾値が1つだけの場合はソートの O(n log n) の方が高くつくため、索引を作らず比較で答えます。
+
+
+def _segmented_searchsorted(sorted_values, lo, hi, targets, side):
+    # 各クエリについて sorted_values[lo:hi] の中で np.searchsorted と同じ位置を求める。
+    # すべてのクエリを同時に二分探索するので、反復回数は最長の区間の log2 で済む。
+    lo = lo.copy()
+    hi = hi.copy()
+    while True:
+        active = lo < hi
+        if not active.any():
+            return lo
+        mid = (lo + hi) // 2
+        probe = sorted_values[np.where(active, mid, 0)]
+        go_right = (probe <= targets) if side == 'right' else (probe < targets)
+        go_right &= active
+        lo = np.where(go_right, mid + 1, lo)
+        hi = np.where(active & ~go_right, mid, hi)
+
+
+class SortedBatchIndex:
+    """
+    連結バッファ（concat_values() の結果）の各区間を昇順に並べた索引です。
+    NaN はどの閾値とも比較が偽になるため（values > t と同じ）、各区間の末尾に置いて探索対象から除きます。
+    """
+
+    def __init__(self, buffer, offsets):
+        self.buffer = buffer
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        starts = self.offsets[:-1]
+        lengths = np.diff(self.offsets)
+        segment_ids = np.repeat(np.arange(lengths.size), lengths)
+        # 区間番号、値の順に安定ソート（NaN は区間の末尾）
+        order = np.lexsort((buffer, segment_ids))
+        self.sorted_values = buffer[order]
+        self.sorted_local_indices = order - np.repeat(starts, lengths)
+        nan_counts = np.add.reduceat(np.isnan(buffer).astype(np.int64), starts) if buffer.size else np.zeros(0, dtype=np.int64)
+        self.valid_ends = self.offsets[1:] - np.where(lengths > 0, nan_counts, 0)
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        1系列分の索引を作ります。
+        """
+        values = np.asarray(values, dtype=float)
+        return cls(values, np.array([0, values.size], dtype=np.int64))
+
+    @classmethod
+    def from_datasets(cls, datasets):
+        """
+        複数レコードの索引をまとめて作ります。'values' が空のレコードや
+        数値に変換できない要素を含むレコードは含まれません。
+        戻り値は (索引, 索引に含まれるレコードの位置のリスト) です。
+        """
+        buffer, offsets, valid_positions = concat_values(datasets)
+        return cls(buffer, offsets), valid_positions
+
+    def _bounds(self, segments, thresholds, mode):
+        segments = np.asarray(segments, dtype=np.int64)
+        thresholds = np.asarray(thresholds, dtype=float)
+        starts = self.offsets[segments]
+        valid_ends = self.valid_ends[segments]
+        if mode == 'exceed':
+            lower = _segmented_searchsorted(self.sorted_values, starts, valid_ends, thresholds, 'right')
+            return lower, valid_ends
+        upper = _segmented_searchsorted(self.sorted_values, starts, valid_ends, thresholds, 'left')
+        return starts, upper
+
+    def count(self, segments, thresholds, mode='exceed'):
+        """
+        (区間番号, 閾値) の組ごとに、閾値を超える（mode='below' なら下回る）点の数を返します。
+        """
+        lower, upper = self._bounds(segments, thresholds, mode)
+        return upper - lower
+
+    def query(self, segments, thresholds, mode='exceed'):
+        """
+        (区間番号, 閾値) の組ごとに、件数・値・元のインデックスを辞書で返します。
+        値とインデックスは元の系列の順序です（values[values > t] と同じ並び）。
+        """
+        segments = np.asarray(segments, dtype=np.int64)
+        lower, upper = self._bounds(segments, thresholds, mode)
+        answers = []
+        for segment, start, end in zip(segments.tolist(), lower.tolist(), upper.tolist()):
+            local_indices = np.sort(self.sorted_local_indices[start:end])
+            segment_start = self.offsets[segment]
+            answers.append({
+                'count': end - start,
+                'values': self.buffer[segment_start + local_indices],
+                'indices': local_indices,
+            })
+        return answers
+
+
+def mask_answer(values, threshold, mode):
+    """
+    1つの閾値だけなら索引を作らず、既存スクリプトと同じ O(n) の比較で答えます。
+    戻り値は SortedBatchIndex.query() の1件分と同じ {'count', 'values', 'indices'} です。
+    """
+    hits = values > threshold if mode == 'exceed' else values < threshold
+    indices = np.flatnonzero(hits)
+    return {'count': int(indices.size), 'values': values[indices], 'indices': indices}
+
+
+def generate_threshold_queries(datasets, thresholds_per_dataset, mode='exceed'):
+    """
+    各データセットについて、複数の閾値に対するラベルをまとめて計算します。
+    thresholds_per_dataset[i] は datasets[i] に対する閾値のリストです。
+    昇順の索引は閾値が2つ以上あるレコードについてだけ作り、閾値が1つのレコードは比較で直接答えます。
+    戻り値は、データセットごとの [{'threshold_value', 'count', 'values', 'indices'}, ...] のリストです
+    （'values' が空のレコードは空のリスト）。
+    """
+    buffer, offsets, valid_positions = concat_values(datasets)
+
+    results = [[] for _ in datasets]
+    indexed_segments = []
+    for segment, position in enumerate(valid_positions):
+        thresholds = list(thresholds_per_dataset[position])
+        if len(thresholds) == 1:
+            answer = mask_answer(buffer[offsets[segment]:offsets[segment + 1]], thresholds[0], mode)
+            results[position].append({
+                'threshold_value': thresholds[0],
+                'count': answer['count'],
+                'values': answer['values'].tolist(),
+                'indices': answer['indices'].tolist(),
+            })
+        elif thresholds:
+            indexed_segments.append(segment)
+    if not indexed_segments:
+        return results
+
+    index = SortedBatchIndex(*select_segments(buffer, offsets, indexed_segments))
+    query_positions = []
+    query_segments = []
+    query_thresholds = []
+    for index_segment, segment in enumerate(indexed_segments):
+        position = valid_positions[segment]
+        for threshold in thresholds_per_dataset[position]:
+            query_positions.append(position)
+            query_segments.append(index_segment)
+            query_thresholds.append(threshold)
+
+    answers = index.query(query_segments, query_thresholds, mode)
+    for position, threshold, answer in zip(query_positions, query_thresholds, answers):
+        results[position].append({
+            'threshold_value': threshold,
+            'count': answer['count'],
+            'values': answer['values'].tolist(),
+            'indices': answer['indices'].tolist(),
+        })
+    return results
+
+
+def batch_random_threshold(datasets, fallback_function, mode):
+    """
+    generate_exceed_label.py / generate_below_label.py と同じ乱数の消費順で閾値を選び、結果を求めます。
+    閾値は1レコードに1つだけなので索引（ソート）は作らず、区間ごとの最小値・最大値をまとめて求めてから
+    既存スクリプトと同じ O(n) の比較で答えます。NaN を含むレコードなどは元の関数に任せます。
+    """
+    buffer, offsets, valid_positions = concat_values(datasets)
+
+    segment_of_position = {position: i for i, position in enumerate(valid_positions)}
+    if valid_positions:
+        starts = offsets[:-1]
+        minimums = np.minimum.reduceat(buffer, starts)
+        maximums = np.maximum.reduceat(buffer, starts)
+        # NaN を含む区間は最小値・最大値が NaN になる
+        has_nan = np.isnan(minimums)
+    results = []
+    for position, dataset in enumerate(datasets):
+        segment = segment_of_position.get(position)
+        if segment is None or has_nan[segment]:
+            results.append(fallback_function(dataset))
+            continue
+
+        min_val = minimums[segment]
+        max_val = maximums[segment]
+        if min_val == max_val:
+            threshold_val = round(min_val, 1)
+        else:
+            threshold_val = round(np.random.uniform(min_val, max_val), 1)
+        values = buffer[offsets[segment]:offsets[segment + 1]]
+        answer = mask_answer(values, threshold_val, mode)
+
+        years = np.array(dataset.get('years_column', []))
+        results.append({
+            **dataset,
+            'years_column': years.tolist() if years.size > 0 else dataset.get('years_column', []),
+            'values': values.tolist(),
+            'threshold_value': threshold_val,
+            'values_above_threshold': answer['values'].tolist(),
+        })
+    return results
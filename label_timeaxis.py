@@ -0,0 +1,206 @@
+import functools
+import re
+
+import numpy as np
+
+# years_column（"19", "18", ..., "90" のような2桁の文字列を含む）を
+# 世紀を補った年に変換し、レコードごとに1回だけ解析してキャッシュするためのモジュール
+#
+# 世紀を補うのは1〜2桁の整数の文字列（"19"、"05" など）だけです。数値（2018、2018.25、1, 2, 3 のような番号）や
+# 4桁・小数の文字列（"2019"、"2018.5"）は既存の fcst と同じく float(token) の値をそのまま使います。
+# 2桁の年は列全体で解釈します。隣り合う2桁の年は近い方の世紀に続くものとし（降順の列で "00" の次の "99" は
+# 前の世紀）、最後に列の中で最も新しい年だけを TWO_DIGIT_YEAR_PIVOT で解釈して全体の世紀を決めます。
+
+# 2桁の年を1つだけ解釈するときの規則（POSIX の strptime %y と同じ）: 69〜99 は 1900 年代、00〜68 は 2000 年代
+TWO_DIGIT_YEAR_PIVOT = 69
+# "2019*" や " 19" のように先頭の数字だけを年として扱う
+_YEAR_PATTERN = re.compile(r'^\s*(\d{1,4})')
+_TWO_DIGIT_PATTERN = re.compile(r'^\s*(\d{1,2})\s*$')
+
+
+def _parse_token(token):
+    # (年の値, 世紀を補う2桁の年かどうか)。解釈できない場合は (None, False)
+    if isinstance(token, bool):
+        return None, False
+    if isinstance(token, (int, float, np.integer, np.floating)):
+        year = float(token)
+        return (year, False) if np.isfinite(year) else (None, False)
+    text = str(token)
+    match = _TWO_DIGIT_PATTERN.match(text)
+    if match:
+        return float(match.group(1)), True
+    try:
+        year = float(text)
+        return (year, False) if np.isfinite(year) else (None, False)
+    except ValueError:
+        pass
+    match = _YEAR_PATTERN.match(text)
+    if not match:
+        return None, False
+    return float(match.group(1)), len(match.group(1)) <= 2
+
+
+def _century_base(two_digit, pivot):
+    # 2桁の年だけを1つ解釈したときの世紀（1900 または 2000）
+    return 1900 if two_digit >= pivot else 2000
+
+
+def _plain_year(year):
+    # 整数の年は int、それ以外は float
+    return int(year) if float(year).is_integer() else float(year)
+
+
+def resolve_year(token, pivot=TWO_DIGIT_YEAR_PIVOT):
+    """
+    1つの年（文字列または数値）を年に変換します。解釈できない場合は None を返します。
+    2桁の年は前後の年が分からないため pivot の規則で世紀を補います（列全体は get_time_axis() を使ってください）。
+    """
+    year, two_digit = _parse_token(token)
+    if year is None:
+        return None
+    if two_digit:
+        year += _century_base(year, pivot)
+    return _plain_year(year)
+
+
+def resolve_years(tokens, pivot=TWO_DIGIT_YEAR_PIVOT):
+    """
+    列全体の年を解釈し、(年の float 配列（解釈できない要素は NaN）, 解釈できたかどうかの配列) を返します。
+    """
+    years = np.full(len(tokens), np.nan)
+    valid = np.zeros(len(tokens), dtype=bool)
+    two_digit_positions = []
+    for index, token in enumerate(tokens):
+        year, two_digit = _parse_token(token)
+        if year is None:
+            continue
+        years[index] = year
+        valid[index] = True
+        if two_digit:
+            two_digit_positions.append(index)
+
+    if two_digit_positions:
+        # 直前の2桁の年から ±50 年以内に続くように世紀をまたいで展開する（ちょうど 50 年は降順とみなす）
+        raw = years[two_digit_positions]
+        steps = (np.diff(raw) + 50) % 100 - 50
+        unwrapped = raw[0] + np.concatenate([[0.0], np.cumsum(steps)])
+        latest = unwrapped.max()
+        latest_two_digit = latest % 100
+        shift = latest_two_digit + _century_base(latest_two_digit, pivot) - latest
+        years[two_digit_positions] = unwrapped + shift
+    return years, valid
+
+
+class TimeAxis:
+    """
+    解析済みの時間軸です。years は年（すべて整数なら int64、小数の年を含めば float64 の配列。
+    解釈できない要素は -1）、valid はその要素が解釈できたかどうかを表します。
+    並び順（order）は最初に参照したときに一度だけ計算されます。
+    キャッシュで共有されるため、配列は読み取り専用です。
+    """
+
+    __slots__ = ('years', 'valid', '_order')
+
+    def __init__(self, years, valid):
+        years.setflags(write=False)
+        valid.setflags(write=False)
+        self.years = years
+        self.valid = valid
+        self._order = None
+
+    def __len__(self):
+        return self.years.size
+
+    @property
+    def all_valid(self):
+        return bool(self.valid.all())
+
+    @property
+    def order(self):
+        """
+        年の昇順に並べるインデックス（同じ年は元の順序を保つ安定ソート）。
+        """
+        if self._order is None:
+            order = np.argsort(self.years, kind='stable')
+            order.setflags(write=False)
+            self._order = order
+        return self._order
+
+    def year_at(self, index):
+        """
+        index 番目の年を Python の値（整数の年は int、小数の年は float）で返します。
+        """
+        return _plain_year(self.years[index])
+
+    @property
+    def is_descending(self):
+        return self.years.size < 2 or bool(np.all(self.years[:-1] > self.years[1:]))
+
+
+@functools.lru_cache(maxsize=4096)
+def _parse_time_axis_cached(tokens, pivot):
+    years, valid = resolve_years(tokens, pivot)
+    years[~valid] = -1
+    # すべて整数の年なら整数の配列にする（年のラベルを従来どおり整数で出力するため）
+    if np.all(years == np.floor(years)):
+        years = years.astype(np.int64)
+    return TimeAxis(years, valid)
+
+
+def get_time_axis(years_column, pivot=TWO_DIGIT_YEAR_PIVOT):
+    """
+    years_column を解析した TimeAxis を返します。
+    同じ内容の years_column（多くのレコードで共通）は一度だけ解析されます。
+    """
+    try:
+        tokens = tuple(years_column)
+        return _parse_time_axis_cached(tokens, pivot)
+    except TypeError:
+        # ハッシュできない要素が含まれる場合はキャッシュを使わない
+        return _parse_time_axis_cached.__wrapped__(tuple(str(t) for t in years_column), pivot)
+
+
+def _generate_time_of_extreme_and_create_dictionary(dataset, mode):
+    if 'values' not in dataset or not dataset['values']:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' には 'values' キーが存在しないか、空です。goldを生成できません。")
+        return {
+            **dataset,
+            'calculated_gold_value': None,
+            'calculated_gold_index': None,
+        }
+
+    years_list = dataset.get('years_column', [])
+    values = np.array(dataset['values'], dtype=float)
+    time_axis = get_time_axis(years_list)
+
+    if len(time_axis) != len(values) or not time_axis.all_valid:
+        print(f"警告: データセットID '{dataset.get('id', 'N/A')}' の 'years_column' が 'values' と対応していないか、年として解釈できません。goldを生成できません。")
+        return {
+            **dataset,
+            'values': values.tolist(),
+            'calculated_gold_value': None,
+            'calculated_gold_index': None,
+        }
+
+    index = int(np.argmax(values) if mode == 'max' else np.argmin(values))
+    return {
+        **dataset,
+        'values': values.tolist(),
+        'calculated_gold_value': time_axis.year_at(index),
+        'calculated_gold_index': index,
+    }
+
+
+def generate_argmaxtime_and_create_dictionary(dataset):
+    """
+    'values' が最大となる時点の年（2桁の年は世紀を補った年）を計算し、新しい辞書を作成します。
+    最大値が複数ある場合は最初に現れる位置を使います（np.argmax と同じ）。
+    """
+    return _generate_time_of_extreme_and_create_dictionary(dataset, 'max')
+
+
+def generate_argmintime_and_create_dictionary(dataset):
+    """
+    'values' が最小となる時点の年（2桁の年は世紀を補った年）を計算し、新しい辞書を作成します。
+    """
+    return _generate_time_of_extreme_and_create_dictionary(dataset, 'min')
@@ -0,0 +1,141 @@
+import numpy as np
+
+from label_numeric import TypedBatch, decode_dataset_column, select_segments
+from label_tasks import TASKS
+from label_timeaxis import get_time_axis
+
+# ラベル生成の前にバッチ全体をまとめて検証するモジュール
+# 各スクリプトに散らばっている検査（values が空、要素数の不足、数値に変換できない要素、
+# years_column と values の長さの不一致など）を1回のベクトル化された処理で行い、
+# 問題のあるレコードは理由コード付きで隔離（quarantine）します。
+# カーネルには検証を通過し、values を変換済みのバッチ（TypedBatch）だけを渡します。
+
+# 理由コード
+MISSING_VALUES = 'missing_values'             # 'values' がない、リストでない、または空
+NON_NUMERIC_VALUES = 'non_numeric_values'     # 'values' に数値に変換できない要素がある
+NON_FINITE_VALUES = 'non_finite_values'       # 'values' に NaN や無限大がある（finite_values のタスク）
+TOO_SHORT = 'too_short'                       # 要素数がタスクの min_length 未満
+YEARS_LENGTH_MISMATCH = 'years_length_mismatch'  # years_column と values の長さが異なる（needs_years のタスク）
+NON_NUMERIC_YEARS = 'non_numeric_years'       # years_column に年として解釈できない要素がある（needs_years のタスク）
+
+
+def _segment_counts(flags, offsets):
+    # 各区間に含まれる True の数（空の区間も正しく 0 になる）
+    cumulative = np.zeros(flags.size + 1, dtype=np.int64)
+    np.cumsum(flags, out=cumulative[1:])
+    return cumulative[offsets[1:]] - cumulative[offsets[:-1]]
+
+
+def _check_years(datasets):
+    # 年は label_timeaxis と同じ規則で解釈する（"2019*" のような年も通す）。
+    # 同じ years_column の解析はキャッシュされるため、レコードごとの処理は軽い
+    lengths = np.zeros(len(datasets), dtype=np.int64)
+    bad_years = {}
+    for position, dataset in enumerate(datasets):
+        years_list = dataset.get('years_column')
+        if not isinstance(years_list, (list, tuple)):
+            continue
+        time_axis = get_time_axis(years_list)
+        lengths[position] = len(time_axis)
+        if not time_axis.all_valid:
+            bad_years[position] = [(index, years_list[index]) for index in np.flatnonzero(~time_axis.valid).tolist()]
+    return lengths, bad_years
+
+
+class ValidationReport:
+    """
+    1バッチ分の検証結果です。
+
+    reasons   : {データセットの位置: {タスク名: [理由コード, ...]}}（問題のあるものだけ）
+    details   : {データセットの位置: {'values': [(位置, 元の要素), ...], 'years_column': [...]}}
+    buffer, offsets : すべてのデータセットの 'values' を変換したもの（変換できない要素は NaN）
+    """
+
+    def __init__(self, datasets, task_names, reasons, details, buffer, offsets):
+        self.datasets = datasets
+        self.task_names = list(task_names)
+        self.reasons = reasons
+        self.details = details
+        self.buffer = buffer
+        self.offsets = offsets
+
+    def clean_positions(self, task_name):
+        return [position for position in range(len(self.datasets))
+                if task_name not in self.reasons.get(position, {})]
+
+    def clean_batch(self, task_name):
+        """
+        task_name の検証を通過したデータセットだけの TypedBatch を返します。
+        """
+        positions = self.clean_positions(task_name)
+        buffer, offsets = select_segments(self.buffer, self.offsets, positions)
+        return TypedBatch([self.datasets[position] for position in positions], buffer, offsets)
+
+    def quarantine_entries(self):
+        """
+        隔離するレコードを、理由コードと元のレコード付きの辞書として順に返します。
+        """
+        for position in sorted(self.reasons):
+            entry = {
+                'id': self.datasets[position].get('id'),
+                'reasons': self.reasons[position],
+            }
+            if position in self.details:
+                entry['details'] = self.details[position]
+            entry['record'] = self.datasets[position]
+            yield entry
+
+
+def validate_batch(datasets, task_names):
+    """
+    datasets を task_names の各タスクの条件（TASKS の min_length / needs_years / finite_values）で
+    まとめて検証し、ValidationReport を返します。
+    """
+    for task_name in task_names:
+        if task_name not in TASKS:
+            raise KeyError(f"未知のタスクです: '{task_name}'")
+
+    buffer, offsets, bad_values = decode_dataset_column(datasets, 'values')
+    lengths = np.diff(offsets)
+    non_finite_counts = _segment_counts(~np.isfinite(buffer), offsets)
+
+    needs_years = any(TASKS[task_name].get('needs_years') for task_name in task_names)
+    if needs_years:
+        years_lengths, bad_years = _check_years(datasets)
+    else:
+        bad_years = {}
+
+    # タスクに依存しない問題（レコードごとに1回だけ判定する）
+    common = {}
+    for position in np.flatnonzero(lengths == 0).tolist():
+        common[position] = [MISSING_VALUES]
+    for position in bad_values:
+        common.setdefault(position, []).append(NON_NUMERIC_VALUES)
+
+    reasons = {}
+    for task_name in task_names:
+        spec = TASKS[task_name]
+        task_flags = {position: list(codes) for position, codes in common.items()}
+        for position in np.flatnonzero((lengths > 0) & (lengths < spec.get('min_length', 1))).tolist():
+            task_flags.setdefault(position, []).append(TOO_SHORT)
+        if spec.get('finite_values'):
+            # 変換できない要素は NaN になっているので、それ以外の NaN・無限大だけを数える
+            for position in np.flatnonzero(non_finite_counts > 0).tolist():
+                if non_finite_counts[position] > len(bad_values.get(position, ())):
+                    task_flags.setdefault(position, []).append(NON_FINITE_VALUES)
+        if spec.get('needs_years'):
+            for position in np.flatnonzero((lengths > 0) & (years_lengths != lengths)).tolist():
+                task_flags.setdefault(position, []).append(YEARS_LENGTH_MISMATCH)
+            for position in bad_years:
+                task_flags.setdefault(position, []).append(NON_NUMERIC_YEARS)
+        for position, codes in task_flags.items():
+            reasons.setdefault(position, {})[task_name] = codes
+
+    details = {}
+    for position, tokens in bad_values.items():
+        details.setdefault(position, {})['values'] = tokens
+    for position, tokens in bad_years.items():
+        if position in reasons:
+            details.setdefault(position, {})['years_column'] = tokens
+
+    return ValidationReport(datasets, task_names, reasons, details, buffer, offsets)
@@ -0,0 +1,298 @@
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 複数タスクの結果をそれぞれのファイルへ同時に書き出すための書き込みサブシステム
+# 計算側はメモリ上のファイルごとのキューに追加するだけで、ディスクへの書き込みは
+# 少数のスレッドがまとめて（大きな単位で）行います。
+
+# fsync の方針
+# 'never'    : fsync しない（OS に任せる）
+# 'on_close' : close() 時にファイルごとに1回 fsync する
+# 'always'   : まとめて書き込むたびに fsync する
+FSYNC_POLICIES = ('never', 'on_close', 'always')
+
+
+class _FileQueue:
+    __slots__ = ('path', 'chunks', 'pending_size', 'draining', 'handle', 'error', 'condition')
+
+    def __init__(self, path):
+        self.path = path
+        self.chunks = []
+        self.pending_size = 0
+        self.draining = False
+        self.handle = None
+        self.error = None
+        self.condition = threading.Condition()
+
+
+class FanOutWriter:
+    """
+    ファイルごとのバッファ付きキューを持ち、スレッドプールでまとめて書き出すライターです。
+    同じファイルへの書き込みは常に1つのスレッドだけが行うため、ファイルごとの順序は保たれます。
+
+    coalesce_size     : キューにこの文字数がたまったら書き出しを始める
+    max_pending_size  : キューの上限（超えた場合のみ write() が待つ。0 なら無制限）
+    """
+
+    def __init__(self, workers=2, fsync_policy='on_close', coalesce_size=1 << 20,
+                 max_pending_size=64 << 20, encoding='utf-8'):
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"fsync_policy は {FSYNC_POLICIES} のいずれかを指定してください: '{fsync_policy}'")
+        self.fsync_policy = fsync_policy
+        self.coalesce_size = coalesce_size
+        self.max_pending_size = max_pending_size
+        self.encoding = encoding
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='label-writer')
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _queue_for(self, path):
+        with self._lock:
+            if self._closed:
+                raise ValueError('閉じられた FanOutWriter には書き込めません。')
+            file_queue = self._queues.get(path)
+            if file_queue is None:
+                file_queue = _FileQueue(path)
+                self._queues[path] = file_queue
+            return file_queue
+
+    def write(self, path, text):
+        """
+        path へ書き出す文字列をキューに追加します（ディスクへの書き込みは待ちません）。
+        """
+        file_queue = self._queue_for(path)
+        with file_queue.condition:
+            while self.max_pending_size and file_queue.pending_size >= self.max_pending_size and file_queue.error is None:
+                if not file_queue.draining:
+                    self._start_drain(file_queue)
+                file_queue.condition.wait()
+            if file_queue.error is not None:
+                raise IOError(f"'{path}' への書き出し中にエラーが発生しました: {file_queue.error}")
+            file_queue.chunks.append(text)
+            file_queue.pending_size += len(text)
+            if not file_queue.draining and file_queue.pending_size >= self.coalesce_size:
+                self._start_drain(file_queue)
+
+    def write_record(self, path, record, ensure_ascii=False, cache=None):
+        """
+        1レコード（辞書または label_record.SeriesRecord）をJSONLの1行としてキューに追加します。
+        NumPy 配列は label_json で直接文字列化されます。
+        """
+        self.write_records(path, [record], ensure_ascii, cache)
+
+    def write_records(self, path, records, ensure_ascii=False, cache=None):
+        """
+        複数のレコードをJSONLの行としてまとめてキューに追加します（キューへの追加は1回だけ）。
+        """
+        from label_json import dumps
+
+        self.write(path, ''.join([dumps(record, ensure_ascii, cache) + '\n' for record in records]))
+
+    def _start_drain(self, file_queue):
+        # file_queue.condition を保持した状態で呼ぶこと
+        file_queue.draining = True
+        self._executor.submit(self._drain, file_queue)
+
+    def _drain(self, file_queue):
+        while True:
+            with file_queue.condition:
+                if not file_queue.chunks or file_queue.error is not None:
+                    file_queue.draining = False
+                    file_queue.condition.notify_all()
+                    return
+                data = ''.join(file_queue.chunks)
+                file_queue.chunks = []
+                file_queue.pending_size = 0
+                file_queue.condition.notify_all()
+            try:
+                if file_queue.handle is None:
+                    file_queue.handle = open(file_queue.path, 'w', encoding=self.encoding)
+                file_queue.handle.write(data)
+                if self.fsync_policy == 'always':
+                    file_queue.handle.flush()
+                    os.fsync(file_queue.handle.fileno())
+            except OSError as e:
+                with file_queue.condition:
+                    file_queue.error = e
+                    file_queue.draining = False
+                    file_queue.condition.notify_all()
+                return
+
+    def flush(self):
+        """
+        キューにあるすべての内容をファイルに書き出し終わるまで待ちます。
+        """
+        with self._lock:
+            file_queues = list(self._queues.values())
+        for file_queue in file_queues:
+            with file_queue.condition:
+                if file_queue.chunks and not file_queue.draining and file_queue.error is None:
+                    self._start_drain(file_queue)
+        for file_queue in file_queues:
+            with file_queue.condition:
+                while file_queue.draining:
+                    file_queue.condition.wait()
+            if file_queue.handle is not None:
+                file_queue.handle.flush()
+        errors = [f"'{q.path}': {q.error}" for q in file_queues if q.error is not None]
+        if errors:
+            raise IOError('書き出し中にエラーが発生しました: ' + ', '.join(errors))
+
+    def close(self):
+        """
+        すべてを書き出し、fsync の方針に従って同期してからファイルを閉じます。
+        """
+        try:
+            self.flush()
+        finally:
+            with self._lock:
+                self._closed = True
+                file_queues = list(self._queues.values())
+            for file_queue in file_queues:
+                if file_queue.handle is None:
+                    continue
+                if self.fsync_policy != 'never' and file_queue.error is None:
+                    os.fsync(file_queue.handle.fileno())
+                file_queue.handle.close()
+            self._executor.shutdown(wait=True)
+
+    def abort(self):
+        """
+        キューにある内容を捨ててファイルを閉じ、このライターが書き始めたファイルを削除します。
+        処理が途中で失敗したときに、途中までの出力を完成したファイルとして残さないために使います。
+        """
+        with self._lock:
+            self._closed = True
+            file_queues = list(self._queues.values())
+        for file_queue in file_queues:
+            with file_queue.condition:
+                file_queue.chunks = []
+                file_queue.pending_size = 0
+                while file_queue.draining:
+                    file_queue.condition.wait()
+        self._executor.shutdown(wait=True)
+        for file_queue in file_queues:
+            if file_queue.handle is None:
+                continue
+            file_queue.handle.close()
+            try:
+                os.remove(file_queue.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def run_tasks_to_files(task_names, datasets, writer, output_dir='.', batch_size=1024, quarantine_path=None,
+                       statistics=None, renderer=None):
+    """
+    1回の読み込みで複数のタスクを実行し、各タスクの結果をそれぞれの出力ファイルへ書き出します。
+    出力ファイル名は label_tasks.task_output_files() で決まります。処理した件数を返します。
+    quarantine_path を指定すると、各バッチを label_validation で事前に検証し、タスクの条件を
+    満たさないレコードはそのタスクの出力に含めず、理由コード付きで quarantine_path に書き出します。
+    結果は辞書に変換せず、label_json で配列から直接書き出します。
+    statistics（label_stats.LabelStatistics）を渡すと、各バッチの結果でラベルの分布の要約を更新します。
+    renderer（label_render.PromptRenderer）を渡すと、テンプレートのあるタスクの prompt/answer を
+    output_dir の <タスク名>_prompts.jsonl に同じパスで書き出します。
+    """
+    from label_intermediates import generate_labels_memoized
+    from label_json import ArrayTextCache
+    from label_tasks import task_ensure_ascii, task_output_files
+    from label_validation import validate_batch
+
+    output_files = {
+        task_name: os.path.join(output_dir, file_name)
+        for task_name, file_name in task_output_files(task_names).items()
+    }
+    prompt_files = {}
+    if renderer is not None:
+        from label_render import SeriesTextCache, prompt_file_name
+        prompt_files = {
+            task_name: os.path.join(output_dir, prompt_file_name(task_name))
+            for task_name in task_names if task_name in renderer.compiled
+        }
+    processed_count = 0
+    batch = []
+    array_cache = ArrayTextCache()
+
+    def run_batch():
+        series_cache = SeriesTextCache() if prompt_files else None
+        report = validate_batch(batch, task_names) if quarantine_path is not None else None
+        # 共有の中間データは全タスクでレコードごとに1回だけ計算し、結果は SeriesRecord のまま
+        # label_json で書き出す（同じレコードの values の文字列化もタスク間で1回だけ）
+        task_results = generate_labels_memoized(task_names, batch, compact=True, report=report)
+        for task_name in task_names:
+            results = task_results[task_name]
+            if statistics is not None:
+                statistics.update(task_name, results)
+            writer.write_records(output_files[task_name], results, task_ensure_ascii(task_name), array_cache)
+            if task_name in prompt_files:
+                writer.write(prompt_files[task_name], ''.join(
+                    json.dumps(item, ensure_ascii=False) + '\n'
+                    for item in renderer.render_batch(task_name, results, series_cache)))
+        if report is not None:
+            writer.write(quarantine_path, ''.join(
+                json.dumps(entry, ensure_ascii=False) + '\n' for entry in report.quarantine_entries()))
+        array_cache.clear()
+
+    for dataset in datasets:
+        batch.append(dataset)
+        if len(batch) >= batch_size:
+            run_batch()
+            processed_count += len(batch)
+            batch = []
+    if batch:
+        run_batch()
+        processed_count += len(batch)
+    return processed_count
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from label_io import iter_datasets_from_jsonl, open_jsonl_input
+    from label_tasks import TASKS
+
+    parser = argparse.ArgumentParser(description='複数タスクを1回の読み込みで実行し、タスクごとのファイルへ書き出します。')
+    parser.add_argument('input', help="入力JSONLファイル（'-' で標準入力）")
+    parser.add_argument('--tasks', default=','.join(TASKS), help='カンマ区切りのタスク名（既定: すべて）')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--fsync', choices=FSYNC_POLICIES, default='on_close')
+    parser.add_argument('--batch-size', type=int, default=1024)
+    parser.add_argument('--quarantine', default=None, help='事前検証で除外したレコードを書き出すJSONLファイル')
+    parser.add_argument('--stats', default=None, help='ラベルの分布のレポートを書き出すJSONファイル')
+    parser.add_argument('--prompts', action='store_true', help='タスクごとの prompt/answer JSONL も書き出す')
+    args = parser.parse_args()
+
+    selected_tasks = [name for name in args.tasks.split(',') if name]
+    unknown_tasks = [name for name in selected_tasks if name not in TASKS]
+    if unknown_tasks:
+        print(f"エラー: 未知のタスクです: {unknown_tasks}", file=sys.stderr)
+        sys.exit(1)
+
+    label_statistics = None
+    if args.stats is not None:
+        from label_stats import LabelStatistics, write_report
+        label_statistics = LabelStatistics(selected_tasks)
+
+    prompt_renderer = None
+    if args.prompts:
+        from label_render import PromptRenderer
+        prompt_renderer = PromptRenderer()
+
+    with open_jsonl_input(args.input) as infile, FanOutWriter(workers=args.workers, fsync_policy=args.fsync) as fan_out_writer:
+        count = run_tasks_to_files(selected_tasks, iter_datasets_from_jsonl(infile, args.input),
+                                   fan_out_writer, args.output_dir, args.batch_size, args.quarantine,
+                                   label_statistics, prompt_renderer)
+    if label_statistics is not None:
+        write_report(label_statistics, args.stats)
+    print(f"{count} 件を {len(selected_tasks)} タスクで処理しました。", file=sys.stderr)
@@ -0,0 +1,66 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import label_async
+from label_async import alabel_file
+from label_writer import FanOutWriter
+
+# alabel_file が失敗したときに、ライターを閉じて残りのバッチを取り消し、途中までの出力を残さないことのテスト
+
+
+def _write_input(path, count, bad_line=None):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        for index in range(count):
+            if index == bad_line:
+                # 有効なJSONだがオブジェクトではない行（解析の途中で例外になる）
+                outfile.write('123\n')
+                continue
+            outfile.write(json.dumps({'id': f'r{index}', 'values': [index, index + 1.5, index - 2.0]}) + '\n')
+
+
+def test_completed_run_writes_all_records(tmp_path):
+    input_path = str(tmp_path / 'input.jsonl')
+    _write_input(input_path, 50)
+    stats = asyncio.run(alabel_file(input_path, ['max', 'sum'], str(tmp_path), batch_size=8))
+    assert stats['processed_count'] == 50
+    with open(tmp_path / 'max_with_gold.jsonl', encoding='utf-8') as infile:
+        assert [json.loads(line)['id'] for line in infile] == [f'r{index}' for index in range(50)]
+
+
+@pytest.mark.parametrize('bad_line', [3, 45])
+def test_failed_run_removes_partial_output(tmp_path, monkeypatch, bad_line):
+    writers = []
+
+    def eager_writer(**options):
+        # 書き込むたびにディスクへ書き出し、失敗前のバッチが途中までの出力として残る状況を作る
+        writer = FanOutWriter(coalesce_size=1, **options)
+        writers.append(writer)
+        return writer
+
+    monkeypatch.setattr(label_async, 'FanOutWriter', eager_writer)
+    input_path = str(tmp_path / 'input.jsonl')
+    output_dir = tmp_path / 'out'
+    output_dir.mkdir()
+    _write_input(input_path, 200, bad_line)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        with pytest.raises(TypeError):
+            asyncio.run(alabel_file(input_path, ['max', 'sum'], str(output_dir), batch_size=4, max_concurrency=8,
+                                    executor=executor))
+    assert os.listdir(output_dir) == []
+    assert all(file_queue.handle.closed for file_queue in writers[0]._queues.values() if file_queue.handle is not None)
+
+
+def test_abort_keeps_files_it_did_not_create(tmp_path):
+    existing = tmp_path / 'existing.jsonl'
+    existing.write_text('keep\n', encoding='utf-8')
+    writer = FanOutWriter(coalesce_size=1)
+    writer.write(str(tmp_path / 'partial.jsonl'), 'line\n')
+    writer.flush()
+    writer.abort()
+    assert os.listdir(tmp_path) == ['existing.jsonl']
+    with pytest.raises(ValueError):
+        writer.write(str(existing), 'more\n')
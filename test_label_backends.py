@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import find_peaks
+
+from label_backends import _kernel_cases, available_backends, get_kernel, verify_backends
+
+# label_backends の各カーネルを、バックエンド同士、および既存スクリプトが使う関数
+# （scipy.signal.find_peaks、np.max / np.min、pandas の interpolate）と比べるテスト
+
+BACKENDS = available_backends()
+
+
+def _segments(buffer, offsets):
+    return [buffer[offsets[i]:offsets[i + 1]] for i in range(offsets.size - 1)]
+
+
+@pytest.fixture(params=[0, 1, 2])
+def cases(request):
+    return _kernel_cases(request.param)
+
+
+def test_verify_backends_reports_no_mismatch():
+    assert verify_backends() == []
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('sign', [1.0, -1.0])
+def test_extrema_matches_find_peaks(cases, backend, sign):
+    buffer, offsets = cases
+    positions, counts = get_kernel('extrema', backend)(buffer, offsets, sign)
+    assert counts.sum() == positions.size
+    found = np.split(positions, np.cumsum(counts)[:-1])
+    for start, segment, segment_positions in zip(offsets[:-1], _segments(buffer, offsets), found):
+        expected, _ = find_peaks(sign * segment)
+        np.testing.assert_array_equal(segment_positions - start, expected)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_extrema_matches_legacy_peak_and_dip(backend):
+    from generate_dip_label import generate_peaks_and_create_dictionary as legacy_dip
+    from generate_peak_label import generate_peaks_and_create_dictionary as legacy_peak
+
+    buffer, offsets = _kernel_cases(3)
+    buffer = np.nan_to_num(buffer, nan=1.0, posinf=4.0)
+    extrema = get_kernel('extrema', backend)
+    for sign, legacy, key in [(1.0, legacy_peak, 'calculated_peak_values'), (-1.0, legacy_dip, 'calculated_values')]:
+        positions, counts = extrema(buffer, offsets, sign)
+        found = np.split(positions, np.cumsum(counts)[:-1])
+        for segment, segment_positions in zip(_segments(buffer, offsets), found):
+            if segment.size == 0:
+                continue
+            legacy_result = legacy({'id': 'x', 'values': segment.tolist()})
+            assert buffer[segment_positions].tolist() == legacy_result[key]
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+@pytest.mark.parametrize('window', [1, 2, 3, 5])
+@pytest.mark.parametrize('use_max', [True, False])
+def test_rolling_extrema_matches_numpy_windows(cases, backend, window, use_max):
+    buffer, offsets = cases
+    actual = get_kernel('rolling_extrema', backend)(buffer, offsets, window, use_max)
+    reduce_window = np.max if use_max else np.min
+    expected = [reduce_window(sliding_window_view(segment, window), axis=1)
+                for segment in _segments(buffer, offsets) if segment.size >= window]
+    expected = np.concatenate(expected) if expected else np.zeros(0)
+    np.testing.assert_array_equal(actual, expected)
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_interpolate_matches_pandas(cases, backend):
+    buffer, offsets = cases
+    buffer = np.where(np.isinf(buffer), 3.0, buffer)
+    actual = get_kernel('interpolate', backend)(buffer, offsets)
+    for start, segment in zip(offsets[:-1], _segments(buffer, offsets)):
+        expected = pd.Series(segment).interpolate(method='linear').to_numpy()
+        np.testing.assert_allclose(actual[start:start + segment.size], expected, rtol=1e-12, atol=0.0)
+
+
+@pytest.mark.parametrize('kernel_name', ['extrema', 'rolling_extrema', 'interpolate'])
+def test_backends_agree_exactly(cases, kernel_name):
+    buffer, offsets = cases
+    arguments = {
+        'extrema': (buffer, offsets, 1.0),
+        'rolling_extrema': (buffer, offsets, 4, True),
+        'interpolate': (np.where(np.isinf(buffer), 3.0, buffer), offsets),
+    }[kernel_name]
+    reference = get_kernel(kernel_name, 'numpy')(*arguments)
+    for backend in BACKENDS:
+        expected, actual = reference, get_kernel(kernel_name, backend)(*arguments)
+        if not isinstance(expected, tuple):
+            expected, actual = (expected,), (actual,)
+        for e, a in zip(expected, actual):
+            np.testing.assert_array_equal(a, e)
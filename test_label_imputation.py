@@ -0,0 +1,41 @@
+import json
+import os
+
+from label_imputation import generate_gap_imputation_and_create_dictionary
+from label_intermediates import generate_labels_memoized
+from label_shard import run_local
+from label_tasks import generate_labels, generate_labels_deterministic
+
+# gapimp の欠損区間が、どの経路（1レコード、バッチカーネル、シャード）でも同じ base_seed から決まることのテスト
+
+
+def _datasets(count=30):
+    return [{'id': f'g{index}', 'values': [float(index + step * step) for step in range(12)]} for index in range(count)]
+
+
+def _gaps(results):
+    return [result['nan_gaps'] for result in results]
+
+
+def test_batch_kernel_uses_base_seed():
+    datasets = _datasets()
+    for base_seed in [0, 7, 12345]:
+        expected = _gaps(generate_gap_imputation_and_create_dictionary(dataset, base_seed=base_seed) for dataset in datasets)
+        assert _gaps(generate_labels('gapimp', datasets, base_seed)) == expected
+        assert _gaps(generate_labels_deterministic('gapimp', datasets, base_seed)) == expected
+        assert _gaps(generate_labels_memoized(['gapimp'], datasets, base_seed)['gapimp']) == expected
+    assert _gaps(generate_labels_deterministic('gapimp', datasets, 7)) != _gaps(generate_labels('gapimp', datasets))
+
+
+def test_shard_seed_reaches_gapimp(tmp_path):
+    datasets = _datasets(12)
+    input_path = str(tmp_path / 'input.jsonl')
+    with open(input_path, 'w', encoding='utf-8') as outfile:
+        for dataset in datasets:
+            outfile.write(json.dumps(dataset) + '\n')
+    output_dir = str(tmp_path / 'out')
+    run_local(input_path, 3, str(tmp_path / 'work'), ['gapimp'], output_dir, seed=7)
+    with open(os.path.join(output_dir, 'gap_interpolation_output.jsonl'), encoding='utf-8') as infile:
+        actual = {record['id']: record['nan_gaps'] for record in map(json.loads, infile)}
+    assert actual == {dataset['id']: generate_gap_imputation_and_create_dictionary(dataset, base_seed=7)['nan_gaps']
+                      for dataset in datasets}
@@ -0,0 +1,109 @@
+import contextlib
+import io
+import json
+import math
+
+import numpy as np
+import pytest
+
+from generate_dip_label import generate_peaks_and_create_dictionary as legacy_dip
+from generate_fcst_label import generate_regression_prediction_and_create_dictionary as legacy_fcst
+from generate_max_label import generate_gold_and_create_dictionary as legacy_max
+from generate_min_label import generate_gold_and_create_dictionary as legacy_min
+from generate_peak_label import generate_peaks_and_create_dictionary as legacy_peak
+from generate_sum_label import generate_gold_and_create_dictionary as legacy_sum
+from label_incremental import IncrementalSeriesState, build_state_from_dataset
+
+# 1点ずつ追加した IncrementalSeriesState のラベルを、全件の再計算（既存の generate_*_label.py）と比べるテスト
+
+
+def _series(seed, length):
+    rng = np.random.default_rng(seed)
+    kind = seed % 3
+    if kind == 0:
+        values = rng.normal(100.0, 30.0, length).round(1)
+    elif kind == 1:
+        # 足す順序で float の和が変わる、桁の大きく異なる値
+        values = rng.choice([1e17, -1e17, 1.0, 3.0, -2.5, 0.1], length) * rng.integers(1, 4, length)
+    else:
+        values = rng.integers(0, 5, length).astype(float)
+    years = [str(1900 + index) for index in range(length)]
+    return values.tolist(), years
+
+
+def _legacy(function, values, years=None):
+    dataset = {'id': 'x', 'values': values}
+    if years is not None:
+        dataset['years_column'] = years
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(dataset)
+
+
+def _appended(values, years):
+    state = IncrementalSeriesState('x')
+    for value, year in zip(values, years):
+        state.append(value, year)
+    return state
+
+
+@pytest.mark.parametrize('seed', range(9))
+def test_labels_after_many_appends_match_full_recomputation(seed):
+    values, years = _series(seed, 200 + 150 * seed)
+    state = _appended(values, years)
+    # 途中で保存・復元しても同じ
+    state = IncrementalSeriesState.from_dict(json.loads(json.dumps(state.to_dict())))
+    labels = state.labels()
+
+    # sum は正確な和を正しく丸めた値。np.sum とはその丸め誤差（n * eps * sum|x| 以下）の範囲で一致する
+    assert labels['sum'] == math.fsum(values)
+    assert labels['ave'] == math.fsum(values) / len(values)
+    legacy_total = _legacy(legacy_sum, values)['calculated_gold_value']
+    assert abs(labels['sum'] - legacy_total) <= len(values) * np.finfo(float).eps * math.fsum(map(abs, values))
+
+    assert labels['max'] == _legacy(legacy_max, values)['calculated_gold_value']
+    assert labels['min'] == _legacy(legacy_min, values)['calculated_gold_value']
+    assert labels['peak'] == _legacy(legacy_peak, values)['calculated_peak_values']
+    assert labels['dip'] == _legacy(legacy_dip, values)['calculated_values']
+
+    expected = _legacy(legacy_fcst, values, years)
+    assert labels['fcst']['next_year_for_prediction'] == expected['next_year_for_prediction']
+    assert labels['fcst']['calculated_next_value_regression'] == pytest.approx(
+        expected['calculated_next_value_regression'], rel=1e-9, abs=1e-9 * max(map(abs, values)))
+
+
+def test_sum_does_not_depend_on_append_order():
+    values, years = _series(1, 500)
+    forward = _appended(values, years).labels()['sum']
+    backward = _appended(values[::-1], years[::-1]).labels()['sum']
+    assert forward == backward == math.fsum(values)
+
+
+@pytest.mark.parametrize('values', [
+    [1.0, math.inf, 2.0],
+    [1.0, -math.inf, 2.0],
+    [math.inf, 1.0, -math.inf],
+    [1.0, math.nan, 2.0],
+    [1.7976931348623157e308, 1.7976931348623157e308],
+])
+def test_non_finite_sums_match_np_sum(values):
+    state = IncrementalSeriesState()
+    state.extend(values)
+    with np.errstate(over='ignore', invalid='ignore'):
+        expected = np.sum(values)
+    assert np.array_equal(state.labels()['sum'], expected, equal_nan=True)
+
+
+@pytest.mark.filterwarnings('ignore:Polyfit may be poorly conditioned')
+@pytest.mark.parametrize('years', [['2019'] * 3, [0, 0, 0]])
+def test_constant_years_match_legacy_fcst(years):
+    values = [1.0, 2.0, 4.0]
+    expected = _legacy(legacy_fcst, values, years)
+    labels = build_state_from_dataset({'id': 'x', 'values': values, 'years_column': years}).labels()['fcst']
+    assert labels.get('regression_error') == expected.get('regression_error')
+    if expected.get('calculated_next_value_regression') is not None:
+        assert labels['calculated_next_value_regression'] == pytest.approx(expected['calculated_next_value_regression'])
+
+
+def test_legacy_state_without_exact_sum_is_restored():
+    state = IncrementalSeriesState.from_dict({'count': 2, 'sum': 3.5, 'sum_compensation': 1e-17})
+    assert state.labels()['sum'] == 3.5
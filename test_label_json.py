@@ -0,0 +1,27 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from label_json import dumps
+
+# label_json の出力が json.dumps とバイト単位で一致すること（str 以外のキーを含む）のテスト
+
+KEYS = [2, -7, 1.5, -0.0, 1e20, math.inf, math.nan, True, False, None, 'ü']
+
+
+@pytest.mark.parametrize('ensure_ascii', [False, True])
+def test_non_string_keys_match_json_dumps(ensure_ascii):
+    plain = {key: index for index, key in enumerate(KEYS)}
+    plain['values'] = [1.0, 2.5]
+    with_array = {**plain, 'values': np.array([1.0, 2.5])}
+    assert dumps(with_array, ensure_ascii) == json.dumps(plain, ensure_ascii=ensure_ascii)
+
+
+def test_unsupported_key_is_rejected_like_json_dumps():
+    record = {(1, 2): 'tuple', 'values': np.array([1.0])}
+    with pytest.raises(TypeError):
+        json.dumps({(1, 2): 'tuple'})
+    with pytest.raises(TypeError):
+        dumps(record)
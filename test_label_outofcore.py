@@ -0,0 +1,63 @@
+import json
+
+import numpy as np
+import pytest
+
+import label_outofcore
+from label_outofcore import evaluate_chunked_series, generate_out_of_core_record, iter_json_array_chunks
+
+# label_outofcore が最上位のオブジェクトの配列だけを読み、入れ子や文字列の中の同じ名前のキーを無視することのテスト
+
+
+def _write(tmp_path, text):
+    path = tmp_path / 'record.json'
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def _read(path, key='values', chunk_size=3):
+    chunks = list(iter_json_array_chunks(path, key, chunk_size))
+    return np.concatenate(chunks).tolist() if chunks else []
+
+
+RECORD = {
+    'id': 'x',
+    'note': 'the "values": [9, 9] and [{ brackets in a string \\" "values": [8]',
+    'meta': {'values': [100.0, 200.0], 'inner': [{'years_column': ['1900']}]},
+    'values': [1.0, 5.0, 2.0, '4.5', 3.0],
+    'years_column': ['2019', '2020', '2021', '2022', '2023'],
+}
+
+
+@pytest.mark.parametrize('block_size', [1 << 24, 7, 16, 33])
+def test_nested_and_quoted_keys_are_ignored(tmp_path, monkeypatch, block_size):
+    # ブロックを小さくして、キーや文字列がブロックの境界をまたぐ場合も確かめる
+    monkeypatch.setattr(label_outofcore, '_READ_BLOCK_SIZE', block_size)
+    path = _write(tmp_path, json.dumps(RECORD))
+    assert _read(path) == [1.0, 5.0, 2.0, 4.5, 3.0]
+    assert _read(path, 'years_column') == [2019.0, 2020.0, 2021.0, 2022.0, 2023.0]
+
+    record = generate_out_of_core_record(path, thresholds=[2.5], chunk_size=2)
+    assert record['meta'] == RECORD['meta']
+    assert record['note'] == RECORD['note']
+    assert record['labels']['max']['calculated_gold_value'] == 5.0
+    assert record['labels']['fcst']['next_year_for_prediction'] == 2024.0
+
+
+def test_key_only_in_nested_object_is_not_found(tmp_path):
+    path = _write(tmp_path, json.dumps({'id': 'x', 'meta': {'values': [1, 2]}, 'data': [{'values': [3]}]}))
+    with pytest.raises(KeyError):
+        _read(path)
+
+
+def test_backslashes_before_quotes(tmp_path):
+    path = _write(tmp_path, json.dumps({'a': 'ends with \\\\', 'b': '\\\\\\" "values": [7]', 'values': [1, 2]}))
+    assert _read(path) == [1.0, 2.0]
+
+
+def test_years_running_out_before_values_is_a_length_mismatch(tmp_path):
+    path = _write(tmp_path, json.dumps({'id': 'x', 'values': [1, 2, 3, 4], 'years_column': ['1', '2']}))
+    with pytest.raises(ValueError):
+        generate_out_of_core_record(path, thresholds=[1.5], chunk_size=2)
+    with pytest.raises(ValueError):
+        evaluate_chunked_series(iter([np.ones(2)]), iter([np.ones(2), np.ones(2)]))
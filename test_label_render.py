@@ -0,0 +1,27 @@
+from label_render import PromptRenderer, SeriesTextCache
+from label_tasks import generate_labels
+
+# label_render の系列の本文のキャッシュが、id ではなく系列の内容ごとに使い回されることのテスト
+
+
+def test_duplicate_ids_get_their_own_series():
+    datasets = [{'id': 'dup', 'values': [1.0, 5.0], 'years_column': ['2019', '2020']},
+                {'id': 'dup', 'values': [7.0, 2.0], 'years_column': ['2019', '2020']}]
+    renderer = PromptRenderer()
+    cache = SeriesTextCache()
+    items = renderer.render_batch('max', generate_labels('max', datasets), cache)
+    assert items[0]['prompt'].startswith('2019: 1\n2020: 5\n')
+    assert items[1]['prompt'].startswith('2019: 7\n2020: 2\n')
+    # 同じバッチの別のタスクでも、それぞれの系列の本文が使われる
+    items = renderer.render_batch('min', generate_labels('min', datasets[::-1]), cache)
+    assert items[0]['prompt'].startswith('2019: 7\n')
+    assert items[1]['prompt'].startswith('2019: 1\n')
+
+
+def test_equal_values_of_different_types_are_not_shared():
+    cache = SeriesTextCache()
+    assert cache.get({'values': [1.5], 'years_column': [2019]}, 'values') == '2019: 1.5'
+    assert cache.get({'values': [1.5], 'years_column': [2019.0]}, 'values') == '2019.0: 1.5'
+    assert cache.get({'values': [True, 2]}, 'values') == 'True, 2'
+    assert cache.get({'values': [1, 2]}, 'values') == '1, 2'
+    assert cache.get({'values': [[1], 2]}, 'values') == '[1], 2'
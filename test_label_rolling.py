@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+from label_rolling import ROLLING_FIELDS, batch_rolling_statistics, generate_rolling_statistics_and_create_dictionary
+
+# label_rolling の出力が、値の有無や長さによらず同じキーを持つことと、窓ごとに直接計算した値と一致することのテスト
+
+
+@pytest.mark.parametrize('dataset', [
+    {'id': 'missing'},
+    {'id': 'empty', 'values': []},
+    {'id': 'short', 'values': [1.0, 2.0]},
+    {'id': 'long', 'values': [1.0, 2.0, 4.0, 8.0]},
+])
+def test_every_path_returns_all_rolling_fields(dataset):
+    result = generate_rolling_statistics_and_create_dictionary(dataset)
+    assert set(ROLLING_FIELDS) <= set(result)
+    assert len({len(result[field]) for field in ROLLING_FIELDS}) == 1
+    assert result['rolling_window'] == 3
+
+
+def test_batch_matches_direct_windows():
+    datasets = [{'id': 'e', 'values': []}, {'id': 'a', 'values': [3.0, 1.0, 4.0, 1.0, 5.0, 9.0]},
+                {'id': 's', 'values': [2.0]}]
+    results = batch_rolling_statistics(datasets, generate_rolling_statistics_and_create_dictionary)
+    windows = np.lib.stride_tricks.sliding_window_view(np.array(datasets[1]['values']), 3)
+    expected = {'mean': windows.mean(axis=1), 'sum': windows.sum(axis=1), 'max': windows.max(axis=1),
+                'min': windows.min(axis=1), 'std': windows.std(axis=1)}
+    for field, name in ROLLING_FIELDS.items():
+        np.testing.assert_allclose(results[1][field], expected[name], rtol=1e-12)
+        assert results[0][field] == results[2][field] == []
@@ -0,0 +1,60 @@
+import json
+import os
+
+import pytest
+
+from label_shard import create_shards, merge_shards, run_shard
+
+# 作業ディレクトリを使い回したときに、前の実行のシャードが結合されないことのテスト
+
+
+def _write_input(path, count):
+    with open(path, 'w', encoding='utf-8') as outfile:
+        for index in range(count):
+            record = {'id': f'r{index}', 'values': [index, index + 2.5, index - 1.0], 'years_column': ['19', '18', '17']}
+            outfile.write(json.dumps(record) + '\n')
+
+
+def _run(input_path, num_shards, work_dir, output_dir, overwrite=False):
+    for manifest_path in create_shards(input_path, num_shards, work_dir, ['max'], overwrite=overwrite):
+        run_shard(manifest_path)
+    merge_shards(work_dir, output_dir)
+    with open(os.path.join(output_dir, 'max_with_gold.jsonl'), encoding='utf-8') as infile:
+        return [json.loads(line)['id'] for line in infile]
+
+
+def test_reused_work_dir_requires_overwrite(tmp_path):
+    input_path = str(tmp_path / 'input.jsonl')
+    work_dir = str(tmp_path / 'work')
+    _write_input(input_path, 40)
+    expected = [f'r{index}' for index in range(40)]
+    assert _run(input_path, 4, work_dir, str(tmp_path / 'out4')) == expected
+
+    with pytest.raises(FileExistsError):
+        create_shards(input_path, 2, work_dir, ['max'])
+    assert _run(input_path, 2, work_dir, str(tmp_path / 'out2'), overwrite=True) == expected
+    assert sorted(os.listdir(os.path.join(work_dir, 'manifests'))) == ['shard-0000.json', 'shard-0001.json']
+
+
+def test_merge_rejects_stale_manifest(tmp_path):
+    input_path = str(tmp_path / 'input.jsonl')
+    work_dir = str(tmp_path / 'work')
+    _write_input(input_path, 10)
+    _run(input_path, 2, work_dir, str(tmp_path / 'out'))
+
+    stale_path = os.path.join(work_dir, 'manifests', 'shard-0002.json')
+    with open(stale_path, 'w', encoding='utf-8') as outfile:
+        json.dump({'run_id': 'old', 'shard_index': 2, 'num_shards': 3}, outfile)
+    with pytest.raises(RuntimeError):
+        merge_shards(work_dir, str(tmp_path / 'out'))
+
+
+def test_merge_rejects_changed_input(tmp_path):
+    input_path = str(tmp_path / 'input.jsonl')
+    work_dir = str(tmp_path / 'work')
+    _write_input(input_path, 10)
+    _run(input_path, 2, work_dir, str(tmp_path / 'out'))
+
+    _write_input(input_path, 12)
+    with pytest.raises(RuntimeError):
+        merge_shards(work_dir, str(tmp_path / 'out'))
@@ -0,0 +1,63 @@
+import json
+import math
+from fractions import Fraction
+
+import numpy as np
+import pytest
+
+from label_stats import LabelStatistics, QuantileSketch
+
+# label_stats の要約の結合が、分割の仕方や結合の順序によらず1回で数えた結果と一致することのテスト
+
+
+def _wide_values(seed, count=600):
+    # 足す順序で float の和が変わる、桁の大きく異なる値
+    rng = np.random.default_rng(seed)
+    values = rng.choice([1e17, -1e17, 1.0, 3.0, -2.5, 0.1, 1e-3, 7e15], count) * rng.integers(1, 5, count)
+    return values.tolist()
+
+
+def _results(values):
+    return [{'id': index, 'calculated_gold_value': value} for index, value in enumerate(values)]
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2, 3])
+def test_merge_in_any_order_equals_single_pass(seed):
+    values = _wide_values(seed)
+    single = LabelStatistics(['sum'])
+    single.update('sum', _results(values))
+    expected = single.report()
+
+    rng = np.random.default_rng(seed + 100)
+    for _ in range(5):
+        cut_points = sorted(rng.choice(np.arange(1, len(values)), size=6, replace=False).tolist())
+        parts = [values[start:end] for start, end in zip([0] + cut_points, cut_points + [len(values)])]
+        shards = []
+        for part in parts:
+            shard = LabelStatistics(['sum'])
+            shard.update('sum', _results(part))
+            # シャードの要約は JSON で保存してから読み込まれる
+            shards.append(LabelStatistics.from_dict(json.loads(json.dumps(shard.to_dict()))))
+        merged = LabelStatistics(['sum'])
+        for index in rng.permutation(len(shards)).tolist():
+            merged.merge(shards[index])
+        assert merged.report() == expected
+
+
+def test_total_is_the_correctly_rounded_exact_sum():
+    values = _wide_values(7)
+    sketch = QuantileSketch()
+    sketch.add(values)
+    assert sketch.total == float(sum(Fraction(value) for value in values))
+    assert sketch.total == math.fsum(values)
+
+
+def test_total_overflow_and_old_state():
+    sketch = QuantileSketch()
+    sketch.add([1.7976931348623157e308, 1.7976931348623157e308])
+    assert sketch.total == math.inf
+
+    state = QuantileSketch().to_dict()
+    del state['exact_total']
+    state['total'] = 2.5
+    assert QuantileSketch.from_dict(state).total == 2.5
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from generate_fcst_label import generate_regression_prediction_and_create_dictionary as generate_fcst
+from label_backtest import generate_backtest_and_create_dictionary
+from label_timeaxis import generate_argmintime_and_create_dictionary, get_time_axis, resolve_year
+
+# label_timeaxis の年の解釈（2桁の年の世紀の補い方、数値・小数の年の扱い）のテスト
+
+
+def _two_digit_axis(first_year, last_year):
+    # 既存のデータと同じ、新しい年から並ぶ2桁の years_column
+    return [f'{year % 100:02d}' for year in range(last_year, first_year - 1, -1)]
+
+
+def _legacy_fcst_prediction(values, years):
+    # 既存の fcst と同じく、年を float に変換して np.polyfit で当てはめた次の年の予測
+    years = np.array(years, dtype=float)
+    slope, intercept = np.polyfit(years, np.array(values, dtype=float), 1)
+    return float(slope * (np.max(years) + 1) + intercept)
+
+
+def test_descending_two_digit_axis_crosses_the_century():
+    time_axis = get_time_axis(_two_digit_axis(1950, 2019))
+    assert time_axis.years.tolist() == list(range(2019, 1949, -1))
+
+
+@pytest.mark.parametrize('tokens, expected', [
+    (['99', '00', '01'], [1999, 2000, 2001]),
+    (['01', '00', '99'], [2001, 2000, 1999]),
+    (['75', '74', '73'], [1975, 1974, 1973]),
+    (['19'], [2019]),
+    (['2019*', '2018', '17'], [2019, 2018, 2017]),
+])
+def test_two_digit_years_resolve_per_column(tokens, expected):
+    assert get_time_axis(tokens).years.tolist() == expected
+
+
+def test_single_token_uses_pivot():
+    assert resolve_year('68') == 2068
+    assert resolve_year('69') == 1969
+
+
+@pytest.mark.parametrize('tokens', [
+    [2018.0, 2018.25, 2018.5, 2018.75],
+    [1, 2, 3, 4],
+    ['2018.5', '2019', '2019.5', '2020'],
+])
+def test_numeric_and_fractional_years_are_kept(tokens):
+    time_axis = get_time_axis(tokens)
+    assert time_axis.all_valid
+    np.testing.assert_array_equal(time_axis.years.astype(float), np.array(tokens, dtype=float))
+
+
+def test_argmintime_on_two_digit_axis():
+    years = _two_digit_axis(1950, 2019)
+    values = list(range(2019, 1949, -1))
+    result = generate_argmintime_and_create_dictionary({'id': 'a', 'values': values, 'years_column': years})
+    assert result['calculated_gold_value'] == 1950
+
+
+def test_fcst_on_two_digit_axis_predicts_the_next_year():
+    years = _two_digit_axis(1950, 2019)
+    values = [2.0 * year - 100.0 for year in range(2019, 1949, -1)]
+    result = generate_fcst({'id': 'a', 'values': values, 'years_column': years})
+    assert result['next_year_for_prediction'] == 2020.0
+    assert result['calculated_next_value_regression'] == pytest.approx(3940.0)
+
+
+@pytest.mark.parametrize('years', [
+    [2018.0, 2018.25, 2018.5, 2018.75],
+    [1, 2, 3, 4],
+    ['2018.5', '2019', '2019.5', '2020'],
+])
+def test_fcst_matches_legacy_on_numeric_years(years):
+    values = [3.0, 5.0, 4.0, 9.0]
+    result = generate_fcst({'id': 'a', 'values': values, 'years_column': years})
+    assert result['calculated_next_value_regression'] == _legacy_fcst_prediction(values, years)
+    assert result['years_for_regression'] == np.array(years, dtype=float).tolist()
+
+
+def test_backtest_keeps_fractional_years():
+    years = [2018.0, 2018.25, 2018.5, 2018.75, 2019.0]
+    result = generate_backtest_and_create_dictionary({'id': 'a', 'values': [1, 2, 3, 4, 5], 'years_column': years})
+    assert result['years_for_regression'] == years
+    assert result['backtest_mae'] == pytest.approx(0.0, abs=1e-9)